@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Routines to combine many Geocat hdf4 granules into netCDF4 files along an unlimited time dimension.
+
+Granules are grouped by their schema (the variables, shapes, types and attributes left after
+compliance_cleanup), and each group is written to a single output file. The time of each granule
+comes from the Image_Date_Time attribute made by compliance_cleanup. Data is appended granule by
+granule, one block at a time, so the whole group never has to be in memory.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os, logging, re
+from datetime import datetime, timedelta
+from constants import *
+from schema_cache import schema_signature, get_schema_cache
+from subset import subset_file_info
+from convert import clean_path, read_hdf4_info, compliance_cleanup, determine_dimensions, storage_settings_for_variable, \
+                    packing_for_variable, read_file_blocks, read_ahead, temporary_output_path, image_datetime, \
+                    hdf4_numpy_type
+
+from netCDF4 import Dataset
+from pyhdf.SD import SD, SDC, HDF4Error
+
+LOG = logging.getLogger(__name__)
+
+# the epoch for the time variable
+TIME_EPOCH = datetime(1970, 1, 1)
+
+def granule_time (in_file_info) :
+    """
+    get the time of a granule in seconds since TIME_EPOCH, from the Image_Date_Time attribute set by compliance_cleanup
+    """
+
+    datetime_obj = datetime.strptime(in_file_info[GLOBAL_ATTRS_KEY][IMAGE_DATETIME_ATTR_NAME], ISO_OUT_TIME_FORMAT)
+
+    return (datetime_obj - TIME_EPOCH).total_seconds()
+
+# the compiled FILE_NAME_TIME_PATTERN
+_FILE_NAME_TIME_RE = re.compile(FILE_NAME_TIME_PATTERN)
+
+def file_name_datetime (file_path) :
+    """
+    get the image date and time from the name of a Geocat file (see FILE_NAME_TIME_PATTERN),
+    or None if the name doesn't have one
+    """
+
+    time_match = _FILE_NAME_TIME_RE.search(os.path.split(file_path)[1])
+    if time_match is None :
+        return None
+
+    try :
+        return datetime.strptime(time_match.group(1) + time_match.group(2), FILE_NAME_TIME_FORMAT)
+    except ValueError :
+        return None
+
+def granule_order_key (file_path) :
+    """
+    get a key to sort granules into time order by, from the image time in their file names; only files
+    without one in their name are opened to read the image date and time from their global attributes;
+    files whose time can't be found sort last (in path order), so they are reported when they are aggregated
+    """
+
+    name_datetime = file_name_datetime(file_path)
+    if name_datetime is not None :
+        return name_datetime, file_path
+
+    try :
+        in_file_obj = SD(file_path, SDC.READ)
+        try :
+            return image_datetime(in_file_obj.attributes()), file_path
+        finally :
+            in_file_obj.end()
+    except Exception :
+        return datetime.max, file_path
+
+def aggregate_file_path (out_path, first_file_path) :
+    """
+    figure out the path of the aggregate output file for a group, based on the first granule in the group
+    """
+
+    first_file_name = os.path.splitext(os.path.split(first_file_path)[1])[0]
+
+    return os.path.join(clean_path(out_path), first_file_name + AGGREGATE_FILE_SUFFIX + OUT_FILE_SUFFIX)
+
+def create_aggregate_file (output_path, in_file_info, schema_cache=None) :
+    """
+    create an aggregate output file for granules with the same schema as in_file_info, with the dimensions
+    and global attributes of the granules plus time and source file variables to record which granule
+    each time step came from (the data variables are created when the first granule is added)
+
+    returns the open output file
+    """
+
+    out_file = Dataset(output_path, mode='w', format='NETCDF4', clobber=True)
+
+    try :
+        # the dimensions are the usual ones for the granules, plus time
+        dimensions_info, variable_dimensions_info = determine_dimensions(in_file_info, schema_cache=schema_cache)
+        out_file.createDimension(TIME_DIM_NAME, None)
+        for dim_name in dimensions_info.keys() :
+            out_file.createDimension(dim_name, dimensions_info[dim_name])
+
+        # the global attributes come from the first granule, except for its time
+        global_attrs_temp = in_file_info[GLOBAL_ATTRS_KEY]
+        for attr_key in sorted(global_attrs_temp.keys()) :
+            if attr_key != IMAGE_DATETIME_ATTR_NAME :
+                setattr(out_file, attr_key, global_attrs_temp[attr_key])
+
+        # variables to describe the time steps
+        time_var_obj = out_file.createVariable(TIME_VAR_NAME, "f8", (TIME_DIM_NAME,))
+        time_var_obj.units         = TIME_UNITS
+        time_var_obj.standard_name = "time"
+        time_var_obj.long_name     = "granule image time"
+        source_var_obj = out_file.createVariable(SOURCE_FILE_VAR_NAME, str, (TIME_DIM_NAME,))
+        source_var_obj.long_name   = "name of the input granule for each time"
+    except BaseException :
+        # don't leave the partly made file open
+        out_file.close()
+        raise
+
+    return out_file
+
+def create_aggregate_variable (out_file, var_name, data_type, var_dims, dimensions_info, in_file_info,
+                               compression_level=DEFAULT_COMPRESSION_LEVEL, storage_settings=None) :
+    """
+    create a data variable in an aggregate file, with the time dimension in front of its usual dimensions and
+    the same storage settings it would usually have, but with one time step per chunk
+    """
+
+    var_shape   = in_file_info[VAR_INFO_KEY][var_name][SHAPE_KEY]
+    var_storage = storage_settings_for_variable(var_name, var_dims, dimensions_info, compression_level,
+                                                storage_settings, var_shape)
+    var_storage[CHUNKSIZES_KEY] = (1,) + tuple(var_storage[CHUNKSIZES_KEY] if CHUNKSIZES_KEY in var_storage
+                                               else [max(1, dim_size) for dim_size in var_shape])
+
+    # the data range of later granules isn't known yet, so variables are never narrowed here
+    data_type, variable_attr_info, var_storage = packing_for_variable(var_name, data_type,
+                                                                      in_file_info[VAR_INFO_KEY][var_name][VAR_ATTRS_KEY],
+                                                                      var_storage)
+    fill_value_temp = variable_attr_info[FILL_VALUE_KEY] if FILL_VALUE_KEY in variable_attr_info else None
+
+    out_var_obj = out_file.createVariable(var_name, data_type, (TIME_DIM_NAME,) + tuple(var_dims),
+                                          fill_value=fill_value_temp, **var_storage)
+    out_var_obj.set_auto_maskandscale(False)
+    for attr_key in sorted(variable_attr_info.keys()) :
+        if attr_key != FILL_VALUE_KEY :
+            setattr(out_var_obj, attr_key, variable_attr_info[attr_key])
+
+    return out_var_obj
+
+def append_granule (out_file, in_file_obj, in_file_info, file_path, time_index=None,
+                    copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE, compression_level=DEFAULT_COMPRESSION_LEVEL,
+                    storage_settings=None, schema_cache=None, read_ahead_size=0) :
+    """
+    add a granule as time step time_index (by default the next one) of an aggregate output file, copying
+    its data one block at a time
+
+    the time and source file of the step are only recorded once all of the granule's data is written, so a
+    granule that fails part way through can be written over by the next one (see aggregate_files)
+    """
+
+    dimensions_info, variable_dimensions_info = determine_dimensions(in_file_info, schema_cache=schema_cache)
+
+    if time_index is None :
+        time_index = len(out_file.dimensions[TIME_DIM_NAME])
+
+    # the data variables are created with the first granule, including any with no data (no lines)
+    for var_name in variable_dimensions_info.keys() :
+        if var_name not in out_file.variables :
+            create_aggregate_variable(out_file, var_name, hdf4_numpy_type(in_file_info[VAR_INFO_KEY][var_name][DATA_TYPE_KEY]),
+                                      variable_dimensions_info[var_name], dimensions_info, in_file_info,
+                                      compression_level, storage_settings)
+
+    data_blocks = read_file_blocks(in_file_obj, in_file_info, list(variable_dimensions_info.keys()), copy_buffer_size)
+    if read_ahead_size :
+        data_blocks = read_ahead(data_blocks, read_ahead_size)
+
+    for var_name, start_line, raw_data in data_blocks :
+        out_file.variables[var_name][time_index, start_line:start_line + raw_data.shape[0]] = raw_data
+
+    out_file.variables[TIME_VAR_NAME][time_index]        = granule_time(in_file_info)
+    out_file.variables[SOURCE_FILE_VAR_NAME][time_index] = os.path.split(file_path)[1]
+
+def _discard_aggregate_file (out_file, temp_file_path) :
+    """
+    close an aggregate file that won't be finished and remove it
+    """
+
+    try :
+        out_file.close()
+    except Exception :
+        pass
+    if os.path.exists(temp_file_path) :
+        os.remove(temp_file_path)
+
+def _truncate_aggregate_file (temp_file_path, num_steps) :
+    """
+    cut a closed aggregate file down to its first num_steps time steps, dropping the partly written step left
+    at the end by a granule that couldn't be added; netCDF4 can't shrink a dimension, so the steps are copied
+    to a new file one at a time, with the same variables and storage settings, which then replaces the old one
+    """
+
+    truncated_path = temp_file_path + ".truncated"
+    old_file = Dataset(temp_file_path, mode='r')
+    new_file = Dataset(truncated_path, mode='w', format='NETCDF4', clobber=True)
+    try :
+        for dim_name, dim_obj in old_file.dimensions.items() :
+            new_file.createDimension(dim_name, None if dim_obj.isunlimited() else len(dim_obj))
+        new_file.setncatts(dict((attr_key, old_file.getncattr(attr_key)) for attr_key in old_file.ncattrs()))
+
+        for var_name, old_var_obj in old_file.variables.items() :
+            old_var_obj.set_auto_maskandscale(False)
+            var_attrs    = dict((attr_key, old_var_obj.getncattr(attr_key)) for attr_key in old_var_obj.ncattrs())
+            var_filters  = old_var_obj.filters() or { }
+            var_chunking = old_var_obj.chunking()
+            new_var_obj  = new_file.createVariable(var_name, old_var_obj.datatype, old_var_obj.dimensions,
+                                                   fill_value=var_attrs.pop("_FillValue", None),
+                                                   zlib=var_filters.get(ZLIB_KEY, False),
+                                                   complevel=var_filters.get(COMPLEVEL_KEY, 4),
+                                                   shuffle=var_filters.get(SHUFFLE_KEY, False),
+                                                   chunksizes=None if var_chunking == "contiguous" else var_chunking)
+            new_var_obj.set_auto_maskandscale(False)
+            new_var_obj.setncatts(var_attrs)
+            for time_index in range(num_steps) :
+                new_var_obj[time_index] = old_var_obj[time_index]
+    except BaseException :
+        new_file.close()
+        os.remove(truncated_path)
+        raise
+    finally :
+        old_file.close()
+    new_file.close()
+
+    os.replace(truncated_path, temp_file_path)
+
+def aggregate_files (out_path, files_list, copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE,
+                     compression_level=DEFAULT_COMPRESSION_LEVEL, storage_settings=None, schema_cache_dir=None,
+                     read_ahead_size=0, **subset_options) :
+    """combine Geocat output hdf4 files into netcdf4 files along an unlimited time dimension
+
+    Files are taken in order of their image times (from their file names, or their global attributes
+    for files without a time in their name) and grouped by schema; each group is written to one aggregate
+    file in the output directory, named after the first file added to the group. A file that can't be
+    added to its group is left out (and the next file in the group is written over any part of it that was
+    written), the rest of the group is still aggregated. The other options work the same way they do for
+    convert_file, and any subset_options (such as include_patterns or bbox) are passed on to
+    subset_file_info for each file.
+
+    Returns a return code using the same codes as hdf4_2_netcdf4.
+    """
+
+    code_to_return = 0
+
+    # the files can only be put in order once they have all been found, but that only needs their names
+    files_list = sorted(files_list, key=granule_order_key)
+    if len(files_list) <= 0 :
+        LOG.warn("No files were listed in the command line input. No file processing will be done.")
+        return 1
+
+    schema_cache  = get_schema_cache(schema_cache_dir)
+    open_outputs  = { } # the open aggregate files, keyed by schema signature
+    temp_paths    = { } # the temporary path each aggregate file is written to, keyed by schema signature
+    added_files   = { } # the files added to each aggregate file so far, keyed by schema signature
+    finished      = False
+
+    try :
+        for file_path in files_list :
+
+            LOG.info("Attempting to aggregate file: " + file_path)
+
+            try :
+                in_file_info, in_file_object = read_hdf4_info(file_path)
+            except HDF4Error :
+                LOG.warn("Unable to open input file (" + file_path + ") due to HDF4Error.")
+                code_to_return = 2
+                continue
+
+            try :
+                compliance_cleanup(in_file_info, schema_cache=schema_cache)
+                if subset_options and not subset_file_info(in_file_object, in_file_info, copy_buffer_size=copy_buffer_size,
+                                                           schema_cache=schema_cache, **subset_options) :
+                    LOG.warn("Nothing in input file (" + file_path + ") is in the requested subset. It will not be aggregated.")
+                    continue
+                signature = schema_signature(in_file_info)
+
+                # start a new aggregate file for each new schema, written under a temporary name and
+                # renamed once it is complete
+                if signature not in open_outputs :
+                    temp_paths[signature]  = temporary_output_path(aggregate_file_path(out_path, file_path))
+                    added_files[signature] = [ ]
+                    LOG.info("Creating aggregate file: " + temp_paths[signature])
+                    try :
+                        open_outputs[signature] = create_aggregate_file(temp_paths[signature], in_file_info,
+                                                                        schema_cache=schema_cache)
+                    except Exception :
+                        if os.path.exists(temp_paths[signature]) :
+                            os.remove(temp_paths[signature])
+                        raise
+
+                try :
+                    append_granule(open_outputs[signature], in_file_object, in_file_info, file_path,
+                                   time_index=len(added_files[signature]),
+                                   copy_buffer_size=copy_buffer_size,
+                                   compression_level=compression_level,
+                                   storage_settings=storage_settings,
+                                   schema_cache=schema_cache,
+                                   read_ahead_size=read_ahead_size)
+                    added_files[signature].append(file_path)
+                except Exception :
+                    # the step stays unrecorded, so the next file in the group is written over it
+                    LOG.warn("Unable to add file (" + file_path + ") to the aggregate output. It will be left out.")
+                    code_to_return = 4
+            except Exception :
+                LOG.warn("Unable to add file (" + file_path + ") to the aggregate output.")
+                code_to_return = 4
+            finally :
+                in_file_object.end()
+        finished = True
+    finally :
+        # record the time covered by each file, close them and put them in place (unless we were interrupted)
+        for signature, out_file in open_outputs.items() :
+            num_steps = len(added_files[signature])
+            if not finished or num_steps <= 0 :
+                _discard_aggregate_file(out_file, temp_paths[signature])
+                continue
+            time_values = out_file.variables[TIME_VAR_NAME][:num_steps]
+            out_file.time_coverage_start = (TIME_EPOCH + timedelta(seconds=float(time_values.min()))).strftime(ISO_OUT_TIME_FORMAT)
+            out_file.time_coverage_end   = (TIME_EPOCH + timedelta(seconds=float(time_values.max()))).strftime(ISO_OUT_TIME_FORMAT)
+            has_partial_step = len(out_file.dimensions[TIME_DIM_NAME]) > num_steps
+            out_file.close()
+            new_file_path = aggregate_file_path(out_path, added_files[signature][0])
+            if has_partial_step :
+                try :
+                    _truncate_aggregate_file(temp_paths[signature], num_steps)
+                except Exception :
+                    LOG.warn("Unable to remove a partly written time step from aggregate file (" + new_file_path
+                             + "). It will not be written.")
+                    os.remove(temp_paths[signature])
+                    code_to_return = 4
+                    continue
+
+            if os.path.exists(new_file_path) :
+                LOG.warn("Output file already exists, old version of file will be destroyed: " + new_file_path)
+                code_to_return = 3 if code_to_return == 0 else code_to_return
+            os.replace(temp_paths[signature], new_file_path)
+
+    return code_to_return
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Benchmarks for the converter, run against synthetic Geocat-like hdf4 files.
+
+The synthetic files have the global attributes, channel variables, packed cloud mask variables,
+and calibration arrays found in real Geocat output, at whatever size is asked for. Each stage of
+the conversion is timed separately, as well as whole runs of hdf4_2_netcdf4, and the results are
+reported as JSON so that they can be compared between versions to catch regressions.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os, sys, logging, json, time, copy, shutil, tempfile, resource, platform, subprocess
+
+import numpy
+from pyhdf.SD import SD, SDC
+
+from constants import *
+import convert
+
+LOG = logging.getLogger(__name__)
+
+# settings for the synthetic files
+SYNTHETIC_FILE_PREFIX = "synthetic_geocat_"
+SYNTHETIC_ALGORITHM   = "bench"
+SYNTHETIC_SATELLITE   = "goes"
+SYNTHETIC_CHANNELS    = [1, 2, 7, 14]
+SYNTHETIC_DETECTORS   = 8
+SYNTHETIC_IMAGE_DATE  = 115100 # YYYJJJ with YYY years since 1900
+SYNTHETIC_IMAGE_TIME  = 120000 # HHMMSS
+
+def _write_sds (file_object, var_name, data, hdf_type, attributes) :
+    """
+    write one variable (with its attributes) to an open hdf4 file
+    """
+
+    var_object = file_object.create(var_name, hdf_type, data.shape)
+    for attr_name in sorted(attributes.keys()) :
+        if attr_name == FILL_VALUE_KEY :
+            var_object.setfillvalue(attributes[attr_name])
+        else :
+            setattr(var_object, attr_name, attributes[attr_name])
+    var_object[:] = data
+    var_object.endaccess()
+
+def make_synthetic_granule (file_path, lines, elements, file_index=0) :
+    """
+    create a synthetic Geocat-like hdf4 file with the given number of lines and elements
+    """
+
+    random_state = numpy.random.RandomState(file_index)
+    file_object  = SD(file_path, SDC.WRITE | SDC.CREATE | SDC.TRUNC)
+
+    # the global date and time, one minute apart for each file
+    setattr(file_object, IMAGE_DATE_ATTR_NAME, SYNTHETIC_IMAGE_DATE)
+    setattr(file_object, IMAGE_TIME_ATTR_NAME, SYNTHETIC_IMAGE_TIME + (file_index % 60) * 100)
+    setattr(file_object, LIB_VERSION_ATTR_NAME, "synthetic")
+
+    # geolocation, which is the same in every file
+    lat_data = numpy.linspace(60.0, -60.0, lines, dtype=numpy.float32)[:, None] * numpy.ones((1, elements), dtype=numpy.float32)
+    lon_data = numpy.ones((lines, 1), dtype=numpy.float32) * numpy.linspace(-135.0, -15.0, elements, dtype=numpy.float32)[None, :]
+    _write_sds(file_object, LAT_VAR_NAME, lat_data, SDC.FLOAT32, {FILL_VALUE_KEY: -999.0, "units": "degrees_north"})
+    _write_sds(file_object, LON_VAR_NAME, lon_data, SDC.FLOAT32, {FILL_VALUE_KEY: -999.0, "units": "degrees_east"})
+
+    # scaled channel data
+    for channel_num in SYNTHETIC_CHANNELS :
+        channel_data = random_state.randint(-32767, 32767, size=(lines, elements)).astype(numpy.int16)
+        scaled_attrs = {FILL_VALUE_KEY: -32768, "scale_factor": 0.01, "add_offset": 100.0, "scaling_method": 1, "units": "none"}
+        _write_sds(file_object, SYNTHETIC_SATELLITE + "_channel_" + str(channel_num) + "_reflectance",
+                   channel_data, SDC.INT16, scaled_attrs)
+        _write_sds(file_object, SYNTHETIC_SATELLITE + "_channel_" + str(channel_num) + "_brightness_temperature",
+                   channel_data, SDC.INT16, dict(scaled_attrs, units="K"))
+
+    # angles and category data
+    for angle_name in ["pixel_satellite_zenith_angle", "pixel_solar_zenith_angle", "pixel_relative_azimuth_angle"] :
+        _write_sds(file_object, angle_name, random_state.randint(-32767, 32767, size=(lines, elements)).astype(numpy.int16),
+                   SDC.INT16, {FILL_VALUE_KEY: -32768, "scale_factor": 0.005, "add_offset": 0.0, "scaling_method": 1})
+    _write_sds(file_object, "pixel_surface_type", random_state.randint(0, 14, size=(lines, elements)).astype(numpy.int8),
+               SDC.INT8, {FILL_VALUE_KEY: -128, "scale_factor": 1.0, "add_offset": 0.0, "scaling_method": 0, "units": "none"})
+    _write_sds(file_object, SYNTHETIC_ALGORITHM + "_cloud_mask", random_state.randint(0, 4, size=(lines, elements)).astype(numpy.int8),
+               SDC.INT8, {FILL_VALUE_KEY: -128})
+
+    # packed variables with extra byte dimensions
+    _write_sds(file_object, SYNTHETIC_ALGORITHM + "_cloud_mask_packed",
+               random_state.randint(0, 256, size=(lines, elements, 7)).astype(numpy.uint8), SDC.UINT8, { })
+    _write_sds(file_object, SYNTHETIC_ALGORITHM + "_cloud_type_packed",
+               random_state.randint(0, 256, size=(lines, elements, 6)).astype(numpy.uint8), SDC.UINT8, { })
+    _write_sds(file_object, SYNTHETIC_ALGORITHM + "_quality_flags1",
+               random_state.randint(0, 256, size=(lines, elements, 3)).astype(numpy.uint8), SDC.UINT8, { })
+
+    # per line times and calibration arrays
+    _write_sds(file_object, SCAN_LINE_TIME_VAR_NAME, numpy.arange(lines, dtype=numpy.float32), SDC.FLOAT32, { })
+    calibration_shape = (SYNTHETIC_DETECTORS, len(SYNTHETIC_CHANNELS))
+    for calibration_name in ["calibration_offset", "calibration_slope", "bc1_planck", "fk1_planck", "channel_wavenumber"] :
+        _write_sds(file_object, calibration_name, random_state.rand(*calibration_shape).astype(numpy.float32),
+                   SDC.FLOAT32, {"units": "mWm-2sr-1(cm-1)-1"})
+
+    file_object.end()
+
+def peak_rss_mb (include_children=False) :
+    """
+    get the peak resident set size of this process so far in MB (optionally including finished child processes)
+    """
+
+    # ru_maxrss is in kilobytes on linux and bytes on mac
+    scale = 1024.0 * 1024.0 if platform.system() == "Darwin" else 1024.0
+    peak  = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if include_children :
+        peak = max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    return peak / scale
+
+def _timing_summary (times, num_files, total_bytes) :
+    """
+    summarize a list of timings (in seconds) of work on num_files files totalling total_bytes
+    """
+
+    best_time = min(times)
+    return {
+                "seconds_min":    best_time,
+                "seconds_mean":   sum(times) / len(times),
+                "files_per_sec":  num_files / best_time if best_time > 0 else None,
+                "mb_per_sec":     total_bytes / (1024.0 * 1024.0) / best_time if best_time > 0 else None,
+                "peak_rss_mb":    peak_rss_mb(),
+           }
+
+def benchmark_stages (file_paths, out_dir, repeat=3, **write_options) :
+    """
+    time each stage of converting the given files separately, repeating each stage the given number of times
+    """
+
+    total_bytes = sum(os.path.getsize(file_path) for file_path in file_paths)
+    times = {"read_hdf4_info": [ ], "compliance_cleanup": [ ], "determine_dimensions": [ ], "write_netCDF4_file": [ ]}
+
+    for repeat_num in range(repeat) :
+        stage_times = dict((stage_name, 0.0) for stage_name in times.keys())
+
+        for file_path in file_paths :
+            start_time = time.time()
+            in_file_info, in_file_object = convert.read_hdf4_info(file_path)
+            stage_times["read_hdf4_info"] += time.time() - start_time
+
+            start_time = time.time()
+            convert.compliance_cleanup(in_file_info)
+            stage_times["compliance_cleanup"] += time.time() - start_time
+
+            start_time = time.time()
+            convert.determine_dimensions(copy.deepcopy(in_file_info))
+            stage_times["determine_dimensions"] += time.time() - start_time
+
+            start_time = time.time()
+            out_file_object = convert.write_netCDF4_file(in_file_object, in_file_info,
+                                                         convert.output_file_path(out_dir, file_path), **write_options)
+            out_file_object.close()
+            stage_times["write_netCDF4_file"] += time.time() - start_time
+
+            in_file_object.end()
+
+        for stage_name in times.keys() :
+            times[stage_name].append(stage_times[stage_name])
+
+    return dict((stage_name, _timing_summary(times[stage_name], len(file_paths), total_bytes))
+                for stage_name in sorted(times.keys()))
+
+def benchmark_conversion (file_paths, out_dir, repeat=3, jobs=1, **convert_options) :
+    """
+    time whole runs of hdf4_2_netcdf4 on the given files, repeating the run the given number of times
+    """
+
+    total_bytes = sum(os.path.getsize(file_path) for file_path in file_paths)
+    times = [ ]
+
+    for repeat_num in range(repeat) :
+        start_time = time.time()
+        convert.hdf4_2_netcdf4(out_dir, file_paths, jobs=jobs, **convert_options)
+        times.append(time.time() - start_time)
+
+    summary = _timing_summary(times, len(file_paths), total_bytes)
+    summary["peak_rss_mb"] = peak_rss_mb(include_children=True)
+    summary["jobs"] = jobs
+
+    return summary
+
+def benchmark_startup (repeat=3) :
+    """
+    time how long the converter command line takes to start up and finish for --help and --version,
+    each run in a new python process the way the installed geocat_converter script runs it
+    """
+
+    package_dir = os.path.dirname(os.path.abspath(convert.__file__))
+    results = { }
+    for option in ["--help", "--version"] :
+        times = [ ]
+        for repeat_num in range(repeat) :
+            start_time = time.time()
+            subprocess.check_call([sys.executable, "-c", "import sys, convert; sys.exit(convert.main())", option],
+                                  cwd=package_dir, stdout=subprocess.DEVNULL)
+            times.append(time.time() - start_time)
+        results[option] = {
+                                "seconds_min":  min(times),
+                                "seconds_mean": sum(times) / len(times),
+                          }
+
+    return results
+
+def main () :
+    import argparse
+    description_text = """
+    Benchmark the Geocat converter on synthetic hdf4 files and report the results as JSON.
+    """
+
+    parser = argparse.ArgumentParser(description=description_text)
+    parser.add_argument('-l', '--lines', dest='lines', type=int, default=1000,
+                        help='the number of lines in each synthetic file (default %(default)s)')
+    parser.add_argument('-e', '--elements', dest='elements', type=int, default=1000,
+                        help='the number of elements in each synthetic file (default %(default)s)')
+    parser.add_argument('-f', '--files', dest='num_files', type=int, default=4,
+                        help='the number of synthetic files to convert (default %(default)s)')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3,
+                        help='the number of times to repeat each timing; the best time is reported (default %(default)s)')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='the number of processes to use for whole conversion runs (default %(default)s)')
+    parser.add_argument('-z', '--compress', dest='compression_level', type=int, default=DEFAULT_COMPRESSION_LEVEL,
+                        help='the zlib compression level to use (default %(default)s)')
+    parser.add_argument('-w', '--work-dir', dest='work_dir', type=str, default=None,
+                        help='the directory to keep the synthetic and output files in (each run makes its own '
+                             'directory inside it); a temporary directory is used and removed afterwards if this is not given')
+    parser.add_argument('-o', '--out', dest='out', type=str, default=None,
+                        help='the file to write the JSON results to (default is to print them)')
+    parser.add_argument('-s', '--startup-only', dest='startup_only', default=False, action='store_true',
+                        help='only time how long the command line takes to start up; no synthetic files are made')
+    parser.add_argument('-v', '--verbose', dest='verbosity', action="count", default=0,
+                        help='each occurrence increases verbosity 1 level through ERROR-WARNING-INFO-DEBUG (default ERROR)')
+
+    args = parser.parse_args()
+
+    levels = [logging.ERROR, logging.WARN, logging.INFO, logging.DEBUG]
+    logging.basicConfig(level = levels[min(max(0, args.verbosity), 3)])
+
+    if args.startup_only :
+        _print_results({"startup": benchmark_startup(args.repeat)}, args.out)
+        return 0
+
+    # each run gets a new directory so files are never left loose in the directory the benchmark is run from
+    if args.work_dir is not None :
+        convert.setup_dir_if_needed(convert.clean_path(args.work_dir), "benchmark work")
+    work_dir = tempfile.mkdtemp(prefix="geocat_bench_", dir=convert.clean_path(args.work_dir) if args.work_dir is not None else None)
+    LOG.info("Benchmark files are in: " + work_dir)
+    in_dir   = os.path.join(work_dir, "input")
+    out_dir  = os.path.join(work_dir, "output")
+    convert.setup_dir_if_needed(in_dir,  "synthetic input")
+    convert.setup_dir_if_needed(out_dir, "benchmark output")
+
+    try :
+        # make the synthetic input files
+        file_paths = [ ]
+        for file_index in range(args.num_files) :
+            file_path = os.path.join(in_dir, SYNTHETIC_FILE_PREFIX + str(file_index) + "." + INPUT_TYPES[0])
+            LOG.info("Creating synthetic file: " + file_path)
+            make_synthetic_granule(file_path, args.lines, args.elements, file_index)
+            file_paths.append(file_path)
+
+        results = {
+                    "settings":     {
+                                        "lines":             args.lines,
+                                        "elements":          args.elements,
+                                        "files":             args.num_files,
+                                        "repeat":            args.repeat,
+                                        "compression_level": args.compression_level,
+                                        "input_mb":          sum(os.path.getsize(file_path) for file_path in file_paths) / (1024.0 * 1024.0),
+                                        "python":            platform.python_version(),
+                                    },
+                    "stages":       benchmark_stages(file_paths, out_dir, args.repeat,
+                                                     compression_level=args.compression_level),
+                    "hdf4_2_netcdf4": benchmark_conversion(file_paths, out_dir, args.repeat, jobs=args.jobs,
+                                                           compression_level=args.compression_level),
+                    "startup":      benchmark_startup(args.repeat),
+                  }
+    finally :
+        if args.work_dir is None :
+            shutil.rmtree(work_dir)
+
+    _print_results(results, args.out)
+
+    return 0
+
+def _print_results (results, out_path=None) :
+    """
+    write the results as JSON to out_path, or print them if there is no out_path
+    """
+
+    results_text = json.dumps(results, indent=4, sort_keys=True)
+    if out_path is not None :
+        with open(out_path, "w") as out_file :
+            out_file.write(results_text + "\n")
+    else :
+        print (results_text)
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -9,6 +9,8 @@ Created by evas April 2015.
 Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
 """
 
+import re
+
 # dimension names
 LINES_DIM_NAME          = "lines"
 ELEMS_DIM_NAME          = "elements"
@@ -32,13 +34,95 @@ SPECIAL_VARIABLES = {
 
 # file input and output type related constants
 INPUT_TYPES      = ['hdf']
+
+# compressed input files are decompressed to a scratch directory before they are converted; each suffix
+# is listed with the module that reads it
+COMPRESSION_MODULES     = {".gz": "gzip", ".bz2": "bz2", ".xz": "lzma"}
+COMPRESSED_INPUT_TYPES  = [input_type + suffix for input_type in INPUT_TYPES for suffix in sorted(COMPRESSION_MODULES.keys())]
+DEFAULT_SCRATCH_SIZE    = 4 * 1024 * 1024 * 1024 # the most decompressed data (in bytes) to keep in the scratch directory
 OUT_FILE_SUFFIX  = ".nc"
+IN_MEMORY_INITIAL_SIZE = 1024 * 1024 # the size (in bytes) an output file made in memory starts at (see in_memory)
+
+# the number of threads used to search directories for input files
+DEFAULT_SEARCH_THREADS = 8
+
+# when watching directories (see --watch), how often (in seconds) to look for new files, and how long
+# a new file must go unchanged before it is considered complete
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_SETTLE_TIME   = 2.0
+
+# constants for splitting a conversion across several nodes (see --shard and --lock)
+TEMP_FILE_SUFFIX     = ".tmp"   # outputs are written under a temporary name ending in this and renamed when complete
+LOCK_FILE_SUFFIX     = ".lock"  # added to the output path for the lock file held while converting
+LOCK_STALE_SECONDS   = 6 * 3600 # locks older than this are assumed to be left over from a crashed run
+LOCKED_RETURN_CODE   = 5        # the return code for a file skipped because another process holds its lock
+
+# the amount of variable data (in bytes) to hold in memory at once when copying variables into the output file
+# variables larger than this are copied in blocks of lines
+DEFAULT_COPY_BUFFER_SIZE = 64 * 1024 * 1024
+
+# constants for combining granules along a time dimension (see --aggregate)
+TIME_DIM_NAME           = "time"
+TIME_VAR_NAME           = "time"
+TIME_UNITS              = "seconds since 1970-01-01T00:00:00Z"
+SOURCE_FILE_VAR_NAME    = "source_file"
+AGGREGATE_FILE_SUFFIX   = "_aggregate"
+# the image date and time in Geocat file names, such as geocatL2.GOES-13.2015100.1200.hdf (YYYYJJJ.HHMM)
+FILE_NAME_TIME_PATTERN  = r"\.(\d{7})\.(\d{4})\."
+FILE_NAME_TIME_FORMAT   = "%Y%j%H%M"
+
+# the geolocation variables, which may be shared between files (see --shared-geo)
+LAT_VAR_NAME                = "pixel_latitude"
+LON_VAR_NAME                = "pixel_longitude"
+GEOLOCATION_VAR_NAMES       = [LAT_VAR_NAME, LON_VAR_NAME]
+SHARED_GEO_FILE_PREFIX      = "geolocation_"
+SHARED_GEO_CACHE_DIR_NAME   = ".geolocation_hashes" # where geolocation hashes are cached if there's no schema cache directory
+GEOLOCATION_FILE_ATTR_NAME  = "geolocation_file" # the path to the shared geolocation file, relative to the output file
+GEOLOCATION_HASH_ATTR_NAME  = "geolocation_hash"
+EXTERNAL_VARS_ATTR_NAME     = "external_variables" # CF attribute listing variables that are kept in another file
+
+# constants for subsetting the input files
+SOURCE_LINES_ATTR_NAME      = "source_lines"    # the [first, last + 1] lines of the input used for a subset
+SOURCE_ELEMS_ATTR_NAME      = "source_elements" # the [first, last + 1] elements of the input used for a subset
+
+# constants for the downsampled overviews of variables (see --overviews)
+OVERVIEW_NAME_PART          = "_overview_"      # overview variables and dimensions are named <name>_overview_<factor>
+OVERVIEWS_ATTR_NAME         = "overviews"       # on a variable, the names of its overview variables
+OVERVIEW_OF_ATTR_NAME       = "overview_of"     # on an overview variable, the name of the variable it is an overview of
+OVERVIEW_FACTOR_ATTR_NAME   = "overview_factor" # on an overview variable, how many lines and elements each value covers
+CELL_METHODS_ATTR_NAME      = "cell_methods"
+
+# keys for the per-variable storage settings (compression and chunking) of the output file
+ZLIB_KEY            = "zlib"
+COMPLEVEL_KEY       = "complevel"
+SHUFFLE_KEY         = "shuffle"
+CHUNKSIZES_KEY      = "chunksizes"
+LEAST_SIG_DIGIT_KEY = "least_significant_digit" # lossy quantization of float variables, in the units of the unpacked data
+NARROW_TYPE_KEY     = "narrow_type" # store integer variables in the smallest integer type that holds their data
+
+# the zlib compression level to use by default; 0 means the output will not be compressed
+DEFAULT_COMPRESSION_LEVEL = 0
+
+# the default chunk shape for variables indexed by [line, element]; square tiles are a good
+# fit for reads of small regions of the image, any other dimensions are kept whole in each chunk
+DEFAULT_CHUNK_LINES = 256
+DEFAULT_CHUNK_ELEMS = 256
+
+# per-variable storage settings, keyed by patterns that match variable names (the same way SPECIAL_VARIABLES is)
+# settings from every pattern that matches a variable will be applied, in order; for example:
+#       r".*?_cloud_mask_packed" : {COMPLEVEL_KEY: 6, CHUNKSIZES_KEY: (512, 512, 7)},
+#       r"pixel_.*?_angle"       : {NARROW_TYPE_KEY: True},
+#       r"pixel_l.*?itude"       : {LEAST_SIG_DIGIT_KEY: 3},
+STORAGE_SETTINGS = {
+                   }
 
 # keys for managing information about the input file
 GLOBAL_ATTRS_KEY = "global_attributes"
 VAR_LIST_KEY     = "variable_list"
 VAR_INFO_KEY     = "variable_info"
 SHAPE_KEY        = "shape"
+DATA_TYPE_KEY    = "data_type"
+OFFSET_KEY       = "offset" # where a subset of the variable starts in the input file, if it is being subset
 VAR_ATTRS_KEY    = "attributes"
 
 # attribute name keys
@@ -143,3 +227,40 @@ FLAG_INFO_MAP            = \
                                 FLAG_MEANINGS_ATTR_NAME: "clear spare water SC Mixed Thick_Ice Thin_Ice Multilay Spare Uncertain",
                             },
         }
+
+# the layout of the bit fields in packed variables, used to unpack them into separate flag variables
+# each field is written to a variable named <packed variable name>_<field name> on the [line, element]
+# dimensions, holding (byte >> first bit) & (2 ** number of bits - 1) for the byte it is in, with any
+# other attributes given for the field (such as flag_masks or flag_values, and flag_meanings)
+# FUTURE, the bit layout of the tests is specific to each algorithm version and isn't recorded here yet;
+#         only variables with a layout in this map are unpacked, packed variables without one are left
+#         packed (see unpack_flags in write_netCDF4_file). A layout is a list of fields like this for the variable's pattern:
+#               r".*?_cloud_mask_packed": [
+#                   ("cloud_mask", {PACKED_BYTE_KEY: 0, PACKED_BITS_KEY: (1, 2),
+#                                   FLAG_VALS_ATTR_NAME: [0, 1, 2, 3],
+#                                   FLAG_MEANINGS_ATTR_NAME: "confident_cloudy probably_cloudy probably_clear confident_clear"}),
+#               ],
+PACKED_BYTE_KEY          = "byte"
+PACKED_BITS_KEY          = "bits" # (first bit, number of bits), with bit 0 the least significant
+FLAG_MASKS_ATTR_NAME     = "flag_masks"
+PACKED_VAR_SUFFIX        = "_packed" # the end of the names of packed variables
+PACKED_FLAGS_MAP         = \
+        {
+        }
+
+# keys for the rules that apply to a variable, as found by match_variable_rules (see the rules module)
+SPECIAL_DIMS_RULE = "special_dimensions"
+LONG_NAME_RULE    = "long_name"
+RANGE_LIMS_RULE   = "range_limits"
+FLAG_INFO_RULE    = "flag_info"
+PACKED_FLAGS_RULE = "packed_flags"
+
+# an index of all the variable name patterns above, compiled once; each entry is in the form
+#       (compiled pattern, rule key, original pattern)
+# entries for each rule stay in the same order as their dictionary so that the last match wins, as it always has
+VARIABLE_PATTERN_INDEX = \
+        [(re.compile(pattern), SPECIAL_DIMS_RULE, pattern) for pattern in SPECIAL_VARIABLES.keys()] + \
+        [(re.compile(pattern), LONG_NAME_RULE,    pattern) for pattern in LONG_NAME_MAP.keys()]     + \
+        [(re.compile(pattern), RANGE_LIMS_RULE,   pattern) for pattern in RANGE_LIMS_MAP.keys()]    + \
+        [(re.compile(pattern), FLAG_INFO_RULE,    pattern) for pattern in FLAG_INFO_MAP.keys()]     + \
+        [(re.compile(pattern), PACKED_FLAGS_RULE, pattern) for pattern in PACKED_FLAGS_MAP.keys()]
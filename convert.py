@@ -9,16 +9,117 @@ Created by evas April 2015.
 Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
 """
 
-import os, sys, logging, re, pkg_resources
+import os, sys, logging, re, math, itertools, multiprocessing, concurrent.futures, hashlib, tempfile, threading, collections, time
 from datetime import datetime
 from constants import *
+from rules import match_variable_rules
+from schema_cache import DIMENSIONS_CACHE_KIND, VAR_CLEANUP_CACHE_KIND, GEO_HASH_CACHE_KIND, schema_signature, \
+                         input_file_signature, get_schema_cache
+from manifest import ConversionManifest, conversion_options_hash
+from metrics import *
 
-# import the appropriate file handling modules
-from netCDF4 import Dataset                  # used to process output netCDF4 files
-from pyhdf.SD import SD, SDC, SDS, HDF4Error # used to process input hdf4 files
+# the file handling modules (netCDF4 for output files and pyhdf for input files) and numpy are slow
+# to import, so they are imported by the routines that use them; this keeps short runs (such as
+# --help and --version) and the start of each worker process quick
+
+# the integer types that variables may be narrowed to, in order of preference
+NARROW_INTEGER_TYPES = ["int8", "uint8", "int16", "uint16", "int32", "uint32"]
 
 LOG = logging.getLogger(__name__)
 
+# the package versions this process has already looked up
+_PACKAGE_VERSIONS = { }
+
+def package_version(package_name) :
+    """
+    get the version number of an installed package, or "unknown" if it isn't installed;
+    each package is only looked up once per process
+    """
+
+    if package_name not in _PACKAGE_VERSIONS :
+        import importlib.metadata
+        try :
+            _PACKAGE_VERSIONS[package_name] = importlib.metadata.version(package_name)
+        except importlib.metadata.PackageNotFoundError :
+            _PACKAGE_VERSIONS[package_name] = "unknown"
+
+    return _PACKAGE_VERSIONS[package_name]
+
+def converter_version() :
+    """
+    get the version number of the installed converter, or "unknown" if it isn't installed
+    """
+    return package_version('geocat_converter')
+
+# the hash of the converter's module sources, filled in when first needed
+_SOURCE_HASH = [ ]
+
+def converter_build_version() :
+    """
+    get a version for the converter that changes whenever its code does, for telling if old outputs are
+    out of date: the installed version number, or when running from a checkout (where there isn't one)
+    "unknown+" and a hash of the converter's module sources
+    """
+
+    version_num = converter_version()
+    if version_num != "unknown" :
+        return version_num
+
+    if not _SOURCE_HASH :
+        source_dir  = os.path.dirname(os.path.abspath(__file__))
+        source_hash = hashlib.sha1()
+        for file_name in sorted(os.listdir(source_dir)) :
+            if file_name.endswith(".py") :
+                with open(os.path.join(source_dir, file_name), "rb") as source_file :
+                    source_hash.update(file_name.encode("utf-8") + b"\0" + source_file.read())
+        _SOURCE_HASH.append(source_hash.hexdigest()[:16])
+
+    return version_num + "+" + _SOURCE_HASH[0]
+
+# the size in bytes of a single data item for each of the hdf4 data types, filled in when first needed
+_HDF4_TYPE_SIZES = { }
+
+def hdf4_type_size(hdf4_type, default_size=8) :
+    """
+    get the size in bytes of a single data item of an hdf4 data type, or default_size for an unknown type
+    """
+
+    if not _HDF4_TYPE_SIZES :
+        from pyhdf.SD import SDC
+        _HDF4_TYPE_SIZES.update({
+                                    SDC.CHAR8:   1, SDC.UCHAR8:  1, SDC.INT8:    1, SDC.UINT8:   1,
+                                    SDC.INT16:   2, SDC.UINT16:  2, SDC.INT32:   4, SDC.UINT32:  4,
+                                    SDC.FLOAT32: 4, SDC.FLOAT64: 8,
+                                })
+
+    return _HDF4_TYPE_SIZES.get(hdf4_type, default_size)
+
+# the numpy data type pyhdf reads each of the hdf4 data types as, filled in when first needed
+_HDF4_NUMPY_TYPES = { }
+
+def hdf4_numpy_type(hdf4_type) :
+    """
+    get the numpy data type that data of an hdf4 data type is read as, so variables can be created
+    before any of their data is read
+    """
+
+    import numpy
+
+    if not _HDF4_NUMPY_TYPES :
+        from pyhdf.SD import SDC
+        _HDF4_NUMPY_TYPES.update({
+                                    SDC.CHAR8:   numpy.dtype("S1"),          SDC.UCHAR8:  numpy.dtype(numpy.uint8),
+                                    SDC.INT8:    numpy.dtype(numpy.int8),    SDC.UINT8:   numpy.dtype(numpy.uint8),
+                                    SDC.INT16:   numpy.dtype(numpy.int16),   SDC.UINT16:  numpy.dtype(numpy.uint16),
+                                    SDC.INT32:   numpy.dtype(numpy.int32),   SDC.UINT32:  numpy.dtype(numpy.uint32),
+                                    SDC.FLOAT32: numpy.dtype(numpy.float32), SDC.FLOAT64: numpy.dtype(numpy.float64),
+                                 })
+
+    if hdf4_type not in _HDF4_NUMPY_TYPES :
+        raise ValueError("Unsupported hdf4 data type: " + str(hdf4_type))
+
+    return _HDF4_NUMPY_TYPES[hdf4_type]
+
 def clean_path(string_path) :
     """
     Return a clean form of the path without things like '.', '..', or '~'
@@ -38,47 +139,134 @@ def setup_dir_if_needed(dirPath, descriptionName) :
         LOG.info("Creating " + descriptionName + " directory.")
         os.makedirs(dirPath)
 
-def search_for_input_files(starting_file_path, input_types=INPUT_TYPES) :
+def has_input_type(file_path, input_types=INPUT_TYPES) :
     """
-    given a list of file paths, search down through any directories
-    and find files that are of the appropriate input types
+    check if the file name has one of the acceptable input file types as its extension
+    (types may have more than one part, such as "hdf.gz")
     """
+    file_name = os.path.split(file_path)[-1]
 
-    file_paths_to_return = set([ ])
+    return any(file_name.endswith("." + input_type) for input_type in input_types)
 
-    # make sure the path is fully expanded
-    clean_file_path = clean_path(starting_file_path)
+def _scan_directory(dir_path, input_types) :
+    """
+    list the acceptable input files and the subdirectories in a single directory
+    """
 
-    LOG.debug("Considering input path: " + clean_file_path)
+    found_files = [ ]
+    found_dirs  = [ ]
+    try :
+        for dir_entry in os.scandir(dir_path) :
+            # the entry types usually come from the directory listing itself, so this doesn't stat each entry
+            if dir_entry.is_dir() :
+                found_dirs.append(dir_entry.path)
+            elif dir_entry.is_file() and has_input_type(dir_entry.name, input_types) :
+                found_files.append(dir_entry.path)
+    except OSError :
+        LOG.warn("Unable to search directory: " + dir_path)
+
+    return found_files, found_dirs
+
+def iter_input_files(starting_file_paths, input_types=INPUT_TYPES, search_threads=DEFAULT_SEARCH_THREADS) :
+    """
+    given a list of file paths, search down through any directories and generate the paths of
+    files that are of the appropriate input types as they are found
 
-    # if this is a single file, test it to see if it's an acceptable input file
-    if os.path.isfile(clean_file_path) :
+    Directories are searched with os.scandir, using up to search_threads threads so that
+    several subdirectories can be searched at once. Each path is only generated once, and
+    symbolic links to directories are followed, but each directory is only searched once
+    (so links that loop back to a directory above them don't keep the search going).
+    """
 
-        # check that the file is of the correct type
-        file_ext = os.path.splitext(os.path.split(clean_file_path)[-1])[-1][1:]
-        if file_ext in input_types :
-            LOG.debug("Path is an existing file of an acceptable type.")
-            file_paths_to_return.update([clean_file_path])
-        else :
-            LOG.warn("Input file type (" + file_ext + ") is not the expected input type for this program. "
-                     "File path will not be processed: " + clean_file_path)
+    seen_paths = set([ ])
+    dirs_to_search = [ ]
+    searched_dirs  = set([ ])
+    def _not_searched_yet (dir_path) :
+        real_dir_path = os.path.realpath(dir_path)
+        if real_dir_path in searched_dirs :
+            return False
+        searched_dirs.add(real_dir_path)
+        return True
 
-    # otherwise, if it's a directory, expand it and test anything we find
-    elif os.path.isdir(clean_file_path) :
+    for starting_file_path in starting_file_paths :
 
-        LOG.debug("Path is a directory. Searching inside this directory.")
-        for in_file in os.listdir(clean_file_path) :
+        # make sure the path is fully expanded
+        clean_file_path = clean_path(starting_file_path)
 
-            temp_paths = search_for_input_files(os.path.join(clean_file_path, in_file))
-            file_paths_to_return.update(temp_paths)
+        LOG.debug("Considering input path: " + clean_file_path)
 
-    else :
+        # if this is a single file, test it to see if it's an acceptable input file
+        if os.path.isfile(clean_file_path) :
+
+            # check that the file is of the correct type
+            if has_input_type(clean_file_path, input_types) :
+                LOG.debug("Path is an existing file of an acceptable type.")
+                if clean_file_path not in seen_paths :
+                    seen_paths.add(clean_file_path)
+                    yield clean_file_path
+            else :
+                file_ext = os.path.splitext(os.path.split(clean_file_path)[-1])[-1][1:]
+                LOG.warn("Input file type (" + file_ext + ") is not the expected input type for this program. "
+                         "File path will not be processed: " + clean_file_path)
+
+        # otherwise, if it's a directory, we'll search it below
+        elif os.path.isdir(clean_file_path) :
+            LOG.debug("Path is a directory. Searching inside this directory.")
+            dirs_to_search.append(clean_file_path)
+
+        else :
+            LOG.warn("Input path is neither an existing file nor a directory. " +
+                     "Path will not be processed: " + starting_file_path)
+
+    if len(dirs_to_search) <= 0 :
+        return
+
+    # search the directories, handing each subdirectory we find to the next free thread
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, search_threads)) as search_pool :
+        pending_searches = set(search_pool.submit(_scan_directory, dir_path, input_types)
+                               for dir_path in dirs_to_search if _not_searched_yet(dir_path))
+        while len(pending_searches) > 0 :
+            done_searches, pending_searches = concurrent.futures.wait(pending_searches,
+                                                                      return_when=concurrent.futures.FIRST_COMPLETED)
+            for done_search in done_searches :
+                found_files, found_dirs = done_search.result()
+                for dir_path in found_dirs :
+                    if _not_searched_yet(dir_path) :
+                        pending_searches.add(search_pool.submit(_scan_directory, dir_path, input_types))
+                for file_path in found_files :
+                    if file_path not in seen_paths :
+                        seen_paths.add(file_path)
+                        yield file_path
+
+def search_for_input_files(starting_file_path, input_types=INPUT_TYPES) :
+    """
+    given a file path, search down through any directories
+    and find files that are of the appropriate input types
+    """
 
-        LOG.warn("Input path is neither an existing file nor a directory. " +
-                 "Path will not be processed: " + starting_file_path)
+    return set(iter_input_files([starting_file_path], input_types))
 
+def read_files_from(list_path, input_types=INPUT_TYPES) :
+    """
+    generate the input file paths listed (one per line) in a file, or in stdin if list_path is "-"
 
-    return file_paths_to_return
+    No directories are searched and the files are not checked to see if they exist.
+    """
+
+    list_file = sys.stdin if list_path == "-" else open(list_path, "r")
+    try :
+        for line in list_file :
+            file_path = line.strip()
+            if not file_path :
+                continue
+            if has_input_type(file_path, input_types) :
+                yield clean_path(file_path)
+            else :
+                LOG.warn("Listed file is not the expected input type for this program. "
+                         "File path will not be processed: " + file_path)
+    finally :
+        if list_file is not sys.stdin :
+            list_file.close()
 
 def read_hdf4_info(input_file_path) :
     """
@@ -93,6 +281,7 @@ def read_hdf4_info(input_file_path) :
             VAR_INFO_KEY        :   {
                                         <var_name> :    {
                                                             SHAPE_KEY: (shape of variable data)
+                                                            DATA_TYPE_KEY: the hdf4 data type of the variable
                                                             VAR_ATTRS_KEY: a dictionary of attribute values keyed by the attribute names
                                                         }
                                     }
@@ -102,6 +291,8 @@ def read_hdf4_info(input_file_path) :
         TODO, depending on what changes need to be made for CF compliance this data structure may need to change a lot
     """
 
+    from pyhdf.SD import SD, SDC
+
     file_info = { }
 
     # open the file
@@ -125,22 +316,34 @@ def read_hdf4_info(input_file_path) :
         var_attrs  = var_object.attributes()
         file_info[VAR_INFO_KEY][var_name] = {
                                                 SHAPE_KEY: sets_temp[var_name][1],
+                                                DATA_TYPE_KEY: sets_temp[var_name][2],
                                                 VAR_ATTRS_KEY: var_attrs,
                                             }
 
     return file_info, file_object
 
-def determine_dimensions (in_file_info) :
+def determine_dimensions (in_file_info, schema_cache=None) :
     """
     given an input file and a list of the variables in the file, determine what dimensions
     it has.
 
+    If a schema_cache is given and a file with the same schema has been seen before, the
+    dimensions found for that file will be reused.
+
     Note: This function makes the assumption that most data will be in two dimensional
     arrays that are indexed by [line, element] and the number of lines and elements will
     be the same for each 2D variable in the file. Any variables that we expect not to
     match this pattern will be defined in the SPECIAL_VARIABLES dictionary.
     """
 
+    # if we've seen a file with this schema before, reuse what we found then
+    signature = None
+    if schema_cache is not None :
+        signature = schema_signature(in_file_info)
+        cached_dims = schema_cache.get(DIMENSIONS_CACHE_KIND, signature)
+        if cached_dims is not None :
+            return cached_dims
+
     # an array to hold the dimensions we will return
     # this will be filled in the format:
     #       dimensions["dimension name"] = dimension size or None for unlimited dimensions
@@ -156,11 +359,9 @@ def determine_dimensions (in_file_info) :
     for var_name in in_file_info[VAR_LIST_KEY] :
 
         # if this is one of our special variables, process it later
-        is_special = False
-        for special_var_pattern in SPECIAL_VARIABLES.keys() :
-            if re.match(special_var_pattern, var_name) :
-                vars_to_process_last.append(var_name)
-                is_special = True
+        is_special = match_variable_rules(var_name)[SPECIAL_DIMS_RULE] is not None
+        if is_special :
+            vars_to_process_last.append(var_name)
 
         # if the variable isn't a special case, try to process it now
         if not is_special :
@@ -214,12 +415,11 @@ def determine_dimensions (in_file_info) :
         # look through the special variables info and see if this variable matches one of them
         expected_dims_size  = None
         expected_dims_names = None
-        for special_var_pattern in SPECIAL_VARIABLES.keys() :
-
-            if re.match(special_var_pattern, var_name) :
+        special_dims_info   = match_variable_rules(var_name)[SPECIAL_DIMS_RULE]
+        if special_dims_info is not None :
 
-                expected_dims_size  = SPECIAL_VARIABLES[special_var_pattern][0]
-                expected_dims_names = SPECIAL_VARIABLES[special_var_pattern][1]
+            expected_dims_size  = special_dims_info[0]
+            expected_dims_names = special_dims_info[1]
 
         # if the variable was not described in the special variables info, make it some temp dim names
         if expected_dims_names is None :
@@ -259,13 +459,34 @@ def determine_dimensions (in_file_info) :
 
         variable_dim_info[var_name] = expected_dims_names
 
+    if schema_cache is not None :
+        schema_cache.put(DIMENSIONS_CACHE_KIND, signature, (dimensions, variable_dim_info))
+
     return dimensions, variable_dim_info
 
-def compliance_cleanup (in_file_info) :
+def image_datetime (global_attrs) :
+    """
+    parse the Image_Date and Image_Time global attributes of a Geocat file into a datetime object
+    """
+
+    image_date = global_attrs[IMAGE_DATE_ATTR_NAME] # attribute is YYYJJ where YYY is years since 1900
+    image_time = global_attrs[IMAGE_TIME_ATTR_NAME] # attribute is HHMMSS
+    # python's datetime can't handle our input year type, so reformat that into a format it can parse
+    date_format_in_temp = "%Y%j %H%M%S"
+    temp_date_time_str = str(int(str(image_date)[0:3]) + 1900) + str(image_date)[3:6] + " " + str(image_time).zfill(6)
+    #temp_date_time_str =  str(int(str(image_date)[0:3]) + 1900) + str(image_date)[3:6] + " " + str(image_time)
+
+    # parse our date time string into a datetime object
+    return datetime.strptime(temp_date_time_str, date_format_in_temp)
+
+def compliance_cleanup (in_file_info, schema_cache=None) :
     """given information about the file, clean up the variables and attributes to ensure minimal CF compliance
 
     Changes will be made in place, so pass in a copy of your in_file_info if you wish to keep the original info
 
+    If a schema_cache is given and a file with the same schema has been seen before, the changes to the
+    variables and variable attributes made for that file will be reused (global attributes are always processed).
+
     This method is using python's datetime module because it handles leap days correctly (which may matter since
     we are taking in a julian day format). This module does not handle leap seconds, so this could cause
     time inaccuracies in the output. (The other option was to use python's time module which handles leap seconds
@@ -301,30 +522,42 @@ def compliance_cleanup (in_file_info) :
 
     # add a timestamp to the global attributes called Image_Date_Time
 
-    # get our input date and time attributes, and then remove them
-    image_date = in_file_info[GLOBAL_ATTRS_KEY][IMAGE_DATE_ATTR_NAME] # attribute is YYYJJ where YYY is years since 1900
+    # parse our input date and time attributes, and then remove them
+    datetime_obj = image_datetime(in_file_info[GLOBAL_ATTRS_KEY])
     del in_file_info[GLOBAL_ATTRS_KEY][IMAGE_DATE_ATTR_NAME]
-    image_time = in_file_info[GLOBAL_ATTRS_KEY][IMAGE_TIME_ATTR_NAME] # attribute is HHMMSS
     del in_file_info[GLOBAL_ATTRS_KEY][IMAGE_TIME_ATTR_NAME]
-    # python's datetime can't handle our input year type, so reformat that into a format it can parse
-    date_format_in_temp = "%Y%j %H%M%S"
-    temp_date_time_str = str(int(str(image_date)[0:3]) + 1900) + str(image_date)[3:6] + " " + str(image_time).zfill(6)
-    #temp_date_time_str =  str(int(str(image_date)[0:3]) + 1900) + str(image_date)[3:6] + " " + str(image_time)
-    # parse our date time string into a datetime object
-    datetime_obj = datetime.strptime(temp_date_time_str, date_format_in_temp)
     # save the new date time attribute to the global attributes
     in_file_info[GLOBAL_ATTRS_KEY][IMAGE_DATETIME_ATTR_NAME] = datetime_obj.strftime(ISO_OUT_TIME_FORMAT)
 
     LOG.debug ("file global date/time: " + in_file_info[GLOBAL_ATTRS_KEY][IMAGE_DATETIME_ATTR_NAME])
 
     # update the Output_Library_Version attribute to match the output library we are using here
-    in_file_info[GLOBAL_ATTRS_KEY][LIB_VERSION_ATTR_NAME] = str(pkg_resources.get_distribution("netCDF4"))
+    in_file_info[GLOBAL_ATTRS_KEY][LIB_VERSION_ATTR_NAME] = "netCDF4 " + package_version("netCDF4")
 
     ### changes to variables and variable attributes:
+    cleanup_variables(in_file_info, schema_cache=schema_cache)
+
+def cleanup_variables (in_file_info, schema_cache=None) :
+    """clean up the variables and variable attributes in the file information to ensure minimal CF compliance
+
+    This is the part of compliance_cleanup that doesn't depend on the global attributes, so it may also be
+    used on the variable attributes of an output file (see refresh_file). Changes will be made in place.
+    See compliance_cleanup for details of the changes and the use of schema_cache.
+    """
 
     # NOTE: in setting this up we need some flexibility by using patterns to identify variable names
     #             (since most variables append the algorithm name and or version to their name)
 
+    # if we've seen a file with this schema before, reuse the variable changes we made then
+    signature = None
+    if schema_cache is not None :
+        signature = schema_signature(in_file_info)
+        cached_var_info = schema_cache.get(VAR_CLEANUP_CACHE_KIND, signature)
+        if cached_var_info is not None :
+            in_file_info[VAR_INFO_KEY] = cached_var_info
+            in_file_info[VAR_LIST_KEY] = list(cached_var_info.keys())
+            return
+
     # delete any variables that we will not be writing out
     for var_name in VARS_TO_DELETE :
         if var_name in in_file_info[VAR_INFO_KEY] :
@@ -393,44 +626,38 @@ def compliance_cleanup (in_file_info) :
         # check to see if any of the attributes falls in our simple conversion list
         for attr_name in var_info[VAR_ATTRS_KEY].keys() :
             attr_val = var_info[VAR_ATTRS_KEY][attr_name]
-            if attr_val in CONVERT_ATTRS_MAP.keys() :
+            if isinstance(attr_val, str) and attr_val in CONVERT_ATTRS_MAP :
                 LOG.debug("Changing variable attribute " + attr_name + " for variable "
                           + var_name + " from " + attr_val + " to " + CONVERT_ATTRS_MAP[attr_val] + ".")
                 var_info[VAR_ATTRS_KEY][attr_name] = CONVERT_ATTRS_MAP[attr_val]
 
         ### if this variable needs descriptive attributes added, add those
 
+        # find all the rules that apply to this variable name at once
+        var_rules = match_variable_rules(var_name)
+
         # add long_name where available (FUTURE, include the algorithm in the long name)
-        for var_exp_key in LONG_NAME_MAP.keys() :
-            temp_match = re.match(var_exp_key, var_name)
-            if temp_match is not None :
-                long_name_str = None
-                if var_exp_key in CHANNEL_DATA_PATTERNS :
-                    long_name_str = LONG_NAME_MAP[var_exp_key] % (temp_match.group(2), temp_match.group(1))
-                else :
-                    long_name_str = LONG_NAME_MAP[var_exp_key]
-                var_info[VAR_ATTRS_KEY][LONG_NAME_ATTR_NAME] = long_name_str
-                LOG.debug("Adding long name to " + var_name + ": " + long_name_str)
+        long_name_str = var_rules[LONG_NAME_RULE]
+        if long_name_str is not None :
+            var_info[VAR_ATTRS_KEY][LONG_NAME_ATTR_NAME] = long_name_str
+            LOG.debug("Adding long name to " + var_name + ": " + long_name_str)
 
         # add information about the range of the data
-        for var_exp_key in RANGE_LIMS_MAP.keys() :
-            temp_match = re.match(var_exp_key, var_name)
-            if temp_match is not None and not did_set_ranges :
-                temp_range = RANGE_LIMS_MAP[var_exp_key]
-                # set valid_range, valid_min, and valid_max attributes
-                LOG.debug("Setting valid range attributes for variable " + var_name + " to range " + str(temp_range) + ".")
-                var_info[VAR_ATTRS_KEY][VALID_RANGE_ATTR_NAME] = temp_range
-                var_info[VAR_ATTRS_KEY][VALID_MIN_ATTR_NAME]   = temp_range[0]
-                var_info[VAR_ATTRS_KEY][VALID_MAX_ATTR_NAME]   = temp_range[1]
+        temp_range = var_rules[RANGE_LIMS_RULE]
+        if temp_range is not None and not did_set_ranges :
+            # set valid_range, valid_min, and valid_max attributes
+            LOG.debug("Setting valid range attributes for variable " + var_name + " to range " + str(temp_range) + ".")
+            var_info[VAR_ATTRS_KEY][VALID_RANGE_ATTR_NAME] = temp_range
+            var_info[VAR_ATTRS_KEY][VALID_MIN_ATTR_NAME]   = temp_range[0]
+            var_info[VAR_ATTRS_KEY][VALID_MAX_ATTR_NAME]   = temp_range[1]
 
         # add information about flag (category variable) values and their meanings
-        for var_exp_key in FLAG_INFO_MAP.keys() :
-            # add flag_values where available (list of possible valid values of the category)
-            # add flag_meanings where available (list of what the categories mean; corresponds to flag_values in order)
-            temp_match = re.match(var_exp_key, var_name)
-            if temp_match is not None and not did_set_ranges :
-                var_info[VAR_ATTRS_KEY][FLAG_VALS_ATTR_NAME]     = FLAG_INFO_MAP[var_exp_key][FLAG_VALS_ATTR_NAME]
-                var_info[VAR_ATTRS_KEY][FLAG_MEANINGS_ATTR_NAME] = FLAG_INFO_MAP[var_exp_key][FLAG_MEANINGS_ATTR_NAME]
+        # add flag_values where available (list of possible valid values of the category)
+        # add flag_meanings where available (list of what the categories mean; corresponds to flag_values in order)
+        flag_info = var_rules[FLAG_INFO_RULE]
+        if flag_info is not None and not did_set_ranges :
+            var_info[VAR_ATTRS_KEY][FLAG_VALS_ATTR_NAME]     = flag_info[FLAG_VALS_ATTR_NAME]
+            var_info[VAR_ATTRS_KEY][FLAG_MEANINGS_ATTR_NAME] = flag_info[FLAG_MEANINGS_ATTR_NAME]
 
         # FUTURE, add standard_name where appropriate
 
@@ -439,22 +666,470 @@ def compliance_cleanup (in_file_info) :
         #          it may be desirable to express this association by providing a link between the variables.
         #          For example, instrument data may have associated measures of uncertainty."
 
+    if schema_cache is not None :
+        schema_cache.put(VAR_CLEANUP_CACHE_KIND, signature, in_file_info[VAR_INFO_KEY])
+
     # TODO, remap and clean up the channel_index based on Table 11 in the Geocat manual
     #   (this should only affect the calibration variables)
     #   because this changes variable sizes and their data, this will need to be done when dimensions are
     #   calculated and when the data is being transferred over to the other file
 
-def write_netCDF4_file (in_file_obj, in_file_info, output_path) :
+def lines_per_block (var_shape, item_size, copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE, align_lines=1) :
+    """
+    figure out how many lines (entries along the first dimension) of a variable with the given shape
+    and data item size fit in the copy buffer; at least one line will always be copied at a time
+
+    if copy_buffer_size is None or 0, the whole variable will be copied at once
+
+    if align_lines is more than 1 and the variable takes more than one block, the block is made a multiple
+    of that many lines, rounding down unless that would leave no lines (so a block may be larger than
+    the copy buffer, and even than the variable, when align_lines is large)
+    """
+
+    total_lines = var_shape[0] if len(var_shape) > 0 else 1
+    if not copy_buffer_size :
+        return max(1, total_lines)
+
+    line_size = item_size
+    for dim_size in var_shape[1:] :
+        line_size *= dim_size
+
+    block_size = max(1, min(total_lines, copy_buffer_size // max(1, line_size)))
+    if align_lines > 1 and block_size < total_lines :
+        block_size = max(align_lines, block_size - (block_size % align_lines))
+
+    return block_size
+
+def read_variable_blocks (in_var_obj, var_shape, item_size, copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE, align_lines=1,
+                          offset=None) :
+    """
+    generate (start line, data) blocks of variable data by reading hyperslabs of whole lines from an hdf4 SDS
+
+    Only one block is held in memory at a time, so reading a large variable this way keeps
+    memory use bounded by copy_buffer_size (or a single line, if a line is larger than that).
+
+    If align_lines is given, blocks will be a multiple of that many lines where possible (this is used
+    to line the blocks up with the chunks in the output file so each chunk is only compressed once).
+
+    If an offset (the index to start at in each dimension) is given, only the window of var_shape starting
+    at that offset is read; start lines are still given relative to the start of the window.
+    """
+
+    total_lines = var_shape[0]
+    block_size  = lines_per_block(var_shape, item_size, copy_buffer_size, align_lines)
+
+    # the slices for the dimensions after the first, which are the same for every block
+    line_offset  = offset[0] if offset is not None else 0
+    other_slices = tuple(slice(dim_offset, dim_offset + dim_size) for dim_offset, dim_size
+                         in zip(offset[1:], var_shape[1:])) if offset is not None else ( )
+
+    for start_line in range(0, total_lines, block_size) :
+        end_line = min(start_line + block_size, total_lines)
+        if offset is None :
+            yield start_line, in_var_obj[start_line:end_line]
+        else :
+            yield start_line, in_var_obj[(slice(line_offset + start_line, line_offset + end_line),) + other_slices]
+
+def read_file_blocks (in_file_obj, in_file_info, var_names, copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE, align_lines=None) :
+    """
+    generate (variable name, start line, data) blocks for each of the named variables in an hdf4 file, in order;
+    if a variable's info has an OFFSET_KEY, only the window of its shape starting at that offset is read
+
+    align_lines may be a dictionary of the number of lines to line each variable's blocks up with,
+    see read_variable_blocks
+    """
+
+    for var_name in var_names :
+        in_var_obj = in_file_obj.select(var_name)
+        var_shape  = in_file_info[VAR_INFO_KEY][var_name][SHAPE_KEY]
+        item_size  = hdf4_type_size(in_var_obj.info()[3])
+        var_align  = align_lines[var_name] if align_lines is not None and var_name in align_lines else 1
+        var_offset = in_file_info[VAR_INFO_KEY][var_name].get(OFFSET_KEY)
+
+        for start_line, raw_data in read_variable_blocks(in_var_obj, var_shape, item_size, copy_buffer_size, var_align,
+                                                         var_offset) :
+            yield var_name, start_line, raw_data
+
+        in_var_obj.endaccess()
+
+def read_ahead (block_generator, max_buffered_bytes) :
+    """
+    run a generator of tuples that end in a block of data in a background thread and yield its items in
+    order, so that the next blocks can be read while the current one is being written
+
+    The reader waits when the blocks that have been read but not finished with would take up more than
+    max_buffered_bytes, though it will always be allowed to get at least one block ahead. Any exception
+    raised by the generator is raised here once the blocks read before it have been yielded.
+
+    The generator is only ever used from the background thread, so it may use file handles that can't
+    be shared between threads as long as nothing else uses them until this is done.
+    """
+
+    condition = threading.Condition()
+    buffered  = collections.deque()
+    state     = {"bytes": 0, "done": False, "error": None, "stop": False}
+
+    def _read_blocks () :
+        try :
+            for item in block_generator :
+                item_bytes = item[-1].nbytes
+                with condition :
+                    # wait for the writer to catch up if we're too far ahead
+                    while not state["stop"] and len(buffered) > 0 and state["bytes"] + item_bytes > max_buffered_bytes :
+                        condition.wait()
+                    if state["stop"] :
+                        return
+                    buffered.append(item)
+                    state["bytes"] += item_bytes
+                    condition.notify_all()
+        except Exception as read_error :
+            with condition :
+                state["error"] = read_error
+        finally :
+            with condition :
+                state["done"] = True
+                condition.notify_all()
+
+    reader_thread = threading.Thread(target=_read_blocks, name="read_ahead")
+    reader_thread.daemon = True
+    reader_thread.start()
+
+    try :
+        while True :
+            with condition :
+                while len(buffered) <= 0 and not state["done"] :
+                    condition.wait()
+                if len(buffered) <= 0 :
+                    if state["error"] is not None :
+                        raise state["error"]
+                    return
+                item = buffered.popleft()
+
+            yield item
+
+            # we're done with this block, so let the reader use that memory
+            with condition :
+                state["bytes"] -= item[-1].nbytes
+                condition.notify_all()
+    finally :
+        with condition :
+            state["stop"] = True
+            condition.notify_all()
+        reader_thread.join()
+
+def parse_storage_option (option_text) :
+    """
+    parse a storage setting from the command line in the form "pattern:key=value,key=value"
+
+    the keys may be complevel (an integer), shuffle (0 or 1), chunks (chunk sizes separated by x,
+    for example 512x512), narrow (0 or 1) or digits (the least significant digit to keep for float data);
+    returns the variable name pattern and a dictionary of storage settings
+    """
+
+    var_pattern, _, settings_text = option_text.rpartition(":")
+    if not var_pattern :
+        raise ValueError("Storage setting (" + option_text + ") does not include a variable name pattern.")
+
+    settings = { }
+    for setting_text in settings_text.split(",") :
+        key, _, value = setting_text.partition("=")
+        key = key.strip()
+        if key == COMPLEVEL_KEY :
+            settings[COMPLEVEL_KEY] = int(value)
+            settings[ZLIB_KEY]      = int(value) > 0
+        elif key == SHUFFLE_KEY :
+            settings[SHUFFLE_KEY]   = bool(int(value))
+        elif key == "chunks" :
+            settings[CHUNKSIZES_KEY] = tuple(int(size) for size in value.split("x"))
+        elif key == "narrow" :
+            settings[NARROW_TYPE_KEY] = bool(int(value))
+        elif key == "digits" :
+            settings[LEAST_SIG_DIGIT_KEY] = int(value)
+        else :
+            raise ValueError("Unknown storage setting (" + key + ") for variable pattern " + var_pattern + ".")
+
+    return var_pattern, settings
+
+def even_chunk_size (dim_size, max_chunk_size) :
+    """
+    get the largest chunk size no bigger than max_chunk_size that splits the dimension into chunks of
+    (nearly) even size, so the last chunk isn't mostly padding
+    """
+
+    if dim_size is None or dim_size <= max_chunk_size :
+        return max_chunk_size if dim_size is None else max(1, dim_size)
+
+    num_chunks = -(-dim_size // max_chunk_size)
+
+    return -(-dim_size // num_chunks)
+
+def storage_settings_for_variable (var_name, var_dim_names, dimensions_info,
+                                   compression_level=DEFAULT_COMPRESSION_LEVEL, storage_settings=None, var_shape=None) :
+    """
+    figure out the compression and chunking keyword arguments to use when creating a variable in the output file
+
+    variables indexed by [line, element] get the default chunk shape and other variables that use unlimited
+    dimensions get a single chunk the size of the variable (if var_shape is given; the library default for
+    unlimited dimensions is far larger than our small calibration arrays), then the settings from any
+    patterns in STORAGE_SETTINGS and storage_settings that match the variable name are applied in order
+    """
+
+    settings = { }
+
+    if compression_level :
+        settings[ZLIB_KEY]      = True
+        settings[COMPLEVEL_KEY] = compression_level
+        settings[SHUFFLE_KEY]   = True
+
+    if tuple(var_dim_names[:2]) == (LINES_DIM_NAME, ELEMS_DIM_NAME) :
+        settings[CHUNKSIZES_KEY] = (even_chunk_size(dimensions_info[LINES_DIM_NAME], DEFAULT_CHUNK_LINES),
+                                    even_chunk_size(dimensions_info[ELEMS_DIM_NAME], DEFAULT_CHUNK_ELEMS)) + \
+                                   tuple(dimensions_info[dim_name] for dim_name in var_dim_names[2:])
+    elif var_shape is not None and None in [dimensions_info[dim_name] for dim_name in var_dim_names] :
+        settings[CHUNKSIZES_KEY] = tuple(max(1, dim_size) for dim_size in var_shape)
+
+    all_storage_settings = list(STORAGE_SETTINGS.items())
+    if storage_settings is not None :
+        all_storage_settings += list(storage_settings.items())
+    for var_pattern, pattern_settings in all_storage_settings :
+        if re.match(var_pattern, var_name) :
+            settings.update(pattern_settings)
+
+    # chunks can't be bigger than the (fixed size) dimensions they are in
+    if CHUNKSIZES_KEY in settings :
+        if len(settings[CHUNKSIZES_KEY]) != len(var_dim_names) :
+            LOG.warn("Chunk sizes " + str(settings[CHUNKSIZES_KEY]) + " do not match the dimensions of variable "
+                     + var_name + ". Default chunking will be used for this variable.")
+            del settings[CHUNKSIZES_KEY]
+        else :
+            settings[CHUNKSIZES_KEY] = tuple(min(chunk_size, dimensions_info[dim_name])
+                                             if dimensions_info[dim_name] is not None else chunk_size
+                                             for chunk_size, dim_name in zip(settings[CHUNKSIZES_KEY], var_dim_names))
+
+    return settings
+
+def read_variable_range (in_file_obj, in_file_info, var_name, copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE, metrics=None) :
+    """
+    find the smallest and largest values of a variable (not counting its fill value) by reading through
+    its data one block at a time; the reads are recorded in metrics, if given
+
+    returns the min and max, or None and None if the variable has no data other than fill values
+    """
+
+    variable_attr_info = in_file_info[VAR_INFO_KEY][var_name][VAR_ATTRS_KEY]
+    fill_value = variable_attr_info[FILL_VALUE_KEY] if FILL_VALUE_KEY in variable_attr_info else None
+
+    data_blocks = read_file_blocks(in_file_obj, in_file_info, [var_name], copy_buffer_size)
+    if metrics is not None :
+        data_blocks = timed_blocks(data_blocks, metrics)
+
+    data_min = None
+    data_max = None
+    for _, _, raw_data in data_blocks :
+        if fill_value is not None :
+            raw_data = raw_data[raw_data != fill_value]
+        if raw_data.size > 0 :
+            data_min = raw_data.min() if data_min is None else min(data_min, raw_data.min())
+            data_max = raw_data.max() if data_max is None else max(data_max, raw_data.max())
+
+    return data_min, data_max
+
+def narrowest_integer_type (data_type, data_range, fill_value=None, other_values=( )) :
+    """
+    find the first of the NARROW_INTEGER_TYPES that is smaller than data_type and can hold all of the
+    values in the data_range (min, max) and other_values exactly, as well as a fill value
+
+    the fill value is kept if it fits in the new type; otherwise the smallest (or largest) value of the
+    new type is used for the fill value if it is outside of the data_range
+
+    returns the new type and fill value, or data_type and fill_value if there isn't a smaller type
+    """
+
+    must_hold = list(data_range) + list(other_values)
+
+    import numpy
+
+    for narrow_type in NARROW_INTEGER_TYPES :
+        narrow_type = numpy.dtype(narrow_type)
+        if narrow_type.itemsize >= data_type.itemsize :
+            continue
+        type_info = numpy.iinfo(narrow_type)
+        if not all(type_info.min <= value <= type_info.max for value in must_hold) :
+            continue
+        if fill_value is None or type_info.min <= fill_value <= type_info.max :
+            return narrow_type, fill_value
+        if type_info.min < data_range[0] :
+            return narrow_type, type_info.min
+        if type_info.max > data_range[1] :
+            return narrow_type, type_info.max
+
+    return data_type, fill_value
+
+def attributes_for_integer_type (variable_attr_info, int_type) :
+    """
+    convert the fill value, flag values and valid range attributes of a variable to an integer type it
+    has been narrowed to; the valid range is limited to the values of the type and kept clear of the
+    fill value, which must already fit in the type
+
+    returns a new dictionary of the attributes
+    """
+
+    import numpy
+
+    int_type  = numpy.dtype(int_type)
+    type_info = numpy.iinfo(int_type)
+    variable_attr_info = dict(variable_attr_info)
+    fill_value = variable_attr_info[FILL_VALUE_KEY] if FILL_VALUE_KEY in variable_attr_info else None
+
+    if fill_value is not None :
+        variable_attr_info[FILL_VALUE_KEY] = int_type.type(fill_value)
+    if FLAG_VALS_ATTR_NAME in variable_attr_info :
+        variable_attr_info[FLAG_VALS_ATTR_NAME] = numpy.ravel(variable_attr_info[FLAG_VALS_ATTR_NAME]).astype(int_type)
+
+    # the valid range is limited to the new type, and kept clear of the fill value
+    valid_limits = {VALID_MIN_ATTR_NAME: type_info.min, VALID_MAX_ATTR_NAME: type_info.max}
+    if fill_value == type_info.min :
+        valid_limits[VALID_MIN_ATTR_NAME] += 1
+    elif fill_value == type_info.max :
+        valid_limits[VALID_MAX_ATTR_NAME] -= 1
+    if VALID_RANGE_ATTR_NAME in variable_attr_info :
+        valid_range = numpy.clip(numpy.asarray(variable_attr_info[VALID_RANGE_ATTR_NAME]),
+                                 valid_limits[VALID_MIN_ATTR_NAME], valid_limits[VALID_MAX_ATTR_NAME])
+        variable_attr_info[VALID_RANGE_ATTR_NAME] = valid_range.astype(int_type)
+    for attr_name in [VALID_MIN_ATTR_NAME, VALID_MAX_ATTR_NAME] :
+        if attr_name in variable_attr_info :
+            attr_val = min(max(variable_attr_info[attr_name], valid_limits[VALID_MIN_ATTR_NAME]),
+                           valid_limits[VALID_MAX_ATTR_NAME])
+            variable_attr_info[attr_name] = int_type.type(attr_val)
+
+    return variable_attr_info
+
+def packing_for_variable (var_name, data_type, variable_attr_info, var_storage, data_range=None) :
+    """
+    apply the narrow_type and least_significant_digit storage settings for a variable
+
+    if the settings ask for it and the data_range (min, max, not counting fill values) is given, an integer
+    variable will be stored in the smallest integer type that holds its data and flag values, see
+    narrowest_integer_type; the data values don't change, so scale_factor and add_offset are kept as they
+    are, but the fill value and valid range are converted to the new type (as CF expects), with the fill
+    value moved to the edge of the new type if it won't fit (the caller must change the fill values in
+    the data to match)
+
+    a least_significant_digit setting is in the units of the unpacked data, so for float variables with a
+    scale_factor it is converted to the units the data is stored in; it is ignored for integer variables
+
+    returns the data type, variable attributes and createVariable settings to use for the variable
+    """
+
+    import numpy
+
+    var_storage = dict(var_storage)
+
+    if var_storage.pop(NARROW_TYPE_KEY, False) :
+        if data_type.kind not in "iu" :
+            LOG.debug("Variable " + var_name + " does not hold integer data and will not be narrowed.")
+        elif data_range is None :
+            LOG.warn("The data range of variable " + var_name + " is not known, so it will not be narrowed.")
+        elif data_range[0] is not None :
+            fill_value  = variable_attr_info[FILL_VALUE_KEY] if FILL_VALUE_KEY in variable_attr_info else None
+            flag_values = numpy.ravel(variable_attr_info[FLAG_VALS_ATTR_NAME]) if FLAG_VALS_ATTR_NAME in variable_attr_info else [ ]
+            narrow_type, narrow_fill = narrowest_integer_type(data_type, data_range, fill_value, flag_values)
+            if narrow_type != data_type :
+                LOG.debug("Storing variable " + var_name + " as " + str(narrow_type) + " instead of " + str(data_type) + ".")
+                if fill_value is not None :
+                    variable_attr_info = dict(variable_attr_info)
+                    variable_attr_info[FILL_VALUE_KEY] = narrow_type.type(narrow_fill)
+                variable_attr_info = attributes_for_integer_type(variable_attr_info, narrow_type)
+                data_type = narrow_type
+
+    if LEAST_SIG_DIGIT_KEY in var_storage :
+        scale_factor = variable_attr_info.get("scale_factor")
+        if data_type.kind != "f" :
+            LOG.debug("Variable " + var_name + " does not hold float data and will not be quantized.")
+            del var_storage[LEAST_SIG_DIGIT_KEY]
+        elif scale_factor :
+            var_storage[LEAST_SIG_DIGIT_KEY] = int(math.floor(var_storage[LEAST_SIG_DIGIT_KEY] + math.log10(abs(scale_factor))))
+
+    return data_type, variable_attr_info, var_storage
+
+def write_netCDF4_file (in_file_obj, in_file_info, output_path, copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE,
+                        compression_level=DEFAULT_COMPRESSION_LEVEL, storage_settings=None, schema_cache=None,
+                        read_ahead_size=0, metrics=None, validate=False, unpack_flags=False,
+                        overview_factors=None, overview_patterns=None, in_memory=False) :
     """
     given an input file to get raw variable data from, a structure describing the variables and
     attributes in the file, and the path to put output in, create an output netCDF4 file
+
+    variable data is copied in blocks of lines that fit in copy_buffer_size bytes, so that
+    large variables don't have to be held in memory all at once; if copy_buffer_size is None
+    or 0 each variable will be read and written in one piece
+
+    compression_level sets the zlib compression for all variables (0 for none) and storage_settings
+    is a dictionary of per-variable compression and chunking settings keyed by variable name
+    patterns, see storage_settings_for_variable; variables that are to be narrowed to a smaller
+    integer type are read through once first to find their data range, see packing_for_variable
+
+    schema_cache is passed on to determine_dimensions
+
+    if read_ahead_size is more than 0, the input data will be read in a background thread while the
+    output is being written, with up to read_ahead_size bytes of data read ahead of the writing
+    (in addition to the block being written); see read_ahead
+
+    if a ConversionMetrics object is given as metrics, the time spent and bytes read and written for each
+    variable will be recorded in it
+
+    if validate is True, each block of data is checked against the variable's valid range as it is copied;
+    the counts of fill, NaN and out of range values and the actual range and mean of each variable are saved
+    in its attributes (and in metrics if given), and the user is warned about any out of range data
+
+    if unpack_flags is True, the fields of packed variables (such as the cloud mask test results) are also
+    written to separate flag variables as each block of packed data is copied, see PACKED_FLAGS_MAP
+
+    if overview_factors are given (such as [2, 4, 8]), downsampled overviews of the image variables that match
+    overview_patterns (or all of them if there are no patterns) are made at each factor as each block of data
+    is copied, see the overviews module
+
+    if in_memory is True, the output file is made in memory instead of on disk (output_path is only used as
+    its name); closing the returned file gives the contents of the file as a memoryview
     """
 
+    from netCDF4 import Dataset
+
     # make the output file
-    out_file = Dataset(output_path, mode='w', format='NETCDF4', clobber=True)
+    if in_memory :
+        out_file = Dataset(output_path, mode='w', format='NETCDF4', memory=IN_MEMORY_INITIAL_SIZE)
+    else :
+        out_file = Dataset(output_path, mode='w', format='NETCDF4', clobber=True)
+
+    # if anything goes wrong, close the partly written file so the handle isn't left open in long-lived workers
+    try :
+        _write_netCDF4_contents(out_file, in_file_obj, in_file_info, copy_buffer_size, compression_level,
+                                storage_settings, schema_cache, read_ahead_size, metrics, validate, unpack_flags,
+                                overview_factors, overview_patterns)
+    except BaseException :
+        out_file.close()
+        raise
+
+    return out_file
+
+def _write_netCDF4_contents (out_file, in_file_obj, in_file_info, copy_buffer_size, compression_level, storage_settings,
+                             schema_cache, read_ahead_size, metrics, validate, unpack_flags, overview_factors,
+                             overview_patterns) :
+    """
+    put the dimensions, attributes, variables and data in a newly made output file, see write_netCDF4_file
+    """
+
+    import numpy
+    if validate :
+        from validation import VariableStatistics
+    if unpack_flags :
+        from packed_flags import flag_fields_for_variable, flag_variable_name, flag_variable_attributes, unpack_field
+    if overview_factors :
+        from overviews import wants_overviews, overview_name, overview_attributes, reduce_block
 
     # figure out what dimensions we expect
-    dimensions_info, variable_dimensions_info = determine_dimensions (in_file_info)
+    with time_stage(metrics, METADATA_STAGE) :
+        dimensions_info, variable_dimensions_info = determine_dimensions (in_file_info, schema_cache=schema_cache)
     # create the dimensions in the netCDF file
     for dim_name in dimensions_info.keys() :
 
@@ -465,23 +1140,68 @@ def write_netCDF4_file (in_file_obj, in_file_info, output_path) :
     for attr_key in sorted(global_attrs_temp.keys()) :
         setattr(out_file, attr_key, global_attrs_temp[attr_key])
 
-    # put each of the variables in the file
+    # figure out how each variable should be compressed and chunked
+    variables_storage = { }
+    align_lines       = { }
+    for var_name in variable_dimensions_info.keys() :
+        var_storage = storage_settings_for_variable(var_name, variable_dimensions_info[var_name], dimensions_info,
+                                                    compression_level, storage_settings,
+                                                    in_file_info[VAR_INFO_KEY][var_name][SHAPE_KEY])
+        variables_storage[var_name] = var_storage
+        align_lines[var_name] = var_storage[CHUNKSIZES_KEY][0] if CHUNKSIZES_KEY in var_storage else 1
+
+    # figure out which variables get overviews; their blocks must also line up with every overview factor
+    overview_var_names = [ ]
+    if overview_factors :
+        overview_var_names = [var_name for var_name in variable_dimensions_info.keys()
+                              if wants_overviews(var_name, variable_dimensions_info[var_name], overview_patterns)]
+        for var_name in overview_var_names :
+            align_lines[var_name] = math.lcm(align_lines[var_name], *overview_factors)
+        if len(overview_var_names) > 0 :
+            for factor in overview_factors :
+                for dim_name in [LINES_DIM_NAME, ELEMS_DIM_NAME] :
+                    out_file.createDimension(overview_name(dim_name, factor), -(-dimensions_info[dim_name] // factor))
+
+    # find the data range of any variables that may be narrowed, before any data is read in the background
+    variable_ranges = { }
     for var_name in variable_dimensions_info.keys() :
+        if variables_storage[var_name].get(NARROW_TYPE_KEY) :
+            variable_ranges[var_name] = read_variable_range(in_file_obj, in_file_info, var_name, copy_buffer_size,
+                                                            metrics)
+
+    # get the raw data from the input file, possibly reading ahead in the background; FUTURE, abstract file access more
+    data_blocks = read_file_blocks(in_file_obj, in_file_info, list(variable_dimensions_info.keys()),
+                                   copy_buffer_size, align_lines)
+    if read_ahead_size :
+        data_blocks = read_ahead(data_blocks, read_ahead_size)
+    if metrics is not None :
+        data_blocks = timed_blocks(data_blocks, metrics)
+
+    # once all of a variable's data is written, save the statistics for it
+    def _finish_statistics (out_var_obj, var_stats) :
+        for attr_key, attr_val in sorted(var_stats.to_attributes().items()) :
+            setattr(out_var_obj, attr_key, attr_val)
+        var_stats.warn_if_out_of_range()
+        if metrics is not None :
+            metrics.add_statistics(var_stats.var_name, var_stats.to_dict())
+
+    # create all of the variables before any data is copied, so variables with no data (no lines) are still made
+    variable_outputs = { }
+    for var_name in variable_dimensions_info.keys() :
+        in_data_type = hdf4_numpy_type(in_file_info[VAR_INFO_KEY][var_name][DATA_TYPE_KEY])
 
-        # get the raw data from the input file; FUTURE, abstract file access more
-        in_var_obj = in_file_obj.select(var_name)
-        raw_data   = in_var_obj[:]
-        data_type  = raw_data.dtype
-        SDS.endaccess(in_var_obj)
+        # figure out how the data will be stored
+        data_type, variable_attr_info, var_storage = packing_for_variable(var_name, in_data_type,
+                                                                          in_file_info[VAR_INFO_KEY][var_name][VAR_ATTRS_KEY],
+                                                                          variables_storage[var_name],
+                                                                          variable_ranges.get(var_name))
 
         # get the fill value
-        variable_attr_info = in_file_info[VAR_INFO_KEY][var_name][VAR_ATTRS_KEY]
         # FUTURE, theoretically this needs to be case insensitive, in practice will this cause problems?
         fill_value_temp = variable_attr_info[FILL_VALUE_KEY] if FILL_VALUE_KEY in variable_attr_info else None
 
-        # create the variable with the appropriate dimensions
         out_var_obj = out_file.createVariable(var_name, data_type, variable_dimensions_info[var_name],
-                                              fill_value=fill_value_temp)
+                                              fill_value=fill_value_temp, **var_storage)
         out_var_obj.set_auto_maskandscale(False)
 
         # set the variable attributes
@@ -489,73 +1209,612 @@ def write_netCDF4_file (in_file_obj, in_file_info, output_path) :
             if attr_key != FILL_VALUE_KEY :
                 setattr(out_var_obj, attr_key, variable_attr_info[attr_key])
 
-        # set the variable data
-        out_var_obj[:] = raw_data
+        var_stats = VariableStatistics(var_name, variable_attr_info) if validate else None
+
+        # the fill value may have changed if the variable was narrowed
+        in_fill_value = in_file_info[VAR_INFO_KEY][var_name][VAR_ATTRS_KEY].get(FILL_VALUE_KEY)
+
+        # if this is a packed variable, create the variables its fields will be unpacked into
+        flag_vars = [ ]
+        if unpack_flags :
+            var_dims  = variable_dimensions_info[var_name]
+            var_shape = in_file_info[VAR_INFO_KEY][var_name][SHAPE_KEY]
+            for field_name, field_layout in flag_fields_for_variable(var_name, var_shape) :
+                flag_var_name = flag_variable_name(var_name, field_name)
+                flag_storage  = storage_settings_for_variable(flag_var_name, var_dims[:2], dimensions_info,
+                                                              compression_level, storage_settings, var_shape[:2])
+                # the flags are already the narrowest type and hold no real values to quantize
+                flag_storage.pop(NARROW_TYPE_KEY, None)
+                flag_storage.pop(LEAST_SIG_DIGIT_KEY, None)
+                flag_var_obj  = out_file.createVariable(flag_var_name, numpy.uint8, var_dims[:2], **flag_storage)
+                flag_var_obj.set_auto_maskandscale(False)
+                flag_attrs    = flag_variable_attributes(var_name, field_name, field_layout)
+                for attr_key in sorted(flag_attrs.keys()) :
+                    setattr(flag_var_obj, attr_key, flag_attrs[attr_key])
+                flag_vars.append((field_layout, flag_var_obj))
+
+        # if this variable gets overviews, create a variable for each of them
+        overview_vars = [ ]
+        if var_name in overview_var_names :
+            flag_values = variable_attr_info.get(FLAG_VALS_ATTR_NAME)
+            for factor in overview_factors :
+                overview_dims    = tuple(overview_name(dim_name, factor) for dim_name in [LINES_DIM_NAME, ELEMS_DIM_NAME])
+                overview_storage = dict(var_storage)
+                overview_storage[CHUNKSIZES_KEY] = (min(DEFAULT_CHUNK_LINES, len(out_file.dimensions[overview_dims[0]])),
+                                                    min(DEFAULT_CHUNK_ELEMS, len(out_file.dimensions[overview_dims[1]])))
+                overview_var_obj = out_file.createVariable(overview_name(var_name, factor), data_type, overview_dims,
+                                                           fill_value=fill_value_temp, **overview_storage)
+                overview_var_obj.set_auto_maskandscale(False)
+                overview_attrs   = overview_attributes(var_name, variable_attr_info, factor)
+                for attr_key in sorted(overview_attrs.keys()) :
+                    setattr(overview_var_obj, attr_key, overview_attrs[attr_key])
+                overview_vars.append((factor, flag_values, overview_var_obj))
+            setattr(out_var_obj, OVERVIEWS_ATTR_NAME, " ".join(overview_var_obj.name for _, _, overview_var_obj in overview_vars))
+
+        variable_outputs[var_name] = (out_var_obj, data_type, fill_value_temp, in_fill_value, var_stats, flag_vars, overview_vars)
+
+    # put the data for each of the variables in the file
+    for var_name, start_line, raw_data in data_blocks :
+
+        out_var_obj, data_type, fill_value_temp, in_fill_value, var_stats, flag_vars, overview_vars = variable_outputs[var_name]
+
+        # convert the data to a narrower type if needed, moving any fill values to the new fill value
+        if raw_data.dtype != data_type :
+            if in_fill_value is not None and in_fill_value != fill_value_temp :
+                raw_data = numpy.where(raw_data == in_fill_value, fill_value_temp, raw_data)
+            raw_data = raw_data.astype(data_type)
+
+        # check this block of data while we have it
+        if var_stats is not None :
+            var_stats.add_block(raw_data)
+
+        # set this block of the variable data
+        write_start_time = time.time()
+        out_var_obj[start_line:start_line + raw_data.shape[0]] = raw_data
+        if metrics is not None :
+            metrics.add_write(var_name, raw_data.nbytes, time.time() - write_start_time)
+
+        # unpack any fields in this block of packed data
+        for field_layout, flag_var_obj in flag_vars :
+            write_start_time = time.time()
+            flag_data = unpack_field(raw_data, field_layout)
+            flag_var_obj[start_line:start_line + flag_data.shape[0]] = flag_data
+            if metrics is not None :
+                metrics.add_write(flag_var_obj.name, flag_data.nbytes, time.time() - write_start_time)
+
+        # reduce this block into each of the overviews
+        for factor, flag_values, overview_var_obj in overview_vars :
+            write_start_time = time.time()
+            overview_data = reduce_block(raw_data, factor, fill_value_temp, flag_values)
+            overview_start = start_line // factor
+            overview_var_obj[overview_start:overview_start + overview_data.shape[0]] = overview_data
+            if metrics is not None :
+                metrics.add_write(overview_var_obj.name, overview_data.nbytes, time.time() - write_start_time)
 
-    return out_file
+    for var_name in variable_dimensions_info.keys() :
+        out_var_obj, var_stats = variable_outputs[var_name][0], variable_outputs[var_name][4]
+        if var_stats is not None :
+            _finish_statistics(out_var_obj, var_stats)
 
-def hdf4_2_netcdf4(out_path, files_list):
-    """convert Geocat output hdf4 file(s) to netcdf4 file(s)
-    Given a list of files that are output hdf4 files from Geocat,
-    convert them to netcdf4 files and save them in the output directory.
+def geolocation_hash (in_file_obj, in_file_info, geo_var_names, copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE) :
+    """
+    calculate a hash of the shape, type and data of the geolocation variables in an input file,
+    reading the data in blocks so the whole arrays don't have to be in memory at once
+    """
 
-    Note: It is assumed that all the files given in files_list are existing
-    files of the appropriate hdf4 format.
+    geo_hash = hashlib.blake2b(digest_size=16)
+
+    for var_name in geo_var_names :
+        in_var_obj = in_file_obj.select(var_name)
+        var_shape  = in_file_info[VAR_INFO_KEY][var_name][SHAPE_KEY]
+        item_size  = hdf4_type_size(in_var_obj.info()[3])
+        geo_hash.update((var_name + str(tuple(var_shape)) + str(in_var_obj.info()[3])).encode("utf-8"))
+        var_offset = in_file_info[VAR_INFO_KEY][var_name].get(OFFSET_KEY)
+        for start_line, raw_data in read_variable_blocks(in_var_obj, var_shape, item_size, copy_buffer_size,
+                                                         offset=var_offset) :
+            geo_hash.update(raw_data.tobytes())
+        in_var_obj.endaccess()
+
+    return geo_hash.hexdigest()
+
+# the shared geolocation files this process has already found or written
+_KNOWN_SHARED_GEO_FILES = set([ ])
+
+def cached_geolocation_hash (in_file_obj, in_file_info, geo_var_names, file_path, geo_hash_cache,
+                             copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE) :
+    """
+    get the geolocation_hash of an input file, from the cache if the file at file_path hasn't changed
+    since it was last hashed; otherwise the geolocation is read and hashed and the result is cached
     """
 
-    code_to_return = 0
+    geo_layout = [(var_name, tuple(in_file_info[VAR_INFO_KEY][var_name][SHAPE_KEY]),
+                   in_file_info[VAR_INFO_KEY][var_name].get(OFFSET_KEY)) for var_name in geo_var_names]
+    signature  = input_file_signature(file_path, geo_layout)
 
-    # warn the user if no files were given as input
-    if len(files_list) <= 0 :
-        LOG.warn("No files were listed in the command line input. No file processing will be done.")
-        code_to_return = 1
+    geo_hash = geo_hash_cache.get(GEO_HASH_CACHE_KIND, signature)
+    if geo_hash is None :
+        geo_hash = geolocation_hash(in_file_obj, in_file_info, geo_var_names, copy_buffer_size)
+        geo_hash_cache.put(GEO_HASH_CACHE_KIND, signature, geo_hash)
 
-    # process each file the user wants converted separately
-    for file_path in files_list :
+    return geo_hash
+
+def share_geolocation (in_file_obj, in_file_info, shared_geo_dir, out_path, copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE,
+                       compression_level=DEFAULT_COMPRESSION_LEVEL, storage_settings=None, schema_cache=None,
+                       read_ahead_size=0, file_path=None) :
+    """
+    move the geolocation variables of an input file out to a shared geolocation file
+
+    The geolocation data is hashed and the shared file is named after the hash, so files with
+    identical geolocation share one file; if a file with that hash already exists (from this run
+    or an earlier one) it is reused, otherwise it is written. The geolocation variables are then
+    removed from in_file_info and global attributes referencing the shared file are added.
 
-        # check that the output directory and the input directories are not the same
-        # for now just warn the user if they are
-        in_dir  = os.path.split(file_path)[0]
-        in_file_name = os.path.split(file_path)[1]
-        out_dir = clean_path(out_path)
-        if in_dir == out_dir :
-            LOG.warn("Output file will be placed in the same directory used for input: " + in_dir)
+    If the file_path of the input is given, its geolocation hash is cached by the path, size and
+    modification time of the file, so later runs don't have to read the geolocation again. The hash
+    is kept in the schema cache directory, or in SHARED_GEO_CACHE_DIR_NAME in the shared_geo_dir if
+    schema_cache is only kept in memory.
 
-        LOG.info("Attempting to convert file: " + file_path)
+    Returns the path to the shared geolocation file, or None if the input has no geolocation.
+    """
+
+    geo_var_names = [var_name for var_name in GEOLOCATION_VAR_NAMES if var_name in in_file_info[VAR_INFO_KEY]]
+    if len(geo_var_names) <= 0 :
+        LOG.debug("No geolocation variables found to share.")
+        return None
 
-        in_file_object  = None
-        out_file_object = None
-        in_file_info    = None
+    # figure out which shared file this geolocation belongs in
+    if file_path is None :
+        geo_hash = geolocation_hash(in_file_obj, in_file_info, geo_var_names, copy_buffer_size)
+    else :
+        geo_hash_cache = schema_cache
+        if geo_hash_cache is None or geo_hash_cache.cache_dir is None :
+            geo_hash_cache = get_schema_cache(os.path.join(shared_geo_dir, SHARED_GEO_CACHE_DIR_NAME))
+        geo_hash = cached_geolocation_hash(in_file_obj, in_file_info, geo_var_names, file_path, geo_hash_cache,
+                                           copy_buffer_size)
+    shared_geo_path = os.path.join(shared_geo_dir, SHARED_GEO_FILE_PREFIX + geo_hash + OUT_FILE_SUFFIX)
+
+    if shared_geo_path not in _KNOWN_SHARED_GEO_FILES and not os.path.exists(shared_geo_path) :
+        LOG.info("Writing new shared geolocation file: " + shared_geo_path)
+
+        # the shared file gets the geolocation variables and the global attributes that aren't specific to this file
+        geo_file_info = {
+                            GLOBAL_ATTRS_KEY: dict((attr_key, attr_val) for attr_key, attr_val
+                                                   in in_file_info[GLOBAL_ATTRS_KEY].items()
+                                                   if attr_key != IMAGE_DATETIME_ATTR_NAME),
+                            VAR_LIST_KEY:     geo_var_names,
+                            VAR_INFO_KEY:     dict((var_name, in_file_info[VAR_INFO_KEY][var_name])
+                                                   for var_name in geo_var_names),
+                        }
+        geo_file_info[GLOBAL_ATTRS_KEY][GEOLOCATION_HASH_ATTR_NAME] = geo_hash
+
+        # write to a temporary file and rename it, so other processes never see a partial file
+        temp_handle, temp_path = tempfile.mkstemp(dir=shared_geo_dir, suffix=OUT_FILE_SUFFIX + ".tmp")
+        os.close(temp_handle)
         try :
-            # extract file information
-            in_file_info, in_file_object = read_hdf4_info(file_path)
-        except HDF4Error :
-            LOG.warn("Unable to open input file (" + file_path + ") due to HDF4Error.")
-            code_to_return = 2
+            geo_file_obj = write_netCDF4_file(in_file_obj, geo_file_info, temp_path,
+                                              copy_buffer_size=copy_buffer_size,
+                                              compression_level=compression_level,
+                                              storage_settings=storage_settings,
+                                              schema_cache=schema_cache,
+                                              read_ahead_size=read_ahead_size)
+            geo_file_obj.close()
+            os.replace(temp_path, shared_geo_path)
+        finally :
+            if os.path.exists(temp_path) :
+                os.remove(temp_path)
+    else :
+        LOG.debug("Using existing shared geolocation file: " + shared_geo_path)
+    _KNOWN_SHARED_GEO_FILES.add(shared_geo_path)
+
+    # take the geolocation out of this file and point to the shared file instead
+    for var_name in geo_var_names :
+        del in_file_info[VAR_INFO_KEY][var_name]
+    in_file_info[VAR_LIST_KEY] = list(in_file_info[VAR_INFO_KEY].keys())
+    in_file_info[GLOBAL_ATTRS_KEY][GEOLOCATION_FILE_ATTR_NAME] = os.path.relpath(shared_geo_path, clean_path(out_path))
+    in_file_info[GLOBAL_ATTRS_KEY][GEOLOCATION_HASH_ATTR_NAME] = geo_hash
+    in_file_info[GLOBAL_ATTRS_KEY][EXTERNAL_VARS_ATTR_NAME]    = " ".join(geo_var_names)
+
+    return shared_geo_path
+
+def temporary_output_path(output_path) :
+    """
+    figure out the temporary path to write an output file to before it is renamed into place; the
+    name includes the host and process, so processes on different nodes never write to the same one
+    """
+    from shards import process_tag
+
+    return output_path + "." + process_tag() + TEMP_FILE_SUFFIX
+
+def output_file_path(out_path, file_path) :
+    """
+    figure out the full path (with name) of the output file for an input file
+    (compressed input files are named for the file they hold)
+    """
+    from decompress import decompressed_name
+
+    in_file_name  = decompressed_name(file_path)
+    new_file_name = os.path.splitext(in_file_name)[0] + OUT_FILE_SUFFIX
+
+    return os.path.join(clean_path(out_path), new_file_name)
+
+def convert_file(out_path, file_path, copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE,
+                 compression_level=DEFAULT_COMPRESSION_LEVEL, storage_settings=None, schema_cache_dir=None,
+                 shared_geo_dir=None, read_ahead_size=0, metrics=None, validate=False, unpack_flags=False,
+                 include_patterns=None, exclude_patterns=None, line_range=None, element_range=None, bbox=None,
+                 overview_factors=None, overview_patterns=None, source_path=None) :
+    """convert a single Geocat output hdf4 file to a netcdf4 file in the output directory
+
+    The input and output files are opened and closed within this call, so it is safe to run
+    several of these at once in separate processes (pyhdf file handles can't be shared).
 
-        # make any changes needed for CF compliance
-        compliance_cleanup(in_file_info)
+    copy_buffer_size limits how much variable data is held in memory at once, compression_level
+    and storage_settings control compression and chunking of the output, and read_ahead_size sets
+    how much data may be read ahead while writing, see write_netCDF4_file.
 
-        # figure out the full path (with name) for the new output file
-        new_file_name = os.path.splitext(in_file_name)[0] + OUT_FILE_SUFFIX
-        new_file_path = os.path.join(out_dir, new_file_name)
+    Metadata processing results are cached by file schema for the life of the process, and
+    also saved in schema_cache_dir if that is given, so they can be reused by other runs.
 
-        if os.path.exists(new_file_path) :
-            LOG.warn("Output file already exists, old version of file will be destroyed: " + new_file_path)
-            code_to_return = 3
+    If shared_geo_dir is given, the geolocation will be written to a shared file in that
+    directory instead of the output file, see share_geolocation.
 
+    Only the variables matching include_patterns (if given) and not matching exclude_patterns
+    are converted. If a line_range and/or element_range (first, last + 1) or a latitude/longitude
+    bbox (west, south, east, north) is given, only that window of the data is read and written,
+    see subset_file_info. If the window has no data in it, no output file is written.
+
+    If a ConversionMetrics object is given as metrics, the time spent in each stage of the
+    conversion and the bytes read and written will be recorded in it.
+
+    If validate is True, the data will be checked against the valid ranges as it is copied, and
+    if unpack_flags is True, packed variables will also be unpacked into flag variables, see
+    write_netCDF4_file. If overview_factors are given, downsampled overviews of the image variables
+    matching overview_patterns are also written, see write_netCDF4_file.
+
+    If file_path is a decompressed copy of a compressed input file, source_path should be the compressed
+    file; the output is named after it and it is the path reported to the user.
+
+    Returns the return code for this file, using the same codes as hdf4_2_netcdf4.
+    """
+
+    code_to_return = 0
+    if source_path is None :
+        source_path = file_path
+
+    # check that the output directory and the input directories are not the same
+    # for now just warn the user if they are
+    in_dir  = os.path.split(source_path)[0]
+    out_dir = clean_path(out_path)
+    if in_dir == out_dir :
+        LOG.warn("Output file will be placed in the same directory used for input: " + in_dir)
+
+    LOG.info("Attempting to convert file: " + source_path)
+
+    from pyhdf.SD import HDF4Error
+
+    in_file_object  = None
+    out_file_object = None
+    in_file_info    = None
+    try :
+        # extract file information
+        with time_stage(metrics, OPEN_STAGE) :
+            in_file_info, in_file_object = read_hdf4_info(file_path)
+    except HDF4Error :
+        LOG.warn("Unable to open input file (" + source_path + ") due to HDF4Error.")
+        if metrics is not None :
+            metrics.finish(2)
+        return 2
+
+    # get the schema cache, or do without it if it can't be set up
+    try :
+        schema_cache = get_schema_cache(schema_cache_dir)
+    except Exception as err :
+        LOG.warn("Unable to use schema cache directory (" + str(schema_cache_dir) + "): " + str(err)
+                 + ". Metadata results will only be cached in memory.")
+        schema_cache = get_schema_cache(None)
+
+    # make any changes needed for CF compliance
+    with time_stage(metrics, METADATA_STAGE) :
+        compliance_cleanup(in_file_info, schema_cache=schema_cache)
+
+    # cut the file down to the variables and region that were asked for
+    if include_patterns or exclude_patterns or line_range is not None or element_range is not None or bbox is not None :
+        from subset import subset_file_info
         try :
-            # create the output file and write the appropriate data and attributes to the new file
-            out_file_object = write_netCDF4_file (in_file_object, in_file_info, new_file_path)
+            with time_stage(metrics, METADATA_STAGE) :
+                has_data = subset_file_info(in_file_object, in_file_info,
+                                            include_patterns=include_patterns,
+                                            exclude_patterns=exclude_patterns,
+                                            line_range=line_range,
+                                            element_range=element_range,
+                                            bbox=bbox,
+                                            copy_buffer_size=copy_buffer_size,
+                                            schema_cache=schema_cache)
         except Exception :
-            LOG.warn("Unable to create output file (" + new_file_path + ").")
-            code_to_return = 4
+            LOG.warn("Unable to subset input file (" + source_path + ").")
+            in_file_object.end()
+            if metrics is not None :
+                metrics.finish(4)
+            return 4
+        if not has_data :
+            LOG.warn("Nothing in input file (" + source_path + ") is in the requested subset. No output will be written.")
+            in_file_object.end()
+            if metrics is not None :
+                metrics.finish(0)
+            return 0
 
-        # close both the old and new files
+    # if the geolocation is shared between files, move it to the shared file
+    if shared_geo_dir is not None :
+        try :
+            with time_stage(metrics, GEOLOCATION_STAGE) :
+                share_geolocation(in_file_object, in_file_info, shared_geo_dir, out_dir,
+                                  copy_buffer_size=copy_buffer_size,
+                                  compression_level=compression_level,
+                                  storage_settings=storage_settings,
+                                  schema_cache=schema_cache,
+                                  read_ahead_size=read_ahead_size,
+                                  file_path=source_path)
+        except Exception :
+            LOG.warn("Unable to write shared geolocation file for " + source_path + ". "
+                     + "The geolocation will be kept in the output file.")
+
+    # figure out the full path (with name) for the new output file
+    new_file_path = output_file_path(out_dir, source_path)
+
+    if os.path.exists(new_file_path) :
+        LOG.warn("Output file already exists, old version of file will be destroyed: " + new_file_path)
+        code_to_return = 3
+
+    # the output is written under a temporary name and renamed once it is complete,
+    # so no one ever sees a partly written file at the output path
+    temp_file_path = temporary_output_path(new_file_path)
+
+    try :
+        # create the output file and write the appropriate data and attributes to the new file
+        out_file_object = write_netCDF4_file (in_file_object, in_file_info, temp_file_path,
+                                              copy_buffer_size=copy_buffer_size,
+                                              compression_level=compression_level,
+                                              storage_settings=storage_settings,
+                                              schema_cache=schema_cache,
+                                              read_ahead_size=read_ahead_size,
+                                              metrics=metrics,
+                                              validate=validate,
+                                              unpack_flags=unpack_flags,
+                                              overview_factors=overview_factors,
+                                              overview_patterns=overview_patterns)
+    except Exception :
+        LOG.warn("Unable to create output file (" + new_file_path + ").")
+        code_to_return = 4
+
+    # close both the old and new files, and put the new file in place
+    with time_stage(metrics, CLOSE_STAGE) :
         if in_file_object  is not None :
             in_file_object.end()
-        if out_file_object is not None :
-            out_file_object.close()
+        try :
+            if out_file_object is not None :
+                out_file_object.close()
+                os.replace(temp_file_path, new_file_path)
+        except Exception :
+            LOG.warn("Unable to finish output file (" + new_file_path + ").")
+            code_to_return = 4
+        finally :
+            if os.path.exists(temp_file_path) :
+                os.remove(temp_file_path)
+
+    if metrics is not None :
+        metrics.finish(code_to_return, new_file_path)
+
+    return code_to_return
+
+def _convert_file_in_worker(worker_args) :
+    """
+    unpack the arguments for convert_file and run it, collecting metrics if they were asked for;
+    used to convert each file in hdf4_2_netcdf4 (both with and without a process pool)
+
+    if lock_output is True, the file is only converted if we can take the lock file for its output
+    (see acquire_lock), otherwise LOCKED_RETURN_CODE is returned for it
+
+    local_path is the decompressed copy of a compressed file (see decompressed_inputs), which is
+    removed once it's converted; if it is None and the file is compressed, it will be decompressed
+    to a temporary directory here
+
+    returns the file path, the return code for the file and its metrics as a dictionary (or None)
+    """
+    out_path, file_path, collect_metrics, convert_options, lock_output, local_path = worker_args
+
+    file_metrics = ConversionMetrics(file_path) if collect_metrics else None
+
+    lock          = None
+    scratch_space = None
+    try :
+        if lock_output :
+            from shards import acquire_lock
+            lock = acquire_lock(output_file_path(out_path, file_path))
+            if lock is None :
+                LOG.info("Another process is converting file (" + file_path + "). It will be skipped.")
+                return file_path, LOCKED_RETURN_CODE, None
+
+        if local_path is None :
+            from decompress import compression_suffix, ScratchSpace
+            local_path = file_path
+            if compression_suffix(file_path) is not None :
+                scratch_space = ScratchSpace()
+                local_path    = scratch_space.decompress(file_path)
+        file_code = convert_file(out_path, local_path, metrics=file_metrics, source_path=file_path, **convert_options)
+    finally :
+        # let go of the decompressed copy, if there is one
+        if scratch_space is not None :
+            scratch_space.close()
+        elif local_path is not None and local_path != file_path and os.path.exists(local_path) :
+            os.remove(local_path)
+        if lock is not None :
+            from shards import release_lock
+            release_lock(lock)
+
+    return file_path, file_code, (file_metrics.to_dict() if file_metrics is not None else None)
+
+def merge_return_codes(return_codes, code_to_return=0) :
+    """
+    merge the per-file return codes from convert_file into a single return code
+
+    The files are considered in the order given and the last non-zero code wins, which
+    matches what happens when the files are converted one after another.
+    """
+
+    for file_code in return_codes :
+        if file_code != 0 :
+            code_to_return = file_code
+
+    return code_to_return
+
+def hdf4_2_netcdf4(out_path, files_list, jobs=1, manifest_path=None, use_hash=False,
+                   metrics_path=None, prometheus_path=None, memory_budget=None, shard=None, lock_outputs=False,
+                   scratch_dir=None, scratch_size=DEFAULT_SCRATCH_SIZE, **convert_options):
+    """convert Geocat output hdf4 file(s) to netcdf4 file(s)
+    Given a list of files that are output hdf4 files from Geocat,
+    convert them to netcdf4 files and save them in the output directory.
+
+    If jobs is more than 1, up to that many files will be converted at the same time
+    in a pool of worker processes. Each worker opens its own input and output files.
+    If jobs is 0 or None, one worker per available cpu will be used.
+
+    If a memory_budget (in bytes) is given as well, each file is only started once the memory it is
+    estimated to need (from the variable shapes in its header) is free in the budget, see
+    scheduled_conversions; otherwise the workers take the next file as soon as they are free.
+
+    If a manifest_path is given, files that the manifest shows were already converted (by this
+    version of the converter with the same output options, and have not changed since) will be skipped, and each file that is
+    converted successfully will be recorded in the manifest. If use_hash is True, the contents of
+    the input files will be compared as well as their size and modification time.
+
+    If a metrics_path is given, a JSON summary of the time spent in each stage of the conversion and the
+    bytes read and written for each file will be written there. If a prometheus_path is given, the run totals
+    will be written there in the Prometheus text format (for the node exporter's textfile collector).
+
+    If a shard (K, N) is given, only the files in that shard are converted (see in_shard), so N runs
+    with shards 0 to N-1 split the files between them without any overlap. If lock_outputs is True, a
+    lock file is held for each output while it is converted, and files whose outputs are locked by
+    another process are skipped.
+
+    Compressed input files (see COMPRESSION_MODULES) are decompressed into a scratch directory made in
+    scratch_dir (or the system's temporary directory), holding at most about scratch_size bytes at once.
+    The next compressed file is decompressed while the current one is converted, and each decompressed
+    copy is removed once it has been converted.
+
+    Any other keyword arguments (such as copy_buffer_size) are passed on to convert_file for each file.
+
+    files_list may be any iterable, such as the generator from iter_input_files, in which case
+    conversion starts as soon as the first files are found.
+
+    Note: It is assumed that all the files given in files_list are existing
+    files of the appropriate hdf4 format.
+    """
+
+    code_to_return  = 0
+    run_start_time  = time.time()
+    collect_metrics = metrics_path is not None or prometheus_path is not None
+
+    # keep track of how many files we were given and how many we skip
+    file_counts = {"given": 0, "skipped": 0, "other_shards": 0, "locked": 0}
+    def _count_files (file_paths) :
+        for file_path in file_paths :
+            file_counts["given"] += 1
+            yield file_path
+    files_to_convert = _count_files(files_list)
+
+    # if we're only converting one shard of the files, skip the files in the other shards
+    if shard is not None :
+        from shards import in_shard
+        def _skip_other_shards (file_paths) :
+            for file_path in file_paths :
+                if in_shard(file_path, shard) :
+                    yield file_path
+                else :
+                    file_counts["other_shards"] += 1
+        files_to_convert = _skip_other_shards(files_to_convert)
+
+    # if we're keeping a manifest, skip any files that are already up to date
+    manifest = None
+    if manifest_path is not None :
+        manifest = ConversionManifest(manifest_path, converter_build_version(), use_hash=use_hash,
+                                      options_hash=conversion_options_hash(convert_options))
+        def _skip_current_files (file_paths) :
+            for file_path in file_paths :
+                if manifest.is_current(file_path, output_file_path(out_path, file_path)) :
+                    file_counts["skipped"] += 1
+                else :
+                    yield file_path
+        files_to_convert = _skip_current_files(files_to_convert)
+
+    # figure out how many processes we should use
+    if not jobs :
+        jobs = multiprocessing.cpu_count()
+    if hasattr(files_list, "__len__") :
+        jobs = min(jobs, len(files_list))
+    jobs = max(1, jobs)
+
+    # decompress any compressed files ahead of converting them
+    from decompress import ScratchSpace, decompressed_inputs
+    scratch_space = ScratchSpace(scratch_dir, scratch_size)
+    files_to_convert = decompressed_inputs(files_to_convert, scratch_space)
+
+    # process each file the user wants converted separately
+    worker_pool = None
+    worker_args = ((out_path, file_path, collect_metrics, convert_options, lock_outputs, local_path)
+                   for file_path, local_path in files_to_convert)
+    if jobs <= 1 :
+        file_results = (_convert_file_in_worker(file_args) for file_args in worker_args)
+    else :
+        LOG.info("Converting files using " + str(jobs) + " worker processes.")
+        worker_pool = multiprocessing.Pool(processes=jobs)
+        if memory_budget :
+            from scheduler import scheduled_conversions
+            LOG.info("Starting files within a memory budget of " + str(memory_budget // (1024 * 1024)) + " MB.")
+            file_results = scheduled_conversions(worker_pool, worker_args, memory_budget, jobs)
+        else :
+            # imap keeps the results in the same order as the input files
+            file_results = worker_pool.imap(_convert_file_in_worker, worker_args)
+
+    # collect the results as each file finishes
+    collected_codes   = [ ]
+    collected_metrics = [ ]
+    try :
+        for file_path, file_code, file_metrics in file_results :
+            # files another process is converting aren't counted for or against this run
+            if file_code == LOCKED_RETURN_CODE :
+                file_counts["locked"] += 1
+                continue
+            collected_codes.append(file_code)
+            if file_metrics is not None :
+                collected_metrics.append(file_metrics)
+            # codes 0 and 3 (the old output was replaced) mean the file was converted
+            if manifest is not None and file_code in (0, 3) :
+                manifest.record(file_path, output_file_path(out_path, file_path))
+    finally :
+        if worker_pool is not None :
+            worker_pool.close()
+            worker_pool.join()
+        scratch_space.close()
+
+    # warn the user if no files were given as input
+    if file_counts["given"] <= 0 :
+        LOG.warn("No files were listed in the command line input. No file processing will be done.")
+        code_to_return = 1
+    if file_counts["skipped"] > 0 :
+        LOG.info("Skipped " + str(file_counts["skipped"]) + " files that were already up to date.")
+    if file_counts["other_shards"] > 0 :
+        LOG.info("Left " + str(file_counts["other_shards"]) + " files for the other shards.")
+    if file_counts["locked"] > 0 :
+        LOG.info("Skipped " + str(file_counts["locked"]) + " files that another process was converting.")
+
+    code_to_return = merge_return_codes(collected_codes, code_to_return)
+
+    # report the metrics for the run
+    if collect_metrics :
+        summary = run_summary(collected_metrics, time.time() - run_start_time, code_to_return)
+        if metrics_path is not None :
+            write_json_summary(metrics_path, summary)
+        if prometheus_path is not None :
+            write_prometheus_textfile(prometheus_path, summary)
 
     return code_to_return
 
@@ -563,6 +1822,12 @@ def main():
     import argparse
     description_text = """
     Convert Geocat hdf4 output files to the netCDF4 format.
+
+    Storage settings for the variables matching a name pattern are given with --storage in the form
+    "pattern:key=value,key=value", using the keys complevel (the zlib compression level), shuffle (0 or 1),
+    chunks (chunk sizes such as 512x512), narrow (1 to store integer data in the smallest integer type that
+    holds its actual range, which is lossless) and digits (the number of decimal places of float data to
+    keep, in the units of the unpacked data, which is lossy).
     """
 
     # create the argument parser
@@ -575,6 +1840,71 @@ def main():
                         help='the path to the output directory; will be created if it does not exist')
     parser.add_argument('-d', '--dirs', dest='do_search_dirs', default=False, action='store_true',
                         help='search any directories given in the files list for files that can be processed')
+    parser.add_argument('--files-from', dest='files_from', type=str, default=None,
+                        help='read a list of input files (one per line) from this file, or from stdin if this is "-"; '
+                             'listed files are used as they are, without searching any directories')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='the number of files to convert at the same time; 0 will use one process per cpu (default 1)')
+    parser.add_argument('--memory-budget', dest='memory_budget', type=float, default=0,
+                        help='the total memory (in MB) the conversions running at the same time may use; each file is '
+                             'only started once the memory estimated from its variable shapes is free, so large and '
+                             'small files can share the workers; 0 for no budget (default %(default)s)')
+    parser.add_argument('-b', '--buffer-size', dest='buffer_size', type=float,
+                        default=DEFAULT_COPY_BUFFER_SIZE / (1024.0 * 1024.0),
+                        help='the maximum amount of variable data (in MB) to hold in memory at once while copying; '
+                             '0 will copy each variable in one piece (default %(default)s)')
+    parser.add_argument('--read-ahead', dest='read_ahead', type=float, default=0,
+                        help='read up to this much variable data (in MB) in a background thread while writing, '
+                             'so reading and writing overlap; 0 to read and write in turn (default %(default)s)')
+    parser.add_argument('-z', '--compress', dest='compression_level', type=int, default=DEFAULT_COMPRESSION_LEVEL,
+                        help='the zlib compression level (1-9) to use for all output variables; 0 for no compression '
+                             '(default %(default)s)')
+    parser.add_argument('--storage', dest='storage_settings', type=str, action='append', default=[ ],
+                        help='compression, chunking and packing settings for variables matching a name pattern, in the form '
+                             '"pattern:complevel=N,shuffle=0|1,chunks=AxB,narrow=0|1,digits=D"; narrow=1 stores integer '
+                             'data in the smallest type that holds its range (lossless) and digits=D keeps D decimal '
+                             'places of float data (lossy); may be given more than once')
+    parser.add_argument('--validate', dest='validate', default=False, action='store_true',
+                        help='check the data against the valid range of each variable as it is copied, saving counts of '
+                             'fill and out of range values and the actual range and mean in the variable attributes '
+                             '(and in the --metrics report)')
+    # FUTURE, add an --unpack-flags option to turn on unpack_flags once PACKED_FLAGS_MAP has the bit layouts
+    #         of the cloud mask and cloud type test results; until then it would never unpack anything
+    parser.add_argument('--overviews', dest='overview_factors', type=str, default=None,
+                        help='also write downsampled overviews of the image variables at these factors, in the form '
+                             '"2,4,8", for quick looks at the data without reading the full resolution variables')
+    parser.add_argument('--overview-vars', dest='overview_patterns', type=str, action='append', default=[ ],
+                        help='only write overviews of variables whose names match this pattern; may be given more than once')
+    parser.add_argument('--include', dest='include_patterns', type=str, action='append', default=[ ],
+                        help='only convert variables whose names match this pattern; may be given more than once')
+    parser.add_argument('--exclude', dest='exclude_patterns', type=str, action='append', default=[ ],
+                        help='do not convert variables whose names match this pattern; may be given more than once')
+    parser.add_argument('--lines', dest='line_range', type=str, default=None,
+                        help='only read and write this range of lines, in the form "first:last" (last not included)')
+    parser.add_argument('--elements', dest='element_range', type=str, default=None,
+                        help='only read and write this range of elements, in the form "first:last" (last not included)')
+    parser.add_argument('--bbox', dest='bbox', type=str, default=None,
+                        help='only read and write the lines and elements covering this latitude/longitude box, '
+                             'in the form "west,south,east,north" (in degrees); overrides --lines and --elements')
+    parser.add_argument('--cache-dir', dest='cache_dir', type=str, default=None,
+                        help='a directory to save metadata processing results in, so they can be reused for '
+                             'files with the same variables in later runs; will be created if it does not exist')
+    parser.add_argument('--manifest', dest='manifest', type=str, default=None,
+                        help='a manifest file to record conversions in; input files that the manifest shows are '
+                             'already converted and unchanged will be skipped')
+    parser.add_argument('--manifest-hash', dest='manifest_hash', default=False, action='store_true',
+                        help='compare the contents of input files (not just their size and modification time) '
+                             'when checking the manifest')
+    parser.add_argument('--shared-geo', dest='shared_geo_dir', type=str, default=None,
+                        help='write the geolocation (latitude and longitude) to shared files in this directory, '
+                             'one per distinct geolocation, instead of copying it into every output file; '
+                             'will be created if it does not exist')
+    parser.add_argument('--metrics', dest='metrics', type=str, default=None,
+                        help='write a JSON summary of the time spent in each stage and the bytes read and written '
+                             'for each file to this path')
+    parser.add_argument('--prometheus', dest='prometheus', type=str, default=None,
+                        help='write the run totals to this path in the Prometheus text format, '
+                             'for the node exporter textfile collector')
     parser.add_argument('-n', '--version', dest='version', action='store_true', default=False,
                         help='display the version number of the installed version of the program')
 
@@ -584,7 +1914,52 @@ def main():
     parser.add_argument('--debug', dest="debug_mode", default=False, action='store_true',
                         help="Enter debug mode. Overrides the verbose command line.")
 
-    # FUTURE, add command line options to handle data aggregation
+    # data aggregation options
+    parser.add_argument('-a', '--aggregate', dest='aggregate', default=False, action='store_true',
+                        help='combine input files with the same variables into one output file per group, '
+                             'along an unlimited time dimension, instead of converting each file separately')
+
+    # catalog options
+    parser.add_argument('--inventory', dest='inventory', type=str, default=None,
+                        help='instead of converting the input files, read only their headers and write a catalog of '
+                             'their times, dimensions and variables to this path, as JSON lines or as an SQLite '
+                             'database if the path ends in .sqlite or .db')
+
+    # options for compressed input files
+    parser.add_argument('--scratch-dir', dest='scratch_dir', type=str, default=None,
+                        help='the directory to decompress compressed input files (' + ", ".join(COMPRESSED_INPUT_TYPES)
+                             + ') into, ideally on a tmpfs (default is the system temporary directory)')
+    parser.add_argument('--scratch-size', dest='scratch_size', type=float, default=DEFAULT_SCRATCH_SIZE / (1024.0 * 1024.0),
+                        help='the most decompressed data (in MB) to keep in the scratch directory at once '
+                             '(default %(default)s)')
+
+    # options for splitting the work between nodes
+    parser.add_argument('--shard', dest='shard', type=str, default=None,
+                        help='only convert the files in shard K of N, in the form "K/N" (K from 0 to N-1); files are '
+                             'split by a stable hash of their names, so runs on N nodes with each K share the work')
+    parser.add_argument('--lock', dest='lock_outputs', default=False, action='store_true',
+                        help='hold a lock file next to each output while converting it, and skip files another '
+                             'process holds the lock for')
+
+    # watch options
+    parser.add_argument('--watch', dest='watch_dirs', type=str, action='append', default=[ ],
+                        help='keep running and convert new input files as they arrive in this directory (or its '
+                             'subdirectories), using worker processes that stay up between files; may be given more '
+                             'than once')
+    parser.add_argument('--poll-interval', dest='poll_interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help='how often (in seconds) to look for new files when watching (default %(default)s)')
+    parser.add_argument('--settle-time', dest='settle_time', type=float, default=DEFAULT_SETTLE_TIME,
+                        help='when watching, how long (in seconds) a new file\'s size must stay the same before it is '
+                             'converted; use 0 if files are renamed into place once they are written (default %(default)s)')
+    parser.add_argument('--ready-suffix', dest='ready_suffix', type=str, default=None,
+                        help='when watching, only convert a new file once a marker file with the same name plus this '
+                             'suffix (such as ".done") exists, instead of waiting for its size to settle')
+
+    # refresh options
+    parser.add_argument('--refresh', dest='refresh', default=False, action='store_true',
+                        help='instead of converting hdf4 files, apply the current variable attribute rules to the '
+                             'existing netCDF4 output files given (or found in directories), changing only their '
+                             'attributes in place')
 
     # parse the arguments
     args = parser.parse_args()
@@ -597,24 +1972,128 @@ def main():
     if args.debug_mode : lvl = logging.DEBUG # override if the user specifically asked for debug
     logging.basicConfig(level = lvl)
 
-    # display the version
+    # display the version; if that's all the user asked for, we're done
     if args.version :
-        version_num = pkg_resources.require('geocat_converter')[0].version
+        version_num = converter_version()
         print ("geo_converter version " + str(version_num) + '\n')
+        if not args.files and args.files_from is None :
+            return 0
 
     # create the output path if it doesn't exist
     out_path = clean_path(args.out)
     setup_dir_if_needed(out_path, "output")
 
+    # create the shared geolocation directory if needed
+    shared_geo_dir = clean_path(args.shared_geo_dir)
+    if shared_geo_dir is not None :
+        setup_dir_if_needed(shared_geo_dir, "shared geolocation")
+
     # process through the input files and search any directories for files we can process
-    # Note: this is a recursive search
-    input_files = set([ ])
-    for in_file_path in args.files :
-        input_files.update(search_for_input_files(in_file_path))
-    input_files = list(input_files)
+    # Note: this is a recursive search, and files are passed on to be converted as they are found
+    # Note: when refreshing, the inputs are our netCDF4 output files, and compressed
+    #       inputs are only decompressed for conversions
+    if args.refresh :
+        input_types = [OUT_FILE_SUFFIX[1:]]
+    elif args.inventory is not None or args.aggregate :
+        input_types = INPUT_TYPES
+    else :
+        input_types = INPUT_TYPES + COMPRESSED_INPUT_TYPES
+    input_files = iter_input_files(args.files, input_types)
+    if args.files_from is not None :
+        input_files = itertools.chain(read_files_from(args.files_from, input_types), input_files)
+
+    # parse any per-variable storage settings
+    storage_settings = { }
+    for storage_option in args.storage_settings :
+        var_pattern, settings = parse_storage_option(storage_option)
+        storage_settings[var_pattern] = settings
+
+    # figure out which shard of the files we're converting
+    shard = None
+    if args.shard is not None :
+        from shards import parse_shard
+        shard = parse_shard(args.shard)
+    overview_factors = None
+    if args.overview_factors is not None :
+        from overviews import parse_overview_factors
+        overview_factors = parse_overview_factors(args.overview_factors)
+
+    # parse any subsetting options
+    subset_options = { }
+    if args.include_patterns :
+        subset_options["include_patterns"] = args.include_patterns
+    if args.exclude_patterns :
+        subset_options["exclude_patterns"] = args.exclude_patterns
+    if args.line_range is not None or args.element_range is not None or args.bbox is not None :
+        from subset import parse_index_range, parse_bounding_box
+        if args.line_range is not None :
+            subset_options["line_range"] = parse_index_range(args.line_range)
+        if args.element_range is not None :
+            subset_options["element_range"] = parse_index_range(args.element_range)
+        if args.bbox is not None :
+            subset_options["bbox"] = parse_bounding_box(args.bbox)
+
+    # if the user asked for a refresh, update the attributes of the output files instead of converting
+    if args.refresh :
+        from refresh import refresh_files
+        return refresh_files(input_files, jobs=args.jobs, schema_cache_dir=clean_path(args.cache_dir))
+
+    # if the user asked for an inventory, catalog the files instead of converting them
+    if args.inventory is not None :
+        from inventory import inventory_files
+        return inventory_files(clean_path(args.inventory), input_files, jobs=args.jobs)
+
+    # if the user asked for aggregation, combine the files instead of converting them separately
+    if args.aggregate :
+        from aggregate import aggregate_files
+        return aggregate_files(out_path, input_files,
+                               copy_buffer_size=int(args.buffer_size * 1024 * 1024),
+                               read_ahead_size=int(args.read_ahead * 1024 * 1024),
+                               compression_level=args.compression_level,
+                               storage_settings=storage_settings,
+                               schema_cache_dir=clean_path(args.cache_dir),
+                               **subset_options)
+
+    # if the user asked us to watch directories, convert files as they arrive until we're stopped
+    if args.watch_dirs :
+        from watch import watch_directories
+        watch_dirs = [clean_path(watch_dir) for watch_dir in args.watch_dirs]
+        for watch_dir in watch_dirs :
+            setup_dir_if_needed(watch_dir, "watch")
+        return watch_directories(out_path, watch_dirs, jobs=args.jobs,
+                                 manifest_path=clean_path(args.manifest), use_hash=args.manifest_hash,
+                                 poll_interval=args.poll_interval, settle_time=args.settle_time,
+                                 ready_suffix=args.ready_suffix,
+                                 shard=shard, lock_outputs=args.lock_outputs,
+                                 copy_buffer_size=int(args.buffer_size * 1024 * 1024),
+                                 read_ahead_size=int(args.read_ahead * 1024 * 1024),
+                                 compression_level=args.compression_level,
+                                 storage_settings=storage_settings,
+                                 schema_cache_dir=clean_path(args.cache_dir),
+                                 shared_geo_dir=shared_geo_dir,
+                                 validate=args.validate,
+                                 overview_factors=overview_factors,
+                                 overview_patterns=args.overview_patterns,
+                                 **subset_options)
 
     # try to do the conversion
-    return_code = hdf4_2_netcdf4(out_path, input_files)
+    return_code = hdf4_2_netcdf4(out_path, input_files, jobs=args.jobs,
+                                 manifest_path=clean_path(args.manifest), use_hash=args.manifest_hash,
+                                 metrics_path=clean_path(args.metrics), prometheus_path=clean_path(args.prometheus),
+                                 memory_budget=int(args.memory_budget * 1024 * 1024),
+                                 shard=shard, lock_outputs=args.lock_outputs,
+                                 scratch_dir=clean_path(args.scratch_dir),
+                                 scratch_size=int(args.scratch_size * 1024 * 1024),
+                                 copy_buffer_size=int(args.buffer_size * 1024 * 1024),
+                                 read_ahead_size=int(args.read_ahead * 1024 * 1024),
+                                 compression_level=args.compression_level,
+                                 storage_settings=storage_settings,
+                                 schema_cache_dir=clean_path(args.cache_dir),
+                                 shared_geo_dir=shared_geo_dir,
+                                 validate=args.validate,
+                                 overview_factors=overview_factors,
+                                 overview_patterns=args.overview_patterns,
+                                 **subset_options)
 
     return 0 if return_code is None else return_code
 
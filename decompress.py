@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Routines to decompress compressed input granules (such as .hdf.gz) to a scratch directory.
+
+hdf4 files can only be read from disk, so each compressed granule is streamed through its
+decompressor into a scratch directory (ideally on a tmpfs) before it is converted, and removed
+again once it is converted. The amount of decompressed data in the scratch directory is limited,
+and the next granule is decompressed in a background thread while the current one is converted.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os, logging, importlib, tempfile, shutil, threading, collections, concurrent.futures
+from constants import *
+
+LOG = logging.getLogger(__name__)
+
+# how much data to decompress at a time
+DECOMPRESS_BLOCK_SIZE = 4 * 1024 * 1024
+
+# how often (in seconds) to check if converted files have been removed from a full scratch directory
+SCRATCH_CHECK_INTERVAL = 0.5
+
+def compression_suffix (file_path) :
+    """
+    get the compression suffix (one of COMPRESSION_MODULES) of a file path, or None if it isn't compressed
+    """
+
+    for suffix in COMPRESSION_MODULES.keys() :
+        if file_path.endswith(suffix) :
+            return suffix
+
+    return None
+
+def decompressed_name (file_path) :
+    """
+    get the name of a file once it's decompressed (the file name without the compression suffix)
+    """
+
+    file_name = os.path.split(file_path)[1]
+    suffix = compression_suffix(file_name)
+
+    return file_name[:-len(suffix)] if suffix is not None else file_name
+
+def decompress_file (file_path, local_path) :
+    """
+    stream a compressed file through its decompressor into local_path, a block at a time
+
+    returns the number of bytes written
+    """
+
+    compression_module = importlib.import_module(COMPRESSION_MODULES[compression_suffix(file_path)])
+
+    bytes_written = 0
+    with compression_module.open(file_path, "rb") as in_file, open(local_path, "wb") as out_file :
+        data = in_file.read(DECOMPRESS_BLOCK_SIZE)
+        while data :
+            out_file.write(data)
+            bytes_written += len(data)
+            data = in_file.read(DECOMPRESS_BLOCK_SIZE)
+
+    return bytes_written
+
+class ScratchSpace (object) :
+    """
+    a scratch directory for decompressed input files that holds at most max_bytes of data at once
+
+    decompress waits until there is room before it starts on a file (a single file is always allowed,
+    so one file larger than max_bytes can still be converted); whoever converts a decompressed file
+    removes it when they are done, which makes room for the next one, and close removes anything left
+    """
+
+    def __init__ (self, scratch_dir=None, max_bytes=DEFAULT_SCRATCH_SIZE) :
+        self.parent_dir  = scratch_dir
+        self.max_bytes   = max_bytes
+        self.scratch_dir = None          # made when the first file is decompressed
+        self.local_files = { }           # input file path -> (local path, bytes used)
+        self.used_bytes  = 0
+        self.condition   = threading.Condition()
+        self.closed      = False
+
+    def decompress (self, file_path) :
+        """
+        decompress a file into the scratch directory, once there's room for it
+
+        returns the local path of the decompressed file
+        """
+
+        with self.condition :
+            self._forget_removed_files()
+            while not self.closed and len(self.local_files) > 0 and self.used_bytes >= self.max_bytes :
+                self.condition.wait(SCRATCH_CHECK_INTERVAL)
+                self._forget_removed_files()
+            if self.closed :
+                raise IOError("The scratch directory was closed before " + file_path + " could be decompressed.")
+            if self.scratch_dir is None :
+                self.scratch_dir = tempfile.mkdtemp(prefix="geocat_scratch_", dir=self.parent_dir)
+            # each file gets its own directory, so it can keep its usual name
+            local_path = os.path.join(tempfile.mkdtemp(dir=self.scratch_dir), decompressed_name(file_path))
+            self.local_files[file_path] = (local_path, 0)
+
+        LOG.debug("Decompressing " + file_path + " to " + local_path)
+        try :
+            file_bytes = decompress_file(file_path, local_path)
+        except Exception :
+            self.release(file_path)
+            raise
+
+        with self.condition :
+            self.local_files[file_path] = (local_path, file_bytes)
+            self.used_bytes += file_bytes
+
+        return local_path
+
+    def _forget_removed_files (self) :
+        """
+        stop counting the space used by decompressed files that have been removed (call with the condition held)
+        """
+
+        for file_path, (local_path, file_bytes) in list(self.local_files.items()) :
+            if file_bytes > 0 and not os.path.exists(local_path) :
+                del self.local_files[file_path]
+                self.used_bytes -= file_bytes
+                shutil.rmtree(os.path.dirname(local_path), ignore_errors=True)
+
+    def release (self, file_path) :
+        """
+        remove the decompressed copy of a file (if there is one) and make its space available again
+        """
+
+        with self.condition :
+            if file_path not in self.local_files :
+                return
+            local_path, file_bytes = self.local_files.pop(file_path)
+            self.used_bytes -= file_bytes
+            self.condition.notify_all()
+
+        shutil.rmtree(os.path.dirname(local_path), ignore_errors=True)
+
+    def close (self) :
+        """
+        remove the scratch directory and everything left in it
+        """
+
+        with self.condition :
+            self.closed      = True
+            self.local_files = { }
+            self.used_bytes  = 0
+            self.condition.notify_all()
+        if self.scratch_dir is not None :
+            shutil.rmtree(self.scratch_dir, ignore_errors=True)
+            self.scratch_dir = None
+
+def decompressed_inputs (file_paths, scratch_space, prefetch=1) :
+    """
+    generate (input path, local path) for each of the file paths, where the local path is the decompressed
+    copy in the scratch space for compressed files and the file itself for the others
+
+    Compressed files are decompressed one at a time in a background thread, up to prefetch files ahead
+    of the one last generated, so decompressing the next file overlaps with converting this one. If a file
+    can't be decompressed, the user is warned and the compressed file is given as the local path (so it
+    will fail to open and be reported like any other bad input).
+    """
+
+    pending = collections.deque() # (input path, the pending decompression or None if there's nothing to do)
+
+    def _finish (file_path, pending_decompression) :
+        if pending_decompression is None :
+            return file_path, file_path
+        try :
+            return file_path, pending_decompression.result()
+        except Exception as err :
+            LOG.warn("Unable to decompress input file (" + file_path + "): " + str(err))
+            return file_path, file_path
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as decompress_pool :
+        for file_path in file_paths :
+            is_compressed = compression_suffix(file_path) is not None
+            pending.append((file_path, decompress_pool.submit(scratch_space.decompress, file_path) if is_compressed else None))
+            while len(pending) > prefetch :
+                yield _finish(*pending.popleft())
+        while len(pending) > 0 :
+            yield _finish(*pending.popleft())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Routines to convert a Geocat hdf4 granule to netCDF4 in memory, for services that embed the converter.
+
+convert_to_memory takes an input file path or the bytes of an input file and returns the converted
+netCDF4 file as a memoryview, without writing an output file. The output is made with netCDF4's
+in-memory Dataset support. The hdf4 library can only read files, so input given as bytes (or a
+compressed input file) is written to a scratch file first; by default that is on /dev/shm (a tmpfs)
+where there is one, so it never reaches a local disk. Metadata processing results are cached for
+the life of the process (see schema_cache), so a long-lived service only works them out once for
+each kind of granule.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os, logging, tempfile, shutil
+from constants import *
+from convert import read_hdf4_info, compliance_cleanup, write_netCDF4_file
+from schema_cache import get_schema_cache
+from decompress import compression_suffix, decompressed_name, decompress_file
+from metrics import *
+
+LOG = logging.getLogger(__name__)
+
+# where input given as bytes is written to so the hdf4 library can read it
+DEFAULT_MEMORY_SCRATCH_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+class EmptySubsetError (ValueError) :
+    """
+    raised by convert_to_memory when nothing in the input is in the requested subset
+    """
+    pass
+
+def convert_to_memory (input_file, input_name=None, copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE,
+                       compression_level=DEFAULT_COMPRESSION_LEVEL, storage_settings=None, schema_cache_dir=None,
+                       metrics=None, validate=False, unpack_flags=False, include_patterns=None, exclude_patterns=None,
+                       line_range=None, element_range=None, bbox=None, overview_factors=None, overview_patterns=None,
+                       scratch_dir=DEFAULT_MEMORY_SCRATCH_DIR) :
+    """convert a single Geocat output hdf4 file to netCDF4 in memory
+
+    input_file may be the path to the input file (which may be compressed, see COMPRESSION_MODULES)
+    or the contents of the input file as bytes (or any other buffer); input_name is the name of the
+    input file (used in messages and as the name of the output) and if it ends in a compression suffix,
+    the bytes given are decompressed first
+
+    The other options are the same as for convert_file, except that the geolocation can't be shared.
+    Input given as bytes or compressed is written to a temporary file in scratch_dir while it is read,
+    and that file is removed before this returns.
+
+    Returns the contents of the netCDF4 file as a memoryview (use bytes() on it for a bytes copy).
+    Raises EmptySubsetError if nothing in the input is in the requested subset, and IOError for any
+    other problem reading the input or making the output.
+    """
+
+    from pyhdf.SD import HDF4Error
+
+    is_path = isinstance(input_file, (str, os.PathLike))
+    if input_name is None :
+        input_name = os.fspath(input_file) if is_path else "input." + INPUT_TYPES[0]
+    source_name = os.path.split(input_name)[1]
+
+    LOG.info("Attempting to convert file in memory: " + source_name)
+
+    # the hdf4 library needs a file to read, so put anything that isn't one in the scratch directory
+    local_dir = None
+    try :
+        if is_path and compression_suffix(source_name) is None :
+            local_path = os.fspath(input_file)
+        else :
+            local_dir  = tempfile.mkdtemp(prefix="geocat_memory_", dir=scratch_dir)
+            local_path = os.path.join(local_dir, decompressed_name(source_name))
+            try :
+                if is_path :
+                    decompress_file(input_file, local_path)
+                else :
+                    compressed_path = local_path + (compression_suffix(source_name) or "")
+                    with open(compressed_path, "wb") as local_file :
+                        local_file.write(input_file)
+                    if compressed_path != local_path :
+                        decompress_file(compressed_path, local_path)
+                        os.remove(compressed_path)
+            except Exception as err :
+                raise IOError("Unable to decompress input file (" + source_name + "): " + str(err))
+
+        try :
+            with time_stage(metrics, OPEN_STAGE) :
+                in_file_info, in_file_object = read_hdf4_info(local_path)
+        except HDF4Error :
+            raise IOError("Unable to open input file (" + source_name + ") due to HDF4Error.")
+
+        out_file_object = None
+        try :
+            # make any changes needed for CF compliance
+            schema_cache = get_schema_cache(schema_cache_dir)
+            with time_stage(metrics, METADATA_STAGE) :
+                compliance_cleanup(in_file_info, schema_cache=schema_cache)
+
+            # cut the file down to the variables and region that were asked for
+            if include_patterns or exclude_patterns or line_range is not None or element_range is not None or bbox is not None :
+                from subset import subset_file_info
+                with time_stage(metrics, METADATA_STAGE) :
+                    has_data = subset_file_info(in_file_object, in_file_info,
+                                                include_patterns=include_patterns,
+                                                exclude_patterns=exclude_patterns,
+                                                line_range=line_range,
+                                                element_range=element_range,
+                                                bbox=bbox,
+                                                copy_buffer_size=copy_buffer_size,
+                                                schema_cache=schema_cache)
+                if not has_data :
+                    raise EmptySubsetError("Nothing in input file (" + source_name + ") is in the requested subset.")
+
+            out_file_object = write_netCDF4_file(in_file_object, in_file_info,
+                                                 os.path.splitext(decompressed_name(source_name))[0] + OUT_FILE_SUFFIX,
+                                                 copy_buffer_size=copy_buffer_size,
+                                                 compression_level=compression_level,
+                                                 storage_settings=storage_settings,
+                                                 schema_cache=schema_cache,
+                                                 metrics=metrics,
+                                                 validate=validate,
+                                                 unpack_flags=unpack_flags,
+                                                 overview_factors=overview_factors,
+                                                 overview_patterns=overview_patterns,
+                                                 in_memory=True)
+            with time_stage(metrics, CLOSE_STAGE) :
+                out_memory = out_file_object.close()
+                out_file_object = None
+        except EmptySubsetError :
+            raise
+        except Exception as err :
+            raise IOError("Unable to convert input file (" + source_name + ") in memory: " + str(err))
+        finally :
+            in_file_object.end()
+            if out_file_object is not None :
+                out_file_object.close()
+    finally :
+        if local_dir is not None :
+            shutil.rmtree(local_dir, ignore_errors=True)
+
+    if metrics is not None :
+        metrics.finish(0)
+
+    return out_memory
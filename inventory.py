@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Routines to build a catalog of the contents of Geocat hdf4 granules without converting them.
+
+Only the headers of each file are read (the attributes and the names, shapes and types of the
+variables), so no variable data is touched. Each catalog record lists the image time, dimensions and
+variables of a granule along with how many bytes of variable data it holds, which can be used to
+plan conversions (for example, to size the memory for each job). The catalog is written as JSON
+lines, or to an SQLite database if the catalog path ends in one of SQLITE_FILE_SUFFIXES.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os, logging, json, multiprocessing, sqlite3, tempfile
+from constants import *
+from convert import read_hdf4_info, determine_dimensions, image_datetime, merge_return_codes, hdf4_type_size, \
+                    hdf4_numpy_type
+
+from pyhdf.SD import HDF4Error
+
+LOG = logging.getLogger(__name__)
+
+# catalog paths ending in any of these are written as SQLite databases
+SQLITE_FILE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+
+# keys for the information saved in each catalog record
+INPUT_PATH_KEY     = "input_path"
+INPUT_SIZE_KEY     = "input_size"
+IMAGE_TIME_KEY     = "image_date_time"
+DIMENSIONS_KEY     = "dimensions"
+VARIABLES_KEY      = "variables"
+VAR_DIMS_KEY       = "dimensions"
+DATA_BYTES_KEY     = "data_bytes"
+ERROR_KEY          = "error"
+
+def variable_data_bytes (var_info) :
+    """
+    figure out how many bytes of data a variable holds from its shape and hdf4 data type
+    """
+
+    num_values = 1
+    for dim_size in var_info[SHAPE_KEY] :
+        num_values *= dim_size
+
+    return num_values * hdf4_type_size(var_info.get(DATA_TYPE_KEY), 1)
+
+def numpy_type_name (hdf4_type) :
+    """
+    get the name of the numpy data type an hdf4 data type is read as (such as "int16"), which numpy.dtype
+    accepts, so catalog readers don't need pyhdf to understand it; None for an unknown type
+    """
+
+    try :
+        numpy_type = hdf4_numpy_type(hdf4_type)
+    except ValueError :
+        return None
+
+    # the names of byte string types give their size in bits, which numpy.dtype reads as bytes
+    return numpy_type.name if numpy_type.kind != "S" else "S" + str(numpy_type.itemsize)
+
+def inventory_file (file_path) :
+    """
+    read the header of one Geocat hdf4 file and build its catalog record
+
+    if the file can't be read or understood, the record will only have the input path, size and an error message
+    """
+
+    record = {
+                INPUT_PATH_KEY: file_path,
+                INPUT_SIZE_KEY: os.path.getsize(file_path) if os.path.exists(file_path) else None,
+             }
+
+    try :
+        in_file_info, in_file_object = read_hdf4_info(file_path)
+    except HDF4Error :
+        LOG.warn("Unable to open input file (" + file_path + ") due to HDF4Error.")
+        record[ERROR_KEY] = "unable to open file"
+        return record
+
+    try :
+        dimensions_info, variable_dimensions_info = determine_dimensions(in_file_info)
+        variables = { }
+        for var_name in in_file_info[VAR_LIST_KEY] :
+            var_info = in_file_info[VAR_INFO_KEY][var_name]
+            variables[var_name] = {
+                                    SHAPE_KEY:      list(var_info[SHAPE_KEY]),
+                                    DATA_TYPE_KEY:  numpy_type_name(var_info[DATA_TYPE_KEY]),
+                                    VAR_DIMS_KEY:   list(variable_dimensions_info.get(var_name, ( ))),
+                                    DATA_BYTES_KEY: variable_data_bytes(var_info),
+                                  }
+        record[IMAGE_TIME_KEY] = image_datetime(in_file_info[GLOBAL_ATTRS_KEY]).strftime(ISO_OUT_TIME_FORMAT)
+        record[DIMENSIONS_KEY] = dimensions_info
+        record[VARIABLES_KEY]  = variables
+        record[DATA_BYTES_KEY] = sum(var_record[DATA_BYTES_KEY] for var_record in variables.values())
+    except Exception as err :
+        LOG.warn("Unable to catalog the contents of input file (" + file_path + "): " + str(err))
+        record[ERROR_KEY] = str(err)
+    finally :
+        in_file_object.end()
+
+    return record
+
+def _write_json_lines_catalog (catalog_path, records) :
+    """
+    write catalog records as JSON lines, replacing any existing catalog once all the records are written
+    """
+
+    temp_handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(catalog_path)), suffix=".tmp")
+    try :
+        with os.fdopen(temp_handle, "w") as catalog_file :
+            for record in records :
+                catalog_file.write(json.dumps(record, sort_keys=True) + "\n")
+                yield record
+        os.replace(temp_path, catalog_path)
+    finally :
+        if os.path.exists(temp_path) :
+            os.remove(temp_path)
+
+def _write_sqlite_catalog (catalog_path, records) :
+    """
+    write catalog records to an SQLite database, replacing any earlier records for the same input files
+    """
+
+    connection = sqlite3.connect(catalog_path)
+    try :
+        connection.execute("CREATE TABLE IF NOT EXISTS granules (input_path TEXT PRIMARY KEY, input_size INTEGER, "
+                           "image_date_time TEXT, data_bytes INTEGER, dimensions TEXT, error TEXT)")
+        connection.execute("CREATE TABLE IF NOT EXISTS variables (input_path TEXT, var_name TEXT, shape TEXT, "
+                           "data_type TEXT, dimensions TEXT, data_bytes INTEGER, PRIMARY KEY (input_path, var_name))")
+        for record in records :
+            file_path = record[INPUT_PATH_KEY]
+            connection.execute("DELETE FROM variables WHERE input_path = ?", (file_path,))
+            connection.execute("INSERT OR REPLACE INTO granules VALUES (?, ?, ?, ?, ?, ?)",
+                               (file_path, record[INPUT_SIZE_KEY], record.get(IMAGE_TIME_KEY), record.get(DATA_BYTES_KEY),
+                                json.dumps(record.get(DIMENSIONS_KEY), sort_keys=True), record.get(ERROR_KEY)))
+            variables = record.get(VARIABLES_KEY, { })
+            connection.executemany("INSERT INTO variables VALUES (?, ?, ?, ?, ?, ?)",
+                                   [(file_path, var_name, json.dumps(variables[var_name][SHAPE_KEY]),
+                                     variables[var_name][DATA_TYPE_KEY], json.dumps(variables[var_name][VAR_DIMS_KEY]),
+                                     variables[var_name][DATA_BYTES_KEY]) for var_name in sorted(variables.keys())])
+            connection.commit()
+            yield record
+    finally :
+        connection.close()
+
+def inventory_files (catalog_path, files_list, jobs=1) :
+    """catalog the contents of Geocat output hdf4 files without converting them
+
+    The headers of up to jobs files are read at the same time in a pool of worker processes (0 or
+    None will use one per cpu). A JSON lines catalog is replaced by each run, while records in an
+    SQLite catalog are added to (or replace the earlier records for the same files in) the database.
+
+    Returns a return code using the same codes as hdf4_2_netcdf4.
+    """
+
+    if not jobs :
+        jobs = multiprocessing.cpu_count()
+    if hasattr(files_list, "__len__") :
+        jobs = min(jobs, len(files_list))
+    jobs = max(1, jobs)
+
+    worker_pool = None
+    if jobs <= 1 :
+        records = (inventory_file(file_path) for file_path in files_list)
+    else :
+        LOG.info("Reading file headers using " + str(jobs) + " worker processes.")
+        worker_pool = multiprocessing.Pool(processes=jobs)
+        records = worker_pool.imap(inventory_file, files_list)
+
+    if catalog_path.endswith(SQLITE_FILE_SUFFIXES) :
+        records = _write_sqlite_catalog(catalog_path, records)
+    else :
+        records = _write_json_lines_catalog(catalog_path, records)
+
+    LOG.info("Writing catalog to: " + catalog_path)
+    collected_codes = [ ]
+    try :
+        for record in records :
+            collected_codes.append(2 if ERROR_KEY in record else 0)
+    finally :
+        if worker_pool is not None :
+            worker_pool.close()
+            worker_pool.join()
+
+    if len(collected_codes) <= 0 :
+        LOG.warn("No files were listed in the command line input. No file processing will be done.")
+        return 1
+
+    return merge_return_codes(collected_codes)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+A manifest of completed conversions, used to skip input files whose output is already up to date.
+
+The manifest is a JSON lines file with one record per completed conversion. Records are only ever
+appended, and when an input file appears more than once the last record for it is used.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os, logging, json, hashlib
+from datetime import datetime
+from constants import *
+
+LOG = logging.getLogger(__name__)
+
+# keys for the information saved in each manifest record
+INPUT_PATH_KEY        = "input_path"
+INPUT_SIZE_KEY        = "input_size"
+INPUT_MTIME_KEY       = "input_mtime"
+INPUT_HASH_KEY        = "input_hash"
+CONVERTER_VERSION_KEY = "converter_version"
+OUTPUT_PATH_KEY       = "output_path"
+OPTIONS_HASH_KEY      = "options_hash"
+CONVERTED_TIME_KEY    = "converted_time"
+
+# the conversion options that don't change what is written to the output files, so they are left out
+# of the options hash and changing them doesn't make the outputs out of date
+NON_OUTPUT_OPTIONS = set(["copy_buffer_size", "read_ahead_size", "schema_cache_dir", "metrics", "source_path"])
+
+# how much of a file to read at once when hashing it
+HASH_READ_SIZE = 4 * 1024 * 1024
+
+def file_content_hash (file_path) :
+    """
+    get the sha1 hash of the contents of a file
+    """
+
+    sha = hashlib.sha1()
+    with open(file_path, "rb") as in_file :
+        data = in_file.read(HASH_READ_SIZE)
+        while data :
+            sha.update(data)
+            data = in_file.read(HASH_READ_SIZE)
+
+    return sha.hexdigest()
+
+def conversion_options_hash (convert_options) :
+    """
+    get the sha1 hash of the conversion options (the keyword arguments for convert_file) that change
+    what is written to the output files
+    """
+
+    output_options = sorted((option_name, option_value) for option_name, option_value in convert_options.items()
+                            if option_name not in NON_OUTPUT_OPTIONS and option_value is not None)
+
+    return hashlib.sha1(json.dumps(output_options, default=repr).encode("utf-8")).hexdigest()
+
+class ConversionManifest (object) :
+    """
+    a record of the input files that have been converted, the state they were in when
+    they were converted, and the version of the converter and the options that did it
+
+    if use_hash is True, the contents of the input files are hashed and compared as well as
+    their size and modification time; options_hash identifies the conversion options in use
+    (see conversion_options_hash), outputs made with other options are not current
+    """
+
+    def __init__ (self, manifest_path, converter_version, use_hash=False, options_hash=None) :
+        self.manifest_path     = manifest_path
+        self.converter_version = converter_version
+        self.use_hash          = use_hash
+        self.options_hash      = options_hash
+        self.records           = { }
+
+        if os.path.exists(self.manifest_path) :
+            with open(self.manifest_path, "r") as manifest_file :
+                for line_num, line in enumerate(manifest_file) :
+                    if not line.strip() :
+                        continue
+                    try :
+                        record = json.loads(line)
+                        self.records[record[INPUT_PATH_KEY]] = record
+                    except (ValueError, KeyError) :
+                        # a crash part way through writing a record can leave a bad last line
+                        LOG.warn("Ignoring unreadable line " + str(line_num + 1) + " in manifest " + self.manifest_path)
+
+    def _input_state (self, file_path, include_hash) :
+        file_stat = os.stat(file_path)
+        state = {
+                    INPUT_SIZE_KEY:  file_stat.st_size,
+                    INPUT_MTIME_KEY: file_stat.st_mtime,
+                }
+        if include_hash :
+            state[INPUT_HASH_KEY] = file_content_hash(file_path)
+
+        return state
+
+    def is_current (self, file_path, output_path) :
+        """
+        check if the manifest shows that this input file was already converted to this output path by this
+        version of the converter with the same options, that the input hasn't changed since then and that
+        the output still exists
+        """
+
+        if file_path not in self.records :
+            return False
+        record = self.records[file_path]
+
+        if record.get(CONVERTER_VERSION_KEY) != self.converter_version or record.get(OUTPUT_PATH_KEY) != output_path :
+            return False
+        if record.get(OPTIONS_HASH_KEY) != self.options_hash :
+            return False
+        if not os.path.exists(file_path) or not os.path.exists(output_path) :
+            return False
+
+        # check the size and modification time before the (slower) hash
+        current_state = self._input_state(file_path, False)
+        for state_key in current_state.keys() :
+            if record.get(state_key) != current_state[state_key] :
+                return False
+        if self.use_hash and record.get(INPUT_HASH_KEY) != file_content_hash(file_path) :
+            return False
+
+        return True
+
+    def record (self, file_path, output_path) :
+        """
+        record that this input file was successfully converted to the given output path
+        """
+
+        record = {
+                    INPUT_PATH_KEY:        file_path,
+                    CONVERTER_VERSION_KEY: self.converter_version,
+                    OUTPUT_PATH_KEY:       output_path,
+                    OPTIONS_HASH_KEY:      self.options_hash,
+                    CONVERTED_TIME_KEY:    datetime.utcnow().strftime(ISO_OUT_TIME_FORMAT),
+                 }
+        record.update(self._input_state(file_path, self.use_hash))
+        self.records[file_path] = record
+
+        # append and flush the record right away, so it survives if the run is interrupted
+        with open(self.manifest_path, "a") as manifest_file :
+            manifest_file.write(json.dumps(record, sort_keys=True) + "\n")
+            manifest_file.flush()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Timing and I/O instrumentation for conversions.
+
+A ConversionMetrics object collects the wall time of each stage of converting one file and the
+bytes read and written for each variable. The metrics for all the files in a run can be written
+out as a JSON summary and as a Prometheus textfile collector file.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os, logging, json, time, resource, platform, tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from constants import *
+
+LOG = logging.getLogger(__name__)
+
+# the stages of converting a file
+OPEN_STAGE        = "open"
+METADATA_STAGE    = "metadata"
+GEOLOCATION_STAGE = "geolocation"
+DATA_READ_STAGE   = "data_read"
+DATA_WRITE_STAGE  = "data_write"
+CLOSE_STAGE       = "close"
+ALL_STAGES        = [OPEN_STAGE, METADATA_STAGE, GEOLOCATION_STAGE, DATA_READ_STAGE, DATA_WRITE_STAGE, CLOSE_STAGE]
+
+# keys for the per-variable I/O information
+BYTES_READ_KEY    = "bytes_read"
+BYTES_WRITTEN_KEY = "bytes_written"
+READ_SECONDS_KEY  = "read_seconds"
+WRITE_SECONDS_KEY = "write_seconds"
+STATISTICS_KEY    = "statistics"
+
+# the prefix for all the Prometheus metric names
+PROMETHEUS_PREFIX = "geocat_converter_"
+
+def peak_rss_bytes () :
+    """
+    get the peak resident set size of this process so far, in bytes; this is the peak over the life of the
+    process, so in a worker that has converted other files it may come from an earlier file
+    """
+
+    # ru_maxrss is in kilobytes on linux and bytes on mac
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+def current_rss_bytes () :
+    """
+    get the current resident set size of this process in bytes, or None where that can't be found
+    (it is read from /proc, so only on linux)
+    """
+
+    try :
+        with open("/proc/self/statm", "r") as statm_file :
+            return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError) :
+        return None
+
+class ConversionMetrics (object) :
+    """
+    the timing and I/O measurements for converting a single file
+
+    the resident set size of the process is sampled when the file is started and finished; the peak
+    recorded is the peak of the whole process so far (see peak_rss_bytes), not just of this file
+    """
+
+    def __init__ (self, input_path) :
+        self.input_path       = input_path
+        self.output_path      = None
+        self.return_code      = None
+        self.input_bytes      = os.path.getsize(input_path) if os.path.exists(input_path) else 0
+        self.output_bytes     = 0
+        self.stage_seconds    = dict((stage_name, 0.0) for stage_name in ALL_STAGES)
+        self.variables        = { }
+        self.rss_start        = current_rss_bytes()
+        self.rss_end          = None
+        self.process_peak_rss = 0
+
+    @contextmanager
+    def time_stage (self, stage_name) :
+        """
+        add the wall time spent in a with block to a stage
+        """
+
+        start_time = time.time()
+        try :
+            yield
+        finally :
+            self.stage_seconds[stage_name] += time.time() - start_time
+
+    def _variable_io (self, var_name) :
+        if var_name not in self.variables :
+            self.variables[var_name] = {BYTES_READ_KEY: 0, BYTES_WRITTEN_KEY: 0, READ_SECONDS_KEY: 0.0, WRITE_SECONDS_KEY: 0.0}
+        return self.variables[var_name]
+
+    def add_read (self, var_name, num_bytes, seconds) :
+        """
+        record a block of data read for a variable
+        """
+        var_io = self._variable_io(var_name)
+        var_io[BYTES_READ_KEY]   += num_bytes
+        var_io[READ_SECONDS_KEY] += seconds
+        self.stage_seconds[DATA_READ_STAGE] += seconds
+
+    def add_write (self, var_name, num_bytes, seconds) :
+        """
+        record a block of data written for a variable
+        """
+        var_io = self._variable_io(var_name)
+        var_io[BYTES_WRITTEN_KEY] += num_bytes
+        var_io[WRITE_SECONDS_KEY] += seconds
+        self.stage_seconds[DATA_WRITE_STAGE] += seconds
+
+    def add_statistics (self, var_name, statistics) :
+        """
+        record the data statistics (as a dictionary) for a variable
+        """
+        self._variable_io(var_name)[STATISTICS_KEY] = statistics
+
+    def finish (self, return_code, output_path=None) :
+        """
+        record the result of the conversion and the sizes of the files
+        """
+        self.return_code = return_code
+        self.output_path = output_path
+        if output_path is not None and os.path.exists(output_path) :
+            self.output_bytes = os.path.getsize(output_path)
+        self.rss_end          = current_rss_bytes()
+        self.process_peak_rss = peak_rss_bytes()
+
+    def to_dict (self) :
+        return {
+                    "input_path":             self.input_path,
+                    "output_path":            self.output_path,
+                    "return_code":            self.return_code,
+                    "input_bytes":            self.input_bytes,
+                    "output_bytes":           self.output_bytes,
+                    "total_seconds":          sum(self.stage_seconds.values()),
+                    "stage_seconds":          self.stage_seconds,
+                    "variables":              self.variables,
+                    "rss_start_bytes":        self.rss_start,
+                    "rss_end_bytes":          self.rss_end,
+                    "process_peak_rss_bytes": self.process_peak_rss,
+               }
+
+@contextmanager
+def time_stage (metrics, stage_name) :
+    """
+    add the wall time spent in a with block to a stage of the given metrics, if there are any
+    """
+
+    if metrics is None :
+        yield
+    else :
+        with metrics.time_stage(stage_name) :
+            yield
+
+def timed_blocks (data_blocks, metrics) :
+    """
+    pass through a generator of (variable name, start line, data) blocks, recording the time spent waiting for each one
+    """
+
+    block_iter = iter(data_blocks)
+    while True :
+        start_time = time.time()
+        try :
+            block = next(block_iter)
+        except StopIteration :
+            return
+        metrics.add_read(block[0], block[-1].nbytes, time.time() - start_time)
+        yield block
+
+def run_summary (file_metrics, run_seconds, return_code) :
+    """
+    summarize the metrics (as dictionaries) for all the files in a run
+    """
+
+    stage_totals = dict((stage_name, sum(metrics["stage_seconds"][stage_name] for metrics in file_metrics))
+                        for stage_name in ALL_STAGES)
+    slowest_file = max(file_metrics, key=lambda metrics : metrics["total_seconds"]) if len(file_metrics) > 0 else None
+
+    return {
+                "run_time":             datetime.now(timezone.utc).strftime(ISO_OUT_TIME_FORMAT),
+                "run_seconds":          run_seconds,
+                "return_code":          return_code,
+                "files":                len(file_metrics),
+                "files_failed":         len([metrics for metrics in file_metrics if metrics["return_code"] not in (0, 3)]),
+                "input_bytes":          sum(metrics["input_bytes"]  for metrics in file_metrics),
+                "output_bytes":         sum(metrics["output_bytes"] for metrics in file_metrics),
+                "bytes_read":           sum(var_io[BYTES_READ_KEY]    for metrics in file_metrics for var_io in metrics["variables"].values()),
+                "bytes_written":        sum(var_io[BYTES_WRITTEN_KEY] for metrics in file_metrics for var_io in metrics["variables"].values()),
+                "values_out_of_range":  sum(var_io[STATISTICS_KEY]["out_of_range"] for metrics in file_metrics
+                                            for var_io in metrics["variables"].values() if STATISTICS_KEY in var_io),
+                "stage_seconds":        stage_totals,
+                "peak_rss_bytes":       max([metrics["process_peak_rss_bytes"] for metrics in file_metrics] + [peak_rss_bytes()]),
+                "slowest_file":         slowest_file["input_path"]    if slowest_file is not None else None,
+                "slowest_file_seconds": slowest_file["total_seconds"] if slowest_file is not None else 0.0,
+                "per_file":             file_metrics,
+           }
+
+def _write_atomically (file_path, text) :
+    """
+    write text to a temporary file next to file_path and then rename it, so readers never see a partial file
+    """
+
+    temp_handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)), suffix=".tmp")
+    try :
+        with os.fdopen(temp_handle, "w") as temp_file :
+            temp_file.write(text)
+        os.replace(temp_path, file_path)
+    finally :
+        if os.path.exists(temp_path) :
+            os.remove(temp_path)
+
+def write_json_summary (file_path, summary) :
+    """
+    write a run summary as JSON
+    """
+
+    LOG.info("Writing run metrics to: " + file_path)
+    _write_atomically(file_path, json.dumps(summary, indent=4, sort_keys=True) + "\n")
+
+def write_prometheus_textfile (file_path, summary) :
+    """
+    write the totals from a run summary in the Prometheus text format, for use with the node exporter textfile collector
+    """
+
+    lines = [ ]
+    def _add_metric (name, help_text, values) :
+        lines.append("# HELP " + PROMETHEUS_PREFIX + name + " " + help_text)
+        lines.append("# TYPE " + PROMETHEUS_PREFIX + name + " gauge")
+        for labels, value in values :
+            lines.append(PROMETHEUS_PREFIX + name + labels + " " + repr(float(value)))
+
+    _add_metric("last_run_timestamp_seconds", "The time the last run finished.", [("", time.time())])
+    _add_metric("run_seconds", "The wall time of the last run.", [("", summary["run_seconds"])])
+    _add_metric("return_code", "The return code of the last run.", [("", summary["return_code"])])
+    _add_metric("files", "The number of files processed in the last run.",
+                [('{status="converted"}', summary["files"] - summary["files_failed"]),
+                 ('{status="failed"}',    summary["files_failed"])])
+    _add_metric("stage_seconds", "The wall time spent in each stage of conversion in the last run, summed over files.",
+                [('{stage="' + stage_name + '"}', summary["stage_seconds"][stage_name]) for stage_name in ALL_STAGES])
+    _add_metric("input_bytes", "The size of the input files in the last run.", [("", summary["input_bytes"])])
+    _add_metric("output_bytes", "The size of the output files in the last run.", [("", summary["output_bytes"])])
+    _add_metric("data_bytes_read", "The bytes of variable data read in the last run.", [("", summary["bytes_read"])])
+    _add_metric("data_bytes_written", "The bytes of variable data written in the last run.", [("", summary["bytes_written"])])
+    _add_metric("values_out_of_range", "The number of data values outside of their valid range in the last run "
+                "(only counted when validating).", [("", summary["values_out_of_range"])])
+    _add_metric("peak_rss_bytes", "The peak resident set size of any converter process in the last run.",
+                [("", summary["peak_rss_bytes"])])
+    _add_metric("slowest_file_seconds", "The wall time of the slowest file in the last run.",
+                [("", summary["slowest_file_seconds"])])
+
+    LOG.info("Writing Prometheus metrics to: " + file_path)
+    _write_atomically(file_path, "\n".join(lines) + "\n")
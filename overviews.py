@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Routines to make downsampled overviews (a pyramid of reduced resolution copies) of image variables.
+
+An overview at factor F has one value for each F x F box of lines and elements in the variable.
+Continuous fields are reduced with the mean of the values in each box that aren't fill values (or
+NaN), and flag variables (those with flag_values) with the most common flag value in each box, so
+the overview only ever holds real flag values. Boxes with no valid data get the fill value.
+
+Overviews are stored in the same file as the variable, in their own variables and dimensions, and
+are linked to the variable by attributes so viewers can find a small copy to draw instead of
+reading the whole array. They are built one block of lines at a time as the variable is copied.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import logging, re
+import numpy
+from constants import *
+
+LOG = logging.getLogger(__name__)
+
+# the attributes copied from a variable to its overviews
+OVERVIEW_COPIED_ATTRS = ["long_name", "standard_name", "units", "scale_factor", "add_offset", "scaling_method",
+                         VALID_RANGE_ATTR_NAME, VALID_MIN_ATTR_NAME, VALID_MAX_ATTR_NAME,
+                         FLAG_VALS_ATTR_NAME, FLAG_MEANINGS_ATTR_NAME]
+
+def parse_overview_factors (factors_text) :
+    """
+    parse a list of overview factors from the command line in the form "2,4,8"
+
+    returns the factors as a sorted list of integers
+    """
+
+    factors = sorted(set(int(factor_text) for factor_text in factors_text.split(",")))
+    if len(factors) <= 0 or factors[0] < 2 :
+        raise ValueError("Overview factors (" + factors_text + ") must all be 2 or more.")
+
+    return factors
+
+def overview_name (name, factor) :
+    """
+    get the name of the overview variable or dimension at a factor for a variable or dimension name
+    """
+
+    return name + OVERVIEW_NAME_PART + str(factor)
+
+def wants_overviews (var_name, var_dims, overview_patterns=None) :
+    """
+    check if a variable should have overviews made: it must be an image (just lines and elements)
+    and match one of the overview_patterns (from the start of its name), if any are given
+    """
+
+    if tuple(var_dims) != (LINES_DIM_NAME, ELEMS_DIM_NAME) :
+        return False
+
+    return not overview_patterns or any(re.match(pattern, var_name) for pattern in overview_patterns)
+
+def overview_attributes (var_name, var_attrs, factor) :
+    """
+    get the attributes for an overview of a variable at a factor (not including the fill value)
+    """
+
+    is_flag   = FLAG_VALS_ATTR_NAME in var_attrs
+    attributes = {
+                    OVERVIEW_OF_ATTR_NAME:     var_name,
+                    OVERVIEW_FACTOR_ATTR_NAME: factor,
+                    CELL_METHODS_ATTR_NAME:    LINES_DIM_NAME + ": " + ELEMS_DIM_NAME + ": " + ("mode" if is_flag else "mean")
+                                               + " (interval: " + str(factor) + " pixels)",
+                 }
+    for attr_key in OVERVIEW_COPIED_ATTRS :
+        if attr_key in var_attrs :
+            attributes[attr_key] = var_attrs[attr_key]
+
+    return attributes
+
+def _boxes (data, factor, pad_value) :
+    """
+    reshape a block of [line, element] data into [box line, line in box, box element, element in box],
+    padding the edges with pad_value to a multiple of the factor
+    """
+
+    num_lines, num_elems = data.shape
+    box_lines = -(-num_lines // factor)
+    box_elems = -(-num_elems // factor)
+    if box_lines * factor != num_lines or box_elems * factor != num_elems :
+        padded = numpy.full((box_lines * factor, box_elems * factor), pad_value, dtype=data.dtype)
+        padded[:num_lines, :num_elems] = data
+        data = padded
+
+    return data.reshape(box_lines, factor, box_elems, factor)
+
+def reduce_block (data, factor, fill_value=None, flag_values=None) :
+    """
+    reduce a block of [line, element] data by a factor, with the mean of the valid values in each box
+    (or if flag_values are given, the most common of them); boxes with no valid data get the fill value
+
+    the result has the same data type as the data; integer means are rounded
+    """
+
+    data = numpy.asarray(data)
+    if fill_value is None :
+        fill_value = numpy.nan if data.dtype.kind == 'f' else None
+
+    if flag_values is not None :
+        # count how often each flag value appears in each box (not counting the padding at the edges)
+        # and take the most common one
+        boxes  = _boxes(data, factor, flag_values[0])
+        inside = _boxes(numpy.ones(data.shape, dtype=bool), factor, False)
+        counts = numpy.stack([numpy.count_nonzero((boxes == flag_value) & inside, axis=(1, 3)) for flag_value in flag_values])
+        result = numpy.asarray(flag_values, dtype=data.dtype)[numpy.argmax(counts, axis=0)]
+        if fill_value is not None :
+            result[counts.sum(axis=0) <= 0] = fill_value
+        return result
+
+    # mask out the fill values (and padding) and NaNs, and average the rest
+    if fill_value is None :
+        boxes = _boxes(data, factor, 0).astype(numpy.float64)
+        valid = _boxes(numpy.ones(data.shape, dtype=bool), factor, False)
+    else :
+        boxes = _boxes(data, factor, fill_value)
+        valid = boxes != fill_value
+        if data.dtype.kind == 'f' :
+            valid &= ~numpy.isnan(boxes)
+        boxes = numpy.where(valid, boxes, 0).astype(numpy.float64)
+    counts = valid.sum(axis=(1, 3))
+    with numpy.errstate(invalid='ignore', divide='ignore') :
+        means = boxes.sum(axis=(1, 3)) / counts
+
+    if data.dtype.kind in "iu" :
+        means = numpy.rint(means)
+    if fill_value is not None :
+        means[counts <= 0] = fill_value
+
+    return means.astype(data.dtype)
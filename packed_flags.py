@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Routines to unpack the bit fields in packed Geocat variables (such as the cloud mask and cloud
+type test results) into separate CF flag variables.
+
+The layout of the fields in each packed variable comes from PACKED_FLAGS_MAP in constants. The
+fields are pulled out of each block of packed data with numpy bit operations as the block is
+copied, so the unpacking is done once at conversion time instead of by every reader. Packed
+variables without a layout in PACKED_FLAGS_MAP are left packed; we don't guess at what their
+bits mean.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import logging
+import numpy
+from constants import *
+from rules import match_variable_rules
+
+LOG = logging.getLogger(__name__)
+
+# the packed variables we've already warned have no layout, so each is only reported once per process
+_WARNED_NO_LAYOUT = set([ ])
+
+def flag_variable_name (packed_var_name, field_name) :
+    """
+    get the name of the variable a field of a packed variable is unpacked into
+    """
+
+    return packed_var_name + "_" + field_name
+
+def flag_fields_for_variable (packed_var_name, packed_shape) :
+    """
+    get the list of (field name, field layout) to unpack from a packed variable, or an empty list if
+    it isn't a packed variable we know how to unpack; fields in bytes the variable doesn't have are left out
+    """
+
+    flag_fields = match_variable_rules(packed_var_name)[PACKED_FLAGS_RULE]
+    if flag_fields is None :
+        if packed_var_name.endswith(PACKED_VAR_SUFFIX) and packed_var_name not in _WARNED_NO_LAYOUT :
+            _WARNED_NO_LAYOUT.add(packed_var_name)
+            LOG.warn("The bit layout of packed variable " + packed_var_name + " is not known (see PACKED_FLAGS_MAP). "
+                     + "It will not be unpacked.")
+        return [ ]
+
+    if len(packed_shape) != 3 :
+        LOG.warn("Packed variable " + packed_var_name + " does not have the expected [line, element, byte] "
+                 + "dimensions. It will not be unpacked.")
+        return [ ]
+
+    usable_fields = [ ]
+    for field_name, field_layout in flag_fields :
+        if field_layout[PACKED_BYTE_KEY] < packed_shape[2] :
+            usable_fields.append((field_name, field_layout))
+        else :
+            LOG.warn("Packed variable " + packed_var_name + " has no byte " + str(field_layout[PACKED_BYTE_KEY])
+                     + " to unpack the " + field_name + " field from.")
+
+    return usable_fields
+
+def flag_variable_attributes (packed_var_name, field_name, field_layout) :
+    """
+    get the attributes for a variable a field is unpacked into; flag values and masks are
+    given the same type as the unpacked data, as CF expects
+    """
+
+    first_bit, num_bits = field_layout[PACKED_BITS_KEY]
+    attributes = {
+                    LONG_NAME_ATTR_NAME: field_name.replace("_", " ") + " (bits " + str(first_bit) + " to "
+                                         + str(first_bit + num_bits - 1) + " of byte " + str(field_layout[PACKED_BYTE_KEY])
+                                         + ") unpacked from " + packed_var_name,
+                 }
+    for attr_key in field_layout.keys() :
+        if attr_key in (FLAG_VALS_ATTR_NAME, FLAG_MASKS_ATTR_NAME) :
+            attributes[attr_key] = numpy.array(field_layout[attr_key], dtype=numpy.uint8)
+        elif attr_key not in (PACKED_BYTE_KEY, PACKED_BITS_KEY) :
+            attributes[attr_key] = field_layout[attr_key]
+
+    return attributes
+
+def unpack_field (packed_data, field_layout) :
+    """
+    pull one field out of a block of packed [line, element, byte] data as an array of uint8
+    """
+
+    first_bit, num_bits = field_layout[PACKED_BITS_KEY]
+    field_bytes = numpy.asarray(packed_data[..., field_layout[PACKED_BYTE_KEY]])
+    if field_bytes.dtype != numpy.uint8 :
+        # look at signed bytes as unsigned, so shifting them doesn't bring in sign bits
+        field_bytes = field_bytes.view(numpy.uint8) if field_bytes.dtype.itemsize == 1 else field_bytes.astype(numpy.uint8)
+
+    return (field_bytes >> first_bit) & numpy.uint8((1 << num_bits) - 1)
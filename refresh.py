@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Routines to refresh the variable attributes of existing netCDF4 output files in place.
+
+When the rules in constants (such as LONG_NAME_MAP, RANGE_LIMS_MAP or FLAG_INFO_MAP) change, the
+outputs don't need to be converted again to pick up the changes. Each output file is opened in
+append mode, the variable cleanup from compliance_cleanup is applied again to the attributes the
+variables have now, and only the attributes that changed are written. No variable data is read or
+written, and the original hdf4 files are not needed.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import logging, multiprocessing
+from constants import *
+from rules import match_variable_rules
+from schema_cache import get_schema_cache
+from convert import cleanup_variables, attributes_for_integer_type, merge_return_codes
+
+LOG = logging.getLogger(__name__)
+
+def _same_attribute_value (old_value, new_value) :
+    """
+    check if two attribute values are the same, ignoring differences in their types (so that values
+    already saved in a narrower type than the rules give them aren't rewritten)
+    """
+
+    import numpy
+
+    if isinstance(old_value, str) or isinstance(new_value, str) :
+        return old_value == new_value
+
+    return numpy.array_equal(numpy.ravel(old_value), numpy.ravel(new_value))
+
+def _fits_type (var_attrs, int_type) :
+    """
+    check if the valid range attributes of a variable fit in its integer type
+    """
+
+    import numpy
+
+    type_info = numpy.iinfo(int_type)
+    for attr_name in [VALID_RANGE_ATTR_NAME, VALID_MIN_ATTR_NAME, VALID_MAX_ATTR_NAME] :
+        if attr_name in var_attrs :
+            attr_vals = numpy.ravel(var_attrs[attr_name])
+            if attr_vals.min() < type_info.min or attr_vals.max() > type_info.max :
+                return False
+
+    return True
+
+def _variables_to_refresh (out_file) :
+    """
+    list the variables in an output file that came from the input file, leaving out the time and source
+    file variables of aggregate files, flag variables unpacked from packed variables and overview variables
+    """
+
+    from packed_flags import flag_variable_name
+
+    added_var_names = set([TIME_VAR_NAME, SOURCE_FILE_VAR_NAME]) if TIME_DIM_NAME in out_file.dimensions else set([ ])
+    for var_name in out_file.variables.keys() :
+        for field_name, _ in match_variable_rules(var_name)[PACKED_FLAGS_RULE] or [ ] :
+            added_var_names.add(flag_variable_name(var_name, field_name))
+        if OVERVIEW_OF_ATTR_NAME in out_file.variables[var_name].ncattrs() :
+            added_var_names.add(var_name)
+
+    return [var_name for var_name in out_file.variables.keys() if var_name not in added_var_names]
+
+def refresh_file (output_path, schema_cache_dir=None) :
+    """
+    apply the variable cleanup from compliance_cleanup again to the variable attributes of an existing
+    output file, writing only the attributes that changed
+
+    Integer variables that were narrowed (see packing_for_variable) keep their type, and any valid range
+    from the rules is limited to that type, the same as it was when the file was written. Fill values can't
+    be changed once a variable is created, so they are left as they are. Attributes added after the cleanup
+    (such as the statistics from --validate) are not touched.
+
+    Returns the return code for this file, using the same codes as hdf4_2_netcdf4.
+    """
+
+    from netCDF4 import Dataset
+
+    LOG.info("Attempting to refresh file: " + output_path)
+
+    try :
+        out_file = Dataset(output_path, mode='a')
+    except (IOError, OSError) :
+        LOG.warn("Unable to open output file (" + output_path + ") to refresh it.")
+        return 2
+
+    code_to_return = 0
+    try :
+        # build the file info the cleanup expects from the output variables
+        var_names = _variables_to_refresh(out_file)
+        file_info = {
+                        GLOBAL_ATTRS_KEY: dict((attr_key, out_file.getncattr(attr_key)) for attr_key in out_file.ncattrs()),
+                        VAR_LIST_KEY:     var_names,
+                        VAR_INFO_KEY:     dict((var_name, {
+                                                            SHAPE_KEY:     out_file.variables[var_name].shape,
+                                                            VAR_ATTRS_KEY: dict((attr_key, out_file.variables[var_name].getncattr(attr_key))
+                                                                                for attr_key in out_file.variables[var_name].ncattrs()),
+                                                          }) for var_name in var_names),
+                    }
+        old_var_info = dict((var_name, dict(file_info[VAR_INFO_KEY][var_name][VAR_ATTRS_KEY])) for var_name in var_names)
+
+        cleanup_variables(file_info, schema_cache=get_schema_cache(schema_cache_dir))
+
+        changed_count = 0
+        for var_name in var_names :
+            if var_name not in file_info[VAR_INFO_KEY] :
+                # variables the cleanup removes would never have been written, so we leave them alone
+                continue
+            var_obj   = out_file.variables[var_name]
+            old_attrs = old_var_info[var_name]
+            new_attrs = file_info[VAR_INFO_KEY][var_name][VAR_ATTRS_KEY]
+            if var_obj.dtype.kind in "iu" and not _fits_type(new_attrs, var_obj.dtype) :
+                new_attrs = attributes_for_integer_type(new_attrs, var_obj.dtype)
+
+            for attr_key in sorted(new_attrs.keys()) :
+                if attr_key == FILL_VALUE_KEY :
+                    continue
+                if attr_key not in old_attrs or not _same_attribute_value(old_attrs[attr_key], new_attrs[attr_key]) :
+                    LOG.debug("Setting attribute " + attr_key + " of variable " + var_name + " to " + str(new_attrs[attr_key]) + ".")
+                    var_obj.setncattr(attr_key, new_attrs[attr_key])
+                    changed_count += 1
+            for attr_key in sorted(old_attrs.keys()) :
+                if attr_key not in new_attrs and attr_key != FILL_VALUE_KEY :
+                    LOG.debug("Removing attribute " + attr_key + " from variable " + var_name + ".")
+                    var_obj.delncattr(attr_key)
+                    changed_count += 1
+
+        LOG.info("Changed " + str(changed_count) + " attributes in " + output_path + ".")
+    except Exception as err :
+        LOG.warn("Unable to refresh output file (" + output_path + "): " + str(err))
+        code_to_return = 4
+    finally :
+        out_file.close()
+
+    return code_to_return
+
+def _refresh_file_in_worker (worker_args) :
+    output_path, schema_cache_dir = worker_args
+    return refresh_file(output_path, schema_cache_dir)
+
+def refresh_files (files_list, jobs=1, schema_cache_dir=None) :
+    """refresh the variable attributes of existing netCDF4 output files in place
+
+    Each file is refreshed with refresh_file, up to jobs files at the same time in a pool of
+    worker processes (0 or None will use one per cpu).
+
+    Returns a return code using the same codes as hdf4_2_netcdf4.
+    """
+
+    if not jobs :
+        jobs = multiprocessing.cpu_count()
+    if hasattr(files_list, "__len__") :
+        jobs = min(jobs, len(files_list))
+    jobs = max(1, jobs)
+
+    worker_args = ((output_path, schema_cache_dir) for output_path in files_list)
+    worker_pool = None
+    if jobs <= 1 :
+        file_codes = (_refresh_file_in_worker(file_args) for file_args in worker_args)
+    else :
+        LOG.info("Refreshing files using " + str(jobs) + " worker processes.")
+        worker_pool = multiprocessing.Pool(processes=jobs)
+        file_codes = worker_pool.imap(_refresh_file_in_worker, worker_args)
+
+    try :
+        collected_codes = list(file_codes)
+    finally :
+        if worker_pool is not None :
+            worker_pool.close()
+            worker_pool.join()
+
+    if len(collected_codes) <= 0 :
+        LOG.warn("No files were listed in the command line input. No file processing will be done.")
+        return 1
+
+    return merge_return_codes(collected_codes)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Routines to find the rules in constants that apply to a variable name.
+
+All of the variable name patterns in the rule maps (SPECIAL_VARIABLES, LONG_NAME_MAP, RANGE_LIMS_MAP,
+FLAG_INFO_MAP and PACKED_FLAGS_MAP) are compiled once into VARIABLE_PATTERN_INDEX, and each name is
+matched against the index in a single pass.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+from constants import *
+
+# the rules we've already found for each variable name
+_VARIABLE_RULES_MEMO = { }
+
+def match_variable_rules (var_name) :
+    """
+    find all the rules from the maps in constants that apply to a variable name in a single pass over
+    the pattern index; results are remembered, so each name is only matched once per process
+
+    returns a dictionary with an entry for each rule key, in the form:
+
+        {
+            SPECIAL_DIMS_RULE : (expected shape, dimension names) or None
+            LONG_NAME_RULE    : the long name (filled in for channel variables) or None
+            RANGE_LIMS_RULE   : [valid min, valid max] or None
+            FLAG_INFO_RULE    : a dictionary with the flag values and meanings or None
+            PACKED_FLAGS_RULE : a list of (field name, field layout) for a packed variable or None
+        }
+
+    the returned dictionary is shared, so don't change it
+    """
+
+    if var_name in _VARIABLE_RULES_MEMO :
+        return _VARIABLE_RULES_MEMO[var_name]
+
+    rules = {
+                SPECIAL_DIMS_RULE: None,
+                LONG_NAME_RULE:    None,
+                RANGE_LIMS_RULE:   None,
+                FLAG_INFO_RULE:    None,
+                PACKED_FLAGS_RULE: None,
+            }
+
+    for compiled_pattern, rule_key, pattern in VARIABLE_PATTERN_INDEX :
+        temp_match = compiled_pattern.match(var_name)
+        if temp_match is None :
+            continue
+
+        if rule_key == SPECIAL_DIMS_RULE :
+            rules[SPECIAL_DIMS_RULE] = SPECIAL_VARIABLES[pattern]
+        elif rule_key == LONG_NAME_RULE :
+            if pattern in CHANNEL_DATA_PATTERNS :
+                rules[LONG_NAME_RULE] = LONG_NAME_MAP[pattern] % (temp_match.group(2), temp_match.group(1))
+            else :
+                rules[LONG_NAME_RULE] = LONG_NAME_MAP[pattern]
+        elif rule_key == RANGE_LIMS_RULE :
+            rules[RANGE_LIMS_RULE] = RANGE_LIMS_MAP[pattern]
+        elif rule_key == FLAG_INFO_RULE :
+            rules[FLAG_INFO_RULE] = FLAG_INFO_MAP[pattern]
+        elif rule_key == PACKED_FLAGS_RULE :
+            rules[PACKED_FLAGS_RULE] = PACKED_FLAGS_MAP[pattern]
+
+    _VARIABLE_RULES_MEMO[var_name] = rules
+
+    return rules
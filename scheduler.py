@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Routines to schedule conversions in a pool of worker processes against a total memory budget.
+
+Before a file is handed to a worker, its header is read to get the shape and data type of each
+variable (see read_hdf4_info), which tells us how much data the file holds without reading any of
+it. From that and the copy settings we estimate how much memory converting the file will take, and
+only start the conversion once that much of the budget is free. This lets large full disk granules
+and small mesoscale granules share a machine without every worker having to be sized for the
+largest file.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import logging, queue, functools, math
+from constants import *
+from convert import read_hdf4_info, determine_dimensions, storage_settings_for_variable, lines_per_block, \
+                    hdf4_type_size, _convert_file_in_worker
+from inventory import variable_data_bytes
+from overviews import wants_overviews
+
+LOG = logging.getLogger(__name__)
+
+# the memory (in bytes) a worker process uses before it holds any variable data (the interpreter and libraries)
+WORKER_BASE_MEMORY = 128 * 1024 * 1024
+
+# the number of copies of a block of variable data a worker may hold at once (the data as read, plus the
+# copies made when fill values are moved or the data is cast to a narrower type)
+BLOCK_COPIES = 3
+
+# the extra memory (in bytes) for each value in a block of a variable that has overviews, on top of the size
+# of the value itself, while an overview is reduced from the block (see reduce_block): a float64 copy of the
+# block and a mask of its valid values, as well as a padded copy of the block at the data's own size
+OVERVIEW_BYTES_PER_VALUE = 8 + 1
+
+# the conversion options that change how much memory a conversion takes, see estimate_conversion_memory
+MEMORY_OPTIONS = ["copy_buffer_size", "read_ahead_size", "compression_level", "storage_settings",
+                  "overview_factors", "overview_patterns"]
+
+def _megabytes (num_bytes) :
+    return "%.1f MB" % (num_bytes / (1024.0 * 1024.0))
+
+def estimate_conversion_memory (file_path, copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE, read_ahead_size=0,
+                                compression_level=DEFAULT_COMPRESSION_LEVEL, storage_settings=None,
+                                overview_factors=None, overview_patterns=None) :
+    """
+    estimate how much memory (in bytes) converting a file will take from the variable shapes and types in
+    its header; data is copied one block at a time (see read_variable_blocks), so this is based on the
+    largest block any variable will be read in, not the total size of the file
+
+    blocks are lined up with the output chunks (see storage_settings_for_variable) and, for variables with
+    overviews, with every overview factor as well, which can make them larger than the copy buffer; the
+    buffers used to reduce a block of a variable into its overviews are counted too
+
+    if the header can't be read, only the memory for the worker itself is counted
+    """
+
+    try :
+        in_file_info, in_file_object = read_hdf4_info(file_path)
+        in_file_object.end()
+        dimensions_info, variable_dimensions_info = determine_dimensions(in_file_info)
+    except Exception :
+        # the conversion will report the problem, it won't need more than a worker to do that
+        LOG.debug("Unable to read the header of " + file_path + " to estimate its memory use.")
+        return WORKER_BASE_MEMORY
+
+    total_bytes   = 0
+    largest_block = 0
+    largest_need  = 0
+    for var_name in in_file_info[VAR_LIST_KEY] :
+        var_info  = in_file_info[VAR_INFO_KEY][var_name]
+        var_bytes = variable_data_bytes(var_info)
+        var_shape = var_info[SHAPE_KEY]
+        var_dims  = variable_dimensions_info.get(var_name)
+        item_size = hdf4_type_size(var_info.get(DATA_TYPE_KEY), 1)
+        total_bytes += var_bytes
+        if len(var_shape) <= 0 or var_shape[0] <= 0 or var_dims is None :
+            largest_block = max(largest_block, var_bytes)
+            largest_need  = max(largest_need, BLOCK_COPIES * var_bytes)
+            continue
+
+        # blocks line up with the output chunks, and with every overview factor for variables with overviews
+        var_storage = storage_settings_for_variable(var_name, var_dims, dimensions_info, compression_level,
+                                                    storage_settings, var_shape)
+        align_lines = var_storage[CHUNKSIZES_KEY][0] if CHUNKSIZES_KEY in var_storage else 1
+        has_overviews = bool(overview_factors) and wants_overviews(var_name, var_dims, overview_patterns)
+        if has_overviews :
+            align_lines = math.lcm(align_lines, *overview_factors)
+
+        block_lines  = min(var_shape[0], lines_per_block(var_shape, item_size, copy_buffer_size, align_lines))
+        block_bytes  = block_lines * (var_bytes // var_shape[0])
+        block_need   = BLOCK_COPIES * block_bytes
+        if has_overviews :
+            block_need += (block_bytes // max(1, item_size)) * OVERVIEW_BYTES_PER_VALUE + block_bytes
+        largest_block = max(largest_block, block_bytes)
+        largest_need  = max(largest_need, block_need)
+
+    LOG.debug(file_path + " holds " + _megabytes(total_bytes) + " of variable data, read in blocks of up to "
+              + _megabytes(largest_block) + ".")
+
+    return WORKER_BASE_MEMORY + largest_need + read_ahead_size
+
+def scheduled_conversions (worker_pool, worker_args, memory_budget, jobs) :
+    """
+    convert files in a worker pool with _convert_file_in_worker, starting each file once the memory
+    estimated for it (see estimate_conversion_memory) is free in the memory_budget (in bytes) and
+    fewer than jobs files are being converted
+
+    Files are started in the order given, so a large file waits for memory to free up rather than
+    being passed over again and again by smaller files behind it. A file that needs more than the
+    whole budget is converted once nothing else is running. Each decision is logged, so the budget
+    can be tuned.
+
+    Results are generated in the same order as worker_args, as the pool's imap would give them.
+    """
+
+    finished_queue = queue.Queue() # (file index, whether the conversion worked, result or error), as they finish
+    reserved       = { }           # file index -> the memory reserved for it, for running files
+    finished       = { }           # file index -> (whether the conversion worked, result or error)
+    memory_used    = 0
+    next_index     = 0             # the index of the next result to hand back
+
+    def _wait_for_one () :
+        """
+        wait for a running file to finish and return the memory it had reserved
+        """
+        file_index, worked, result = finished_queue.get()
+        finished[file_index] = (worked, result)
+        return reserved.pop(file_index)
+
+    def _results_in_order () :
+        """
+        hand back the results that are finished and aren't waiting for earlier files
+        """
+        results = [ ]
+        while next_index + len(results) in finished :
+            worked, result = finished.pop(next_index + len(results))
+            if not worked :
+                raise result
+            results.append(result)
+        return results
+
+    for file_index, file_args in enumerate(worker_args) :
+        file_path = file_args[1]
+        convert_options = file_args[3]
+        # the header is read from the decompressed copy of the file, if there is one
+        file_memory = estimate_conversion_memory(file_args[5] or file_path,
+                                                 **dict((option_name, convert_options[option_name])
+                                                        for option_name in MEMORY_OPTIONS if option_name in convert_options))
+
+        if file_memory > memory_budget :
+            LOG.warn("Converting " + file_path + " is estimated to need " + _megabytes(file_memory) + ", more than "
+                     + "the whole memory budget of " + _megabytes(memory_budget) + ". It will be converted on its own.")
+
+        # wait until there's room for this file, or nothing else is running
+        while len(reserved) > 0 and (len(reserved) >= jobs or memory_used + file_memory > memory_budget) :
+            LOG.info("Waiting to start " + file_path + " (needs " + _megabytes(file_memory) + "); "
+                     + _megabytes(memory_used) + " of " + _megabytes(memory_budget) + " is in use by "
+                     + str(len(reserved)) + " running conversions.")
+            memory_used -= _wait_for_one()
+
+        reserved[file_index] = file_memory
+        memory_used += file_memory
+        LOG.info("Starting " + file_path + " (needs " + _megabytes(file_memory) + "); " + _megabytes(memory_used)
+                 + " of " + _megabytes(memory_budget) + " is now in use by " + str(len(reserved))
+                 + " running conversions.")
+        worker_pool.apply_async(_convert_file_in_worker, (file_args,),
+                                callback=functools.partial(_put_result, finished_queue, file_index, True),
+                                error_callback=functools.partial(_put_result, finished_queue, file_index, False))
+
+        # pick up anything that finished while we were starting this file
+        while not finished_queue.empty() :
+            memory_used -= _wait_for_one()
+        for result in _results_in_order() :
+            next_index += 1
+            yield result
+
+    # hand back the rest of the results as they finish
+    while len(reserved) > 0 :
+        memory_used -= _wait_for_one()
+        for result in _results_in_order() :
+            next_index += 1
+            yield result
+
+def _put_result (finished_queue, file_index, worked, result) :
+    """
+    called by the worker pool when a file is finished, to pass its result back to scheduled_conversions
+    """
+
+    finished_queue.put((file_index, worked, result))
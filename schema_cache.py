@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Caching for the results of metadata processing, keyed by the schema of the input file.
+
+Geocat files from the same satellite and set of algorithms have the same variable names,
+shapes, data types, and variable attributes, so the dimensions and attribute changes worked
+out for one of them can be reused for the rest. The cache can optionally be saved to a
+directory so that it is shared between runs and between worker processes.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os, logging, hashlib, pickle, copy, tempfile
+from constants import *
+
+LOG = logging.getLogger(__name__)
+
+# the kinds of results that are cached
+DIMENSIONS_CACHE_KIND  = "dimensions"
+VAR_CLEANUP_CACHE_KIND = "variable_cleanup"
+GEO_HASH_CACHE_KIND    = "geolocation_hash" # keyed by input file and its state, see input_file_signature
+
+def input_file_signature (file_path, extra_info=None) :
+    """
+    build a signature for the current state of an input file from its path, size and modification time,
+    and any extra_info (which must have a stable repr) that the cached result also depends on
+    """
+
+    file_stat = os.stat(file_path)
+    file_state = (os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime_ns, extra_info)
+
+    return hashlib.sha1(repr(file_state).encode("utf-8")).hexdigest()
+
+# the extension used for cache files saved to disk
+CACHE_FILE_SUFFIX = ".pickle"
+
+def _rules_signature () :
+    """
+    build a signature for the rules in constants that the cached results depend on,
+    so that changing the rules invalidates anything cached with the old rules
+    """
+
+    rules = (
+                SPECIAL_VARIABLES,
+                VARS_TO_DELETE,
+                sorted(BAD_UNITS_SET),
+                CONVERT_ATTRS_MAP,
+                LONG_NAME_MAP,
+                RANGE_LIMS_MAP,
+                FLAG_INFO_MAP,
+                SHORT_RANGE_DEFAULT,
+            )
+
+    return hashlib.sha1(repr(rules).encode("utf-8")).hexdigest()
+
+RULES_SIGNATURE = _rules_signature()
+
+def schema_signature (in_file_info) :
+    """
+    build a signature for the schema of a file from the names, shapes, data types and attributes of
+    its variables (in the format returned by read_hdf4_info); global attributes are not included
+    """
+
+    sha = hashlib.sha1(RULES_SIGNATURE.encode("utf-8"))
+
+    for var_name in in_file_info[VAR_LIST_KEY] :
+        var_info = in_file_info[VAR_INFO_KEY][var_name]
+        var_schema = (
+                        var_name,
+                        tuple(var_info[SHAPE_KEY]),
+                        var_info[DATA_TYPE_KEY] if DATA_TYPE_KEY in var_info else None,
+                        sorted(var_info[VAR_ATTRS_KEY].items()),
+                     )
+        sha.update(repr(var_schema).encode("utf-8"))
+
+    return sha.hexdigest()
+
+class SchemaCache (object) :
+    """
+    a cache of metadata processing results keyed by the kind of result and a schema signature
+
+    results are kept in memory and, if a cache directory is given, saved as one file per result
+    in that directory; values are copied going in and out so callers may change them freely
+    """
+
+    def __init__ (self, cache_dir=None) :
+        self.cache_dir = cache_dir
+        self.results   = { }
+
+        if self.cache_dir is not None and not os.path.isdir(self.cache_dir) :
+            LOG.info("Creating schema cache directory: " + self.cache_dir)
+            # other worker processes may be making the directory at the same time
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _cache_file_path (self, kind, signature) :
+        return os.path.join(self.cache_dir, kind + "_" + signature + CACHE_FILE_SUFFIX)
+
+    def get (self, kind, signature) :
+        """
+        get a copy of the cached result for this kind and signature, or None if there isn't one
+        """
+
+        key = (kind, signature)
+
+        # if we don't have it in memory, check if another run saved it to disk
+        if key not in self.results and self.cache_dir is not None :
+            file_path = self._cache_file_path(kind, signature)
+            if os.path.exists(file_path) :
+                try :
+                    with open(file_path, "rb") as cache_file :
+                        self.results[key] = pickle.load(cache_file)
+                except Exception :
+                    LOG.warn("Unable to read schema cache file (" + file_path + "). It will be ignored.")
+
+        if key not in self.results :
+            return None
+
+        LOG.debug("Using cached " + kind + " results for schema " + signature + ".")
+
+        return copy.deepcopy(self.results[key])
+
+    def put (self, kind, signature, value) :
+        """
+        save a copy of the result for this kind and signature
+        """
+
+        key = (kind, signature)
+        self.results[key] = copy.deepcopy(value)
+
+        if self.cache_dir is not None :
+            # write to a temporary file and rename it, so other processes never see a partial file
+            file_path = self._cache_file_path(kind, signature)
+            temp_handle, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=CACHE_FILE_SUFFIX + ".tmp")
+            try :
+                with os.fdopen(temp_handle, "wb") as cache_file :
+                    pickle.dump(self.results[key], cache_file, pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, file_path)
+            except Exception :
+                LOG.warn("Unable to save schema cache file (" + file_path + ").")
+                if os.path.exists(temp_path) :
+                    os.remove(temp_path)
+
+# the schema caches in use by this process, keyed by cache directory
+_SCHEMA_CACHES = { }
+
+def get_schema_cache (cache_dir=None) :
+    """
+    get the schema cache for this process that uses the given cache directory (or None
+    for a cache that is only kept in memory), creating it if needed
+    """
+
+    if cache_dir not in _SCHEMA_CACHES :
+        _SCHEMA_CACHES[cache_dir] = SchemaCache(cache_dir)
+
+    return _SCHEMA_CACHES[cache_dir]
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Routines to split one conversion across several nodes that share a file system.
+
+Each node is given a shard (K of N) and only converts the input files whose names hash to that
+shard. The hash is of the file name, not the full path, so nodes that mount the shared file
+system in different places still agree on the split. Lock files can also be used so that runs
+that overlap (for example, two watches of the same directory) don't convert the same file at once.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os, logging, hashlib, socket, time, uuid
+from constants import *
+
+LOG = logging.getLogger(__name__)
+
+def parse_shard (shard_text) :
+    """
+    parse a shard from the command line in the form "K/N", where K is the shard to convert
+    (counting from 0) out of N shards
+
+    returns (K, N)
+    """
+
+    index_text, separator, count_text = shard_text.partition("/")
+    if not separator :
+        raise ValueError("Shard (" + shard_text + ") is not in the form K/N.")
+    shard_index, shard_count = int(index_text), int(count_text)
+    if shard_count < 1 or not 0 <= shard_index < shard_count :
+        raise ValueError("Shard (" + shard_text + ") must have 0 <= K < N.")
+
+    return shard_index, shard_count
+
+def in_shard (file_path, shard) :
+    """
+    check if a file belongs in a shard (K, N), by a stable hash of its file name
+    """
+
+    shard_index, shard_count = shard
+    name_hash = hashlib.md5(os.path.split(file_path)[1].encode("utf-8")).hexdigest()
+
+    return int(name_hash, 16) % shard_count == shard_index
+
+def process_tag () :
+    """
+    get a tag naming this process that is unique across the nodes sharing the file system
+    """
+
+    return socket.gethostname() + "." + str(os.getpid())
+
+def _read_lock_token (lock_path) :
+    """
+    read the token written in a lock file, or None if it can't be read (for example, if it was just removed)
+    """
+
+    try :
+        with open(lock_path, "r") as lock_file :
+            return lock_file.read()
+    except OSError :
+        return None
+
+def acquire_lock (output_path, stale_seconds=LOCK_STALE_SECONDS) :
+    """
+    try to take the lock file for an output file, so no other process converts to it at the same time;
+    a lock older than stale_seconds is assumed to be left over from a crashed run and is taken over
+
+    Each lock file holds a token unique to the process and attempt that made it. A stale lock is taken
+    over by renaming it to a name only we use (only one process can rename it) and checking that the
+    file we moved is the stale lock we looked at, not a new lock another process made after taking the
+    stale one over; if it isn't, the new lock is put back and we don't get the lock.
+
+    returns the lock (to give to release_lock) if we got it, or None if another process has it
+    """
+
+    lock_path  = output_path + LOCK_FILE_SUFFIX
+    lock_token = process_tag() + "." + uuid.uuid4().hex + "\n"
+
+    for attempt_num in range(2) :
+        try :
+            lock_handle = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError :
+            stale_token = _read_lock_token(lock_path)
+            try :
+                lock_age = time.time() - os.path.getmtime(lock_path)
+            except OSError :
+                continue # the lock was let go while we were looking at it
+            if stale_token is None or lock_age < stale_seconds or attempt_num > 0 :
+                return None
+
+            # move the stale lock out of the way, where no other process will touch it
+            taken_path = lock_path + "." + uuid.uuid4().hex + ".stale"
+            try :
+                os.rename(lock_path, taken_path)
+            except OSError :
+                return None # another process took the stale lock over first
+            if _read_lock_token(taken_path) != stale_token :
+                # we moved a new lock made by the process that took the stale lock over, put it back
+                try :
+                    os.link(taken_path, lock_path)
+                except OSError :
+                    pass
+                os.remove(taken_path)
+                return None
+            LOG.warn("Taking over lock file left " + str(int(lock_age)) + " seconds ago: " + lock_path)
+            os.remove(taken_path)
+            continue
+
+        # record who has the lock, to help with cleaning up after a crash and so we only ever remove our own lock
+        with os.fdopen(lock_handle, "w") as lock_file :
+            lock_file.write(lock_token)
+        return lock_path, lock_token
+
+    return None
+
+def release_lock (lock) :
+    """
+    let go of a lock taken with acquire_lock, if we still hold it
+    """
+
+    lock_path, lock_token = lock
+    if _read_lock_token(lock_path) != lock_token :
+        LOG.warn("Lock file was taken over by another process before we let go of it: " + lock_path)
+        return
+
+    try :
+        os.remove(lock_path)
+    except OSError :
+        LOG.warn("Unable to remove lock file: " + lock_path)
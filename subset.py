@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Routines to subset Geocat files by variable and by region as they are converted.
+
+Variables are chosen with include and exclude name patterns. The region is a window of lines and
+elements, given directly or found from a latitude/longitude bounding box. The window is recorded
+in the file info as an offset for each variable and the variable shapes are cut down to the size
+of the window, so that only the window is read from the input (as hdf4 hyperslabs) and the output
+dimensions are sized to match.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import logging, re
+import numpy
+from constants import *
+from convert import determine_dimensions, read_variable_blocks, hdf4_type_size
+
+LOG = logging.getLogger(__name__)
+
+def parse_index_range (range_text) :
+    """
+    parse a range of indexes from the command line in the form "first:last" (like a python slice,
+    so the last index is not included and either may be left out)
+
+    returns the first and last indexes, with None for any that were left out
+    """
+
+    first_text, separator, last_text = range_text.partition(":")
+    if not separator :
+        raise ValueError("Index range (" + range_text + ") is not in the form first:last.")
+
+    return (int(first_text) if first_text.strip() else None), (int(last_text) if last_text.strip() else None)
+
+def parse_bounding_box (bbox_text) :
+    """
+    parse a latitude/longitude bounding box from the command line in the form "west,south,east,north"
+    (in degrees); if west is larger than east the box crosses the antimeridian
+    """
+
+    bbox = [float(value) for value in bbox_text.split(",")]
+    if len(bbox) != 4 :
+        raise ValueError("Bounding box (" + bbox_text + ") is not in the form west,south,east,north.")
+    if bbox[1] > bbox[3] :
+        raise ValueError("The south edge of bounding box (" + bbox_text + ") is north of its north edge.")
+
+    return bbox
+
+def select_variables (in_file_info, include_patterns=None, exclude_patterns=None) :
+    """
+    remove the variables from in_file_info that don't match any of the include_patterns (if there are any)
+    or that match any of the exclude_patterns; patterns are matched from the start of the variable names
+    """
+
+    for var_name in list(in_file_info[VAR_INFO_KEY].keys()) :
+        is_included = not include_patterns or any(re.match(pattern, var_name) for pattern in include_patterns)
+        is_excluded = exclude_patterns and any(re.match(pattern, var_name) for pattern in exclude_patterns)
+        if not is_included or is_excluded :
+            LOG.debug("Leaving variable " + var_name + " out of the subset.")
+            del in_file_info[VAR_INFO_KEY][var_name]
+    in_file_info[VAR_LIST_KEY] = list(in_file_info[VAR_INFO_KEY].keys())
+
+def window_from_bounding_box (in_file_obj, in_file_info, bbox, copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE) :
+    """
+    find the window of lines and elements that covers every pixel inside a bounding box (see
+    parse_bounding_box), reading the latitude and longitude a block at a time
+
+    returns ((first line, last line + 1), (first element, last element + 1)), or None if no pixels are inside
+    """
+
+    west, south, east, north = bbox
+    if LAT_VAR_NAME not in in_file_info[VAR_INFO_KEY] or LON_VAR_NAME not in in_file_info[VAR_INFO_KEY] :
+        raise ValueError("The file has no " + LAT_VAR_NAME + " and " + LON_VAR_NAME + " to find the bounding box with.")
+
+    lat_fill = in_file_info[VAR_INFO_KEY][LAT_VAR_NAME][VAR_ATTRS_KEY].get(FILL_VALUE_KEY)
+    lon_fill = in_file_info[VAR_INFO_KEY][LON_VAR_NAME][VAR_ATTRS_KEY].get(FILL_VALUE_KEY)
+
+    lat_shape = in_file_info[VAR_INFO_KEY][LAT_VAR_NAME][SHAPE_KEY]
+    lon_shape = in_file_info[VAR_INFO_KEY][LON_VAR_NAME][SHAPE_KEY]
+    if tuple(lat_shape) != tuple(lon_shape) :
+        raise ValueError("The " + LAT_VAR_NAME + " and " + LON_VAR_NAME + " in the file have different shapes.")
+
+    # both are read in blocks of the same lines, sized for whichever has the larger data type
+    lat_var_obj = in_file_obj.select(LAT_VAR_NAME)
+    lon_var_obj = in_file_obj.select(LON_VAR_NAME)
+    item_size   = max(hdf4_type_size(lat_var_obj.info()[3]), hdf4_type_size(lon_var_obj.info()[3]))
+    lat_blocks  = read_variable_blocks(lat_var_obj, lat_shape, item_size, copy_buffer_size,
+                                       offset=in_file_info[VAR_INFO_KEY][LAT_VAR_NAME].get(OFFSET_KEY))
+    lon_blocks  = read_variable_blocks(lon_var_obj, lon_shape, item_size, copy_buffer_size,
+                                       offset=in_file_info[VAR_INFO_KEY][LON_VAR_NAME].get(OFFSET_KEY))
+
+    rows_inside = [ ]
+    cols_inside = None
+    for (start_line, lat_data), (_, lon_data) in zip(lat_blocks, lon_blocks) :
+        inside = (lat_data >= south) & (lat_data <= north)
+        if west <= east :
+            inside &= (lon_data >= west) & (lon_data <= east)
+        else :
+            inside &= (lon_data >= west) | (lon_data <= east)
+        if lat_fill is not None :
+            inside &= lat_data != lat_fill
+        if lon_fill is not None :
+            inside &= lon_data != lon_fill
+
+        block_rows = numpy.flatnonzero(inside.any(axis=1))
+        if block_rows.size > 0 :
+            rows_inside += [start_line + block_rows[0], start_line + block_rows[-1]]
+        block_cols = inside.any(axis=0)
+        cols_inside = block_cols if cols_inside is None else cols_inside | block_cols
+    lat_var_obj.endaccess()
+    lon_var_obj.endaccess()
+
+    if len(rows_inside) <= 0 :
+        return None
+    cols_inside = numpy.flatnonzero(cols_inside)
+
+    return (int(min(rows_inside)), int(max(rows_inside)) + 1), (int(cols_inside[0]), int(cols_inside[-1]) + 1)
+
+def apply_window (in_file_info, line_range=None, element_range=None, schema_cache=None) :
+    """
+    cut the variables in in_file_info indexed by lines or elements down to a window of the lines and elements;
+    the ranges are (first, last + 1) with None for either end to use the edge of the data, and are clipped to
+    the data; each variable's info gets an OFFSET_KEY with the start of the window in each of its dimensions
+
+    returns False if the window has no data in it
+    """
+
+    dimensions_info, variable_dimensions_info = determine_dimensions(in_file_info, schema_cache=schema_cache)
+
+    windows = { }
+    for dim_name, dim_range in [(LINES_DIM_NAME, line_range), (ELEMS_DIM_NAME, element_range)] :
+        if dim_range is None or dimensions_info.get(dim_name) is None :
+            continue
+        # slice gives us python's usual handling of None and negative indexes
+        first, last, _ = slice(*dim_range).indices(dimensions_info[dim_name])
+        if last <= first :
+            return False
+        windows[dim_name] = (first, last)
+
+    for var_name in in_file_info[VAR_LIST_KEY] :
+        var_info  = in_file_info[VAR_INFO_KEY][var_name]
+        var_dims  = variable_dimensions_info[var_name]
+        offset    = [windows[dim_name][0] if dim_name in windows else 0 for dim_name in var_dims]
+        var_shape = [windows[dim_name][1] - windows[dim_name][0] if dim_name in windows else dim_size
+                     for dim_name, dim_size in zip(var_dims, var_info[SHAPE_KEY])]
+        if any(offset) or list(var_shape) != list(var_info[SHAPE_KEY]) :
+            var_info[OFFSET_KEY] = tuple(offset)
+            var_info[SHAPE_KEY]  = tuple(var_shape)
+
+    # record what part of the input this is
+    if LINES_DIM_NAME in windows :
+        in_file_info[GLOBAL_ATTRS_KEY][SOURCE_LINES_ATTR_NAME] = list(windows[LINES_DIM_NAME])
+    if ELEMS_DIM_NAME in windows :
+        in_file_info[GLOBAL_ATTRS_KEY][SOURCE_ELEMS_ATTR_NAME] = list(windows[ELEMS_DIM_NAME])
+
+    return True
+
+def subset_file_info (in_file_obj, in_file_info, include_patterns=None, exclude_patterns=None,
+                      line_range=None, element_range=None, bbox=None, copy_buffer_size=DEFAULT_COPY_BUFFER_SIZE,
+                      schema_cache=None) :
+    """
+    subset in_file_info (after compliance_cleanup) in place by variable and by region, see select_variables
+    and apply_window; if a bbox is given the window is found from it and line_range and element_range are ignored
+
+    returns False if the subset has no data in it
+    """
+
+    if bbox is not None :
+        window = window_from_bounding_box(in_file_obj, in_file_info, bbox, copy_buffer_size)
+        if window is None :
+            LOG.warn("No pixels fall inside the bounding box " + str(bbox) + ".")
+            return False
+        line_range, element_range = window
+        LOG.debug("Bounding box " + str(bbox) + " covers lines " + str(line_range) + " and elements " + str(element_range) + ".")
+
+    select_variables(in_file_info, include_patterns, exclude_patterns)
+
+    if line_range is not None or element_range is not None :
+        if not apply_window(in_file_info, line_range, element_range, schema_cache) :
+            LOG.warn("The window of lines " + str(line_range) + " and elements " + str(element_range) + " has no data in it.")
+            return False
+
+    return True
@@ -0,0 +1,30 @@
+# encoding: utf-8
+"""
+
+Shared fixtures for the converter tests.
+
+The converter modules live at the top of the repository, so that directory is put on the path here.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+@pytest.fixture
+def make_granule (tmp_path) :
+    """
+    make a synthetic Geocat-like hdf4 granule (see benchmark.make_synthetic_granule) in a temporary directory
+    """
+
+    from benchmark import make_synthetic_granule
+
+    def _make_granule (lines=64, elements=48, file_index=0, file_name=None) :
+        file_path = str(tmp_path / (file_name or "synthetic_geocat_" + str(file_index) + ".hdf"))
+        make_synthetic_granule(file_path, lines, elements, file_index)
+        return file_path
+
+    return _make_granule
@@ -0,0 +1,101 @@
+# encoding: utf-8
+"""
+
+Tests for aggregating granules along a time dimension (see the aggregate module).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os
+
+import numpy
+from netCDF4 import Dataset
+
+from constants import *
+import aggregate
+
+def test_time_steps_follow_image_time (make_granule, tmp_path) :
+    # names that sort in the opposite order to their image times
+    in_paths = [make_granule(file_index=2, file_name="a.hdf"),
+                make_granule(file_index=1, file_name="m.hdf"),
+                make_granule(file_index=0, file_name="z.hdf")]
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    assert aggregate.aggregate_files(str(out_dir), in_paths) == 0
+
+    assert os.listdir(str(out_dir)) == ["z" + AGGREGATE_FILE_SUFFIX + OUT_FILE_SUFFIX]
+    out_file = Dataset(str(out_dir / os.listdir(str(out_dir))[0]))
+    assert list(out_file.variables[SOURCE_FILE_VAR_NAME][:]) == ["z.hdf", "m.hdf", "a.hdf"]
+    assert numpy.all(numpy.diff(out_file.variables[TIME_VAR_NAME][:]) > 0)
+    out_file.close()
+
+def _fail_part_way_through (monkeypatch, bad_datetime_text) :
+    # the bad granule fails after some of its data has been written
+    real_read_file_blocks = aggregate.read_file_blocks
+    def _read_file_blocks (in_file_obj, in_file_info, var_names, copy_buffer_size) :
+        for block_num, block in enumerate(real_read_file_blocks(in_file_obj, in_file_info, var_names, copy_buffer_size)) :
+            if block_num > 3 and in_file_info[GLOBAL_ATTRS_KEY][IMAGE_DATETIME_ATTR_NAME] == bad_datetime_text :
+                raise IOError("read failed")
+            yield block
+    monkeypatch.setattr(aggregate, "read_file_blocks", _read_file_blocks)
+
+def _image_datetime_text (in_path) :
+    from convert import read_hdf4_info, compliance_cleanup
+    in_file_info, in_file_obj = read_hdf4_info(in_path)
+    in_file_obj.end()
+    compliance_cleanup(in_file_info)
+    return in_file_info[GLOBAL_ATTRS_KEY][IMAGE_DATETIME_ATTR_NAME]
+
+def _aggregated_sources (out_dir) :
+    assert len(os.listdir(str(out_dir))) == 1
+    out_file = Dataset(str(out_dir / os.listdir(str(out_dir))[0]))
+    sources  = list(out_file.variables[SOURCE_FILE_VAR_NAME][:])
+    out_file.close()
+    return sources
+
+def test_failed_granule_is_left_out (make_granule, tmp_path, monkeypatch) :
+    in_paths = [make_granule(file_index=file_index) for file_index in range(3)]
+    out_dir  = tmp_path / "out"
+    out_dir.mkdir()
+    _fail_part_way_through(monkeypatch, _image_datetime_text(in_paths[1]))
+
+    assert aggregate.aggregate_files(str(out_dir), in_paths, copy_buffer_size=4096) == 4
+    assert _aggregated_sources(out_dir) == [os.path.split(in_paths[0])[1], os.path.split(in_paths[2])[1]]
+
+def test_failed_last_granule_is_truncated (make_granule, tmp_path, monkeypatch) :
+    in_paths = [make_granule(file_index=file_index) for file_index in range(3)]
+    out_dir  = tmp_path / "out"
+    out_dir.mkdir()
+    _fail_part_way_through(monkeypatch, _image_datetime_text(in_paths[2]))
+
+    assert aggregate.aggregate_files(str(out_dir), in_paths, copy_buffer_size=4096) == 4
+    assert _aggregated_sources(out_dir) == [os.path.split(in_paths[0])[1], os.path.split(in_paths[1])[1]]
+
+    # the copied steps keep their data, fill values and storage settings
+    expected_dir = tmp_path / "expected"
+    expected_dir.mkdir()
+    monkeypatch.undo()
+    assert aggregate.aggregate_files(str(expected_dir), in_paths[:2]) == 0
+    out_file      = Dataset(str(out_dir / os.listdir(str(out_dir))[0]))
+    expected_file = Dataset(str(expected_dir / os.listdir(str(expected_dir))[0]))
+    for var_name, expected_var_obj in expected_file.variables.items() :
+        out_var_obj = out_file.variables[var_name]
+        assert out_var_obj.filters() == expected_var_obj.filters()
+        assert out_var_obj.ncattrs() == expected_var_obj.ncattrs()
+        numpy.testing.assert_array_equal(out_var_obj[:], expected_var_obj[:])
+    out_file.close()
+    expected_file.close()
+
+def test_order_comes_from_file_names_without_opening (tmp_path, monkeypatch) :
+    in_paths = ["geocatL2.GOES-13.2015100.1215.hdf", "geocatL2.GOES-13.2015099.2345.hdf", "geocatL2.GOES-13.2015100.0000.hdf"]
+    def _no_open (*args) :
+        raise AssertionError("files with a time in their names should not be opened")
+    monkeypatch.setattr(aggregate, "SD", _no_open)
+
+    assert sorted(in_paths, key=aggregate.granule_order_key) == [in_paths[1], in_paths[2], in_paths[0]]
+
+def test_files_without_a_name_time_are_opened (make_granule) :
+    later_path   = make_granule(file_index=1, file_name="later.hdf")
+    earlier_path = make_granule(file_index=0, file_name="earlier.hdf")
+    assert aggregate.file_name_datetime(later_path) is None
+    assert sorted([later_path, earlier_path], key=aggregate.granule_order_key) == [earlier_path, later_path]
@@ -0,0 +1,63 @@
+# encoding: utf-8
+"""
+
+Tests for converting whole files (see convert_file and hdf4_2_netcdf4).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os
+
+import numpy
+from netCDF4 import Dataset
+
+from constants import *
+import convert
+
+def _open_paths_under (dir_path) :
+    open_paths = [ ]
+    for fd_name in os.listdir("/proc/self/fd") :
+        try :
+            open_paths.append(os.readlink(os.path.join("/proc/self/fd", fd_name)))
+        except OSError :
+            pass
+    return [open_path for open_path in open_paths if open_path.startswith(str(dir_path))]
+
+def test_failed_write_closes_and_removes_output (make_granule, tmp_path, monkeypatch) :
+    in_path = make_granule()
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+
+    real_read_file_blocks = convert.read_file_blocks
+    def _fail_after_first_block (*args, **kwargs) :
+        for block_num, block in enumerate(real_read_file_blocks(*args, **kwargs)) :
+            if block_num > 0 :
+                raise IOError("read failed")
+            yield block
+    monkeypatch.setattr(convert, "read_file_blocks", _fail_after_first_block)
+
+    assert convert.convert_file(str(out_dir), in_path) == 4
+    assert os.listdir(str(out_dir)) == [ ]
+    assert _open_paths_under(out_dir) == [ ]
+
+def test_parallel_conversion_matches_serial (make_granule, tmp_path) :
+    in_paths = [make_granule(file_index=file_index) for file_index in range(3)]
+    serial_dir, parallel_dir = tmp_path / "serial", tmp_path / "parallel"
+    serial_dir.mkdir()
+    parallel_dir.mkdir()
+    assert convert.hdf4_2_netcdf4(str(serial_dir), in_paths, jobs=1) == 0
+    assert convert.hdf4_2_netcdf4(str(parallel_dir), in_paths, jobs=2) == 0
+
+    assert sorted(os.listdir(str(serial_dir))) == sorted(os.listdir(str(parallel_dir)))
+    for file_name in os.listdir(str(serial_dir)) :
+        serial_file   = Dataset(str(serial_dir / file_name))
+        parallel_file = Dataset(str(parallel_dir / file_name))
+        for var_name in serial_file.variables.keys() :
+            numpy.testing.assert_array_equal(parallel_file.variables[var_name][:], serial_file.variables[var_name][:])
+        serial_file.close()
+        parallel_file.close()
+
+def test_merge_return_codes () :
+    assert convert.merge_return_codes([0, 0]) == 0
+    assert convert.merge_return_codes([0, 2, 0, 4, 0]) == 4
+    assert convert.merge_return_codes([ ]) == 0
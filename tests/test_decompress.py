@@ -0,0 +1,188 @@
+# encoding: utf-8
+"""
+
+Tests for converting compressed input granules (see the decompress module).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os, shutil, importlib, threading, time
+
+import numpy
+import pytest
+from netCDF4 import Dataset
+
+from constants import *
+import convert, decompress
+
+def _compress (file_path, suffix) :
+    compressed_path = file_path + suffix
+    compression_module = importlib.import_module(COMPRESSION_MODULES[suffix])
+    with open(file_path, "rb") as in_file, compression_module.open(compressed_path, "wb") as out_file :
+        shutil.copyfileobj(in_file, out_file)
+    return compressed_path
+
+def _read_variables (file_path) :
+    with Dataset(file_path, "r") as nc_file :
+        return dict((var_name, nc_file.variables[var_name][:]) for var_name in nc_file.variables)
+
+@pytest.mark.parametrize("suffix", sorted(COMPRESSION_MODULES.keys()))
+def test_decompress_file_round_trip (make_granule, tmp_path, suffix) :
+    in_path = make_granule()
+    compressed_path = _compress(in_path, suffix)
+    assert decompress.compression_suffix(compressed_path) == suffix
+    assert decompress.decompressed_name(compressed_path) == os.path.basename(in_path)
+
+    local_path = str(tmp_path / "local.hdf")
+    bytes_written = decompress.decompress_file(compressed_path, local_path)
+    assert bytes_written == os.path.getsize(in_path)
+    with open(in_path, "rb") as in_file, open(local_path, "rb") as local_file :
+        assert in_file.read() == local_file.read()
+
+@pytest.mark.parametrize("suffix", sorted(COMPRESSION_MODULES.keys()))
+def test_compressed_input_converts_like_plain_input (make_granule, tmp_path, suffix) :
+    in_path = make_granule()
+    plain_dir = tmp_path / "plain"
+    compressed_dir = tmp_path / "compressed"
+    scratch_dir = tmp_path / "scratch"
+    for dir_path in (plain_dir, compressed_dir, scratch_dir) :
+        dir_path.mkdir()
+
+    compressed_path = _compress(in_path, suffix)
+    assert convert.hdf4_2_netcdf4(str(plain_dir), [in_path]) == 0
+    assert convert.hdf4_2_netcdf4(str(compressed_dir), [compressed_path], scratch_dir=str(scratch_dir)) == 0
+
+    out_name = os.path.splitext(os.path.basename(in_path))[0] + OUT_FILE_SUFFIX
+    assert os.listdir(str(compressed_dir)) == [out_name]
+    plain_vars = _read_variables(str(plain_dir / out_name))
+    compressed_vars = _read_variables(str(compressed_dir / out_name))
+    assert sorted(plain_vars.keys()) == sorted(compressed_vars.keys())
+    for var_name in plain_vars :
+        numpy.testing.assert_array_equal(plain_vars[var_name], compressed_vars[var_name])
+
+    # the decompressed copy and the scratch directory made for it are gone
+    assert os.listdir(str(scratch_dir)) == [ ]
+
+def test_scratch_space_waits_for_room (make_granule, tmp_path) :
+    first_path = _compress(make_granule(file_index=0), ".gz")
+    second_path = _compress(make_granule(file_index=1), ".gz")
+
+    # a single file is always allowed, even when it's bigger than the limit
+    scratch_parent = tmp_path / "scratch_parent"
+    scratch_parent.mkdir()
+    scratch_space = decompress.ScratchSpace(str(scratch_parent), max_bytes=1)
+    try :
+        first_local = scratch_space.decompress(first_path)
+        assert os.path.exists(first_local)
+        assert scratch_space.used_bytes == os.path.getsize(first_local)
+
+        second_local = [ ]
+        waiting = threading.Thread(target=lambda : second_local.append(scratch_space.decompress(second_path)))
+        waiting.start()
+        time.sleep(3 * decompress.SCRATCH_CHECK_INTERVAL)
+        assert waiting.is_alive() and second_local == [ ]
+
+        # converting the first file makes room for the second
+        scratch_space.release(first_path)
+        waiting.join(10)
+        assert not waiting.is_alive()
+        assert not os.path.exists(first_local)
+        assert os.path.exists(second_local[0])
+        assert scratch_space.used_bytes == os.path.getsize(second_local[0])
+
+        # removing a decompressed copy without releasing it also makes room
+        os.remove(second_local[0])
+        third_local = scratch_space.decompress(first_path)
+        assert scratch_space.used_bytes == os.path.getsize(third_local)
+    finally :
+        scratch_space.close()
+    assert os.listdir(str(scratch_parent)) == [ ]
+
+def test_closed_scratch_space_stops_waiting (make_granule, tmp_path) :
+    first_path = _compress(make_granule(file_index=0), ".bz2")
+    second_path = _compress(make_granule(file_index=1), ".bz2")
+
+    scratch_parent = tmp_path / "scratch_parent"
+    scratch_parent.mkdir()
+    scratch_space = decompress.ScratchSpace(str(scratch_parent), max_bytes=1)
+    scratch_space.decompress(first_path)
+
+    errors = [ ]
+    def _decompress_second () :
+        try :
+            scratch_space.decompress(second_path)
+        except IOError as err :
+            errors.append(err)
+    waiting = threading.Thread(target=_decompress_second)
+    waiting.start()
+    time.sleep(decompress.SCRATCH_CHECK_INTERVAL)
+    scratch_space.close()
+    waiting.join(10)
+
+    assert not waiting.is_alive() and len(errors) == 1
+    assert os.listdir(str(scratch_parent)) == [ ]
+
+def test_next_file_is_decompressed_while_this_one_is_used (make_granule, tmp_path, monkeypatch) :
+    in_paths = [_compress(make_granule(file_index=file_index), ".xz") for file_index in range(3)]
+    plain_path = make_granule(file_index=3)
+
+    scratch_parent = tmp_path / "scratch_parent"
+    scratch_parent.mkdir()
+    scratch_space = decompress.ScratchSpace(str(scratch_parent))
+    started = dict((file_path, threading.Event()) for file_path in in_paths)
+    real_decompress = scratch_space.decompress
+    def _note_decompress (file_path) :
+        started[file_path].set()
+        return real_decompress(file_path)
+    monkeypatch.setattr(scratch_space, "decompress", _note_decompress)
+
+    try :
+        local_inputs = decompress.decompressed_inputs(in_paths + [plain_path], scratch_space, prefetch=1)
+
+        file_path, local_path = next(local_inputs)
+        assert file_path == in_paths[0] and os.path.exists(local_path)
+        # the next file is being decompressed before we ask for it, but not the one after that
+        assert started[in_paths[1]].wait(10)
+        assert not started[in_paths[2]].is_set()
+
+        remaining = list(local_inputs)
+        assert [file_path for file_path, local_path in remaining] == in_paths[1:] + [plain_path]
+        for file_path, local_path in remaining[:-1] :
+            assert os.path.dirname(local_path).startswith(scratch_space.scratch_dir)
+            assert os.path.basename(local_path) == decompress.decompressed_name(file_path)
+        # files that aren't compressed are used where they are
+        assert remaining[-1] == (plain_path, plain_path)
+    finally :
+        scratch_space.close()
+    assert os.listdir(str(scratch_parent)) == [ ]
+
+def test_bad_compressed_file_is_given_as_is (tmp_path) :
+    bad_path = str(tmp_path / "broken.hdf.gz")
+    with open(bad_path, "wb") as bad_file :
+        bad_file.write(b"this is not gzip data")
+
+    scratch_space = decompress.ScratchSpace(str(tmp_path))
+    try :
+        assert list(decompress.decompressed_inputs([bad_path], scratch_space)) == [(bad_path, bad_path)]
+        assert scratch_space.local_files == { } and scratch_space.used_bytes == 0
+    finally :
+        scratch_space.close()
+
+def test_scratch_is_removed_when_conversion_fails (make_granule, tmp_path, monkeypatch) :
+    in_paths = [_compress(make_granule(file_index=file_index), ".gz") for file_index in range(2)]
+    out_dir = tmp_path / "out"
+    scratch_dir = tmp_path / "scratch"
+    out_dir.mkdir()
+    scratch_dir.mkdir()
+
+    def _fail_conversion (out_path, file_path, **kwargs) :
+        assert os.path.exists(file_path) and file_path.startswith(str(scratch_dir))
+        raise RuntimeError("conversion failed")
+    monkeypatch.setattr(convert, "convert_file", _fail_conversion)
+
+    with pytest.raises(RuntimeError) :
+        convert.hdf4_2_netcdf4(str(out_dir), in_paths, scratch_dir=str(scratch_dir))
+
+    # neither the file that failed nor the one decompressed ahead of it are left behind
+    assert os.listdir(str(scratch_dir)) == [ ]
+    assert os.listdir(str(out_dir)) == [ ]
@@ -0,0 +1,93 @@
+# encoding: utf-8
+"""
+
+Tests for finding the input files (see iter_input_files and read_files_from).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os, sys, io
+
+from constants import *
+import convert
+
+def _touch (file_path) :
+    with open(str(file_path), "w") :
+        pass
+    return str(file_path)
+
+def test_directories_are_searched_recursively (tmp_path) :
+    top_dir = tmp_path / "top"
+    (top_dir / "a" / "b").mkdir(parents=True)
+    (top_dir / "c").mkdir()
+    other_dir = tmp_path / "other"
+    other_dir.mkdir()
+
+    expected = [_touch(top_dir / "one.hdf"),
+                _touch(top_dir / "a" / "two.hdf"),
+                _touch(top_dir / "a" / "b" / "three.hdf"),
+                _touch(top_dir / "c" / "four.hdf.gz")]
+    # files of other types are left out
+    for file_name in ("notes.txt", "one.nc", "hdf", "one.hdf.bak") :
+        _touch(top_dir / "a" / file_name)
+
+    # links to files and to directories outside the search are followed
+    _touch(other_dir / "five.hdf")
+    os.symlink(str(other_dir / "five.hdf"), str(top_dir / "c" / "linked.hdf"))
+    os.symlink(str(other_dir), str(top_dir / "a" / "linked_dir"))
+    expected += [str(top_dir / "c" / "linked.hdf"), str(top_dir / "a" / "linked_dir" / "five.hdf")]
+    # a link back up the tree doesn't make the search go on forever
+    os.symlink(str(top_dir), str(top_dir / "a" / "b" / "loop"))
+    # and a broken link is skipped
+    os.symlink(str(tmp_path / "missing.hdf"), str(top_dir / "broken.hdf"))
+
+    found = list(convert.iter_input_files([str(top_dir)], INPUT_TYPES + COMPRESSED_INPUT_TYPES, search_threads=4))
+    assert sorted(found) == sorted(expected)
+
+    # without the compressed types, the .hdf.gz file isn't found
+    found = list(convert.iter_input_files([str(top_dir)], INPUT_TYPES, search_threads=1))
+    assert sorted(found) == sorted(path for path in expected if not path.endswith(".gz"))
+
+def test_each_path_is_only_given_once (tmp_path) :
+    (tmp_path / "sub").mkdir()
+    file_path = _touch(tmp_path / "sub" / "one.hdf")
+    bad_path = _touch(tmp_path / "one.txt")
+
+    found = list(convert.iter_input_files([file_path, str(tmp_path), str(tmp_path / "sub"), file_path, bad_path,
+                                           str(tmp_path / "missing")]))
+    assert found == [file_path]
+
+def test_files_are_read_from_a_list_file (tmp_path) :
+    list_path = tmp_path / "files.txt"
+    list_path.write_text("/data/one.hdf\n\n   /data/two.hdf.bz2  \n/data/notes.txt\n/data/dir\n")
+
+    found = list(convert.read_files_from(str(list_path), INPUT_TYPES + COMPRESSED_INPUT_TYPES))
+    # the listed files are not searched or checked for
+    assert found == ["/data/one.hdf", "/data/two.hdf.bz2"]
+    assert list(convert.read_files_from(str(list_path))) == ["/data/one.hdf"]
+
+def test_files_are_read_from_stdin (monkeypatch) :
+    monkeypatch.setattr(sys, "stdin", io.StringIO("/data/one.hdf\n/data/two.hdf\n"))
+
+    assert list(convert.read_files_from("-")) == ["/data/one.hdf", "/data/two.hdf"]
+    assert not sys.stdin.closed
+
+def test_listed_and_searched_files_are_converted (make_granule, tmp_path, monkeypatch) :
+    listed_path = make_granule(file_index=0)
+    piped_path = make_granule(file_index=1)
+    search_dir = tmp_path / "search"
+    search_dir.mkdir()
+    os.rename(make_granule(file_index=2), str(search_dir / "synthetic_geocat_2.hdf"))
+    out_dir = tmp_path / "out"
+
+    list_path = tmp_path / "files.txt"
+    list_path.write_text(listed_path + "\n")
+    monkeypatch.setattr(sys, "argv", ["convert.py", "-o", str(out_dir), "--files-from", str(list_path), str(search_dir)])
+    assert convert.main() == 0
+
+    monkeypatch.setattr(sys, "stdin", io.StringIO(piped_path + "\n"))
+    monkeypatch.setattr(sys, "argv", ["convert.py", "-o", str(out_dir), "--files-from", "-"])
+    assert convert.main() == 0
+
+    assert sorted(os.listdir(str(out_dir))) == ["synthetic_geocat_" + str(file_index) + OUT_FILE_SUFFIX
+                                               for file_index in range(3)]
@@ -0,0 +1,56 @@
+# encoding: utf-8
+"""
+
+Tests for converting granules in memory (see the in_memory module).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import gzip
+
+import numpy
+import pytest
+from netCDF4 import Dataset
+
+from constants import *
+import convert
+import in_memory
+
+def _assert_same_data (out_memory, expected_path) :
+    out_file      = Dataset("converted.nc", memory=bytes(out_memory))
+    expected_file = Dataset(expected_path)
+    assert sorted(out_file.variables.keys()) == sorted(expected_file.variables.keys())
+    for var_name in expected_file.variables.keys() :
+        numpy.testing.assert_array_equal(out_file.variables[var_name][:], expected_file.variables[var_name][:])
+    out_file.close()
+    expected_file.close()
+
+def test_round_trip_matches_file_conversion (make_granule, tmp_path) :
+    in_path = make_granule()
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    assert convert.convert_file(str(out_dir), in_path) == 0
+    expected_path = convert.output_file_path(str(out_dir), in_path)
+
+    # from a path, from bytes, and from compressed bytes
+    _assert_same_data(in_memory.convert_to_memory(in_path), expected_path)
+    with open(in_path, "rb") as in_file :
+        in_bytes = in_file.read()
+    _assert_same_data(in_memory.convert_to_memory(in_bytes, input_name="granule.hdf", scratch_dir=str(tmp_path)),
+                      expected_path)
+    _assert_same_data(in_memory.convert_to_memory(gzip.compress(in_bytes), input_name="granule.hdf.gz",
+                                                  scratch_dir=str(tmp_path)), expected_path)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["out", "synthetic_geocat_0.hdf"]
+
+def test_empty_subset_is_reported (make_granule) :
+    with pytest.raises(in_memory.EmptySubsetError) :
+        in_memory.convert_to_memory(make_granule(), bbox=[100.0, -10.0, 110.0, 10.0])
+
+def test_internal_value_errors_are_io_errors (make_granule, monkeypatch) :
+    def _broken_write (*args, **kwargs) :
+        raise ValueError("bad array shape")
+    monkeypatch.setattr(in_memory, "write_netCDF4_file", _broken_write)
+
+    with pytest.raises(IOError) as err_info :
+        in_memory.convert_to_memory(make_granule())
+    assert not isinstance(err_info.value, in_memory.EmptySubsetError)
@@ -0,0 +1,42 @@
+# encoding: utf-8
+"""
+
+Tests for the header-only catalog of granules (see the inventory module).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import json, sqlite3
+
+import numpy
+
+from constants import *
+import inventory
+
+def test_data_types_are_numpy_names (make_granule) :
+    record = inventory.inventory_file(make_granule(lines=64, elements=48))
+
+    variables = record[inventory.VARIABLES_KEY]
+    assert variables[LAT_VAR_NAME][DATA_TYPE_KEY] == "float32"
+    assert variables["goes_channel_1_reflectance"][DATA_TYPE_KEY] == "int16"
+    assert variables["bench_cloud_mask_packed"][DATA_TYPE_KEY] == "uint8"
+    for var_record in variables.values() :
+        num_values = int(numpy.prod(var_record[SHAPE_KEY]))
+        assert var_record[inventory.DATA_BYTES_KEY] == num_values * numpy.dtype(var_record[DATA_TYPE_KEY]).itemsize
+
+def test_catalogs_hold_the_type_names (make_granule, tmp_path) :
+    in_paths = [make_granule(file_index=file_index) for file_index in range(2)]
+
+    json_path = str(tmp_path / "catalog.jsonl")
+    assert inventory.inventory_files(json_path, in_paths) == 0
+    with open(json_path) as catalog_file :
+        records = [json.loads(line) for line in catalog_file]
+    assert [record[inventory.INPUT_PATH_KEY] for record in records] == in_paths
+    assert records[0][inventory.VARIABLES_KEY][LON_VAR_NAME][DATA_TYPE_KEY] == "float32"
+
+    sqlite_path = str(tmp_path / "catalog.sqlite")
+    assert inventory.inventory_files(sqlite_path, in_paths) == 0
+    connection = sqlite3.connect(sqlite_path)
+    data_types = connection.execute("SELECT DISTINCT data_type FROM variables WHERE var_name = ?", (LON_VAR_NAME,)).fetchall()
+    connection.close()
+    assert data_types == [("float32",)]
@@ -0,0 +1,52 @@
+# encoding: utf-8
+"""
+
+Tests for skipping inputs whose outputs are up to date (see the manifest module).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os
+
+import convert
+from manifest import ConversionManifest, conversion_options_hash
+
+def test_only_same_version_and_options_are_current (make_granule, tmp_path) :
+    in_path, manifest_path = make_granule(), str(tmp_path / "manifest.jsonl")
+    manifest = ConversionManifest(manifest_path, "1.0", options_hash=conversion_options_hash({"compression_level": 4}))
+    out_path = str(tmp_path / "out.nc")
+    open(out_path, "w").close()
+    manifest.record(in_path, out_path)
+
+    same  = ConversionManifest(manifest_path, "1.0", options_hash=conversion_options_hash({"compression_level": 4}))
+    other = ConversionManifest(manifest_path, "1.0", options_hash=conversion_options_hash({"compression_level": 0}))
+    newer = ConversionManifest(manifest_path, "1.1", options_hash=conversion_options_hash({"compression_level": 4}))
+    assert same.is_current(in_path, out_path)
+    assert not other.is_current(in_path, out_path)
+    assert not newer.is_current(in_path, out_path)
+
+def test_options_that_change_outputs_change_the_hash () :
+    base_hash = conversion_options_hash({"compression_level": 4})
+    assert conversion_options_hash({"compression_level": 4, "copy_buffer_size": 1024, "schema_cache_dir": "/tmp"}) == base_hash
+    assert conversion_options_hash({"compression_level": 4, "bbox": (0.0, 1.0, 0.0, 1.0)}) != base_hash
+    assert conversion_options_hash({"compression_level": 4, "include_patterns": ["goes_.*"]}) != base_hash
+    assert conversion_options_hash({"compression_level": 4, "overview_factors": [2, 4]}) != base_hash
+    assert conversion_options_hash({"compression_level": 4, "storage_settings": {".*": {"narrow": True}}}) != base_hash
+
+def test_changed_options_reconvert (make_granule, tmp_path) :
+    in_path, manifest_path = make_granule(), str(tmp_path / "manifest.jsonl")
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    out_path = convert.output_file_path(str(out_dir), in_path)
+
+    assert convert.hdf4_2_netcdf4(str(out_dir), [in_path], manifest_path=manifest_path, compression_level=4) == 0
+    first_inode = os.stat(out_path).st_ino
+    assert convert.hdf4_2_netcdf4(str(out_dir), [in_path], manifest_path=manifest_path, compression_level=4) == 0
+    assert os.stat(out_path).st_ino == first_inode
+    assert convert.hdf4_2_netcdf4(str(out_dir), [in_path], manifest_path=manifest_path, compression_level=0) in (0, 3)
+    assert os.stat(out_path).st_ino != first_inode
+
+def test_checkout_version_follows_the_sources () :
+    version_num = convert.converter_build_version()
+    if convert.converter_version() == "unknown" :
+        assert version_num.startswith("unknown+") and len(version_num) > len("unknown+")
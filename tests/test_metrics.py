@@ -0,0 +1,39 @@
+# encoding: utf-8
+"""
+
+Tests for the conversion timing and I/O metrics (see the metrics module).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+from datetime import datetime
+
+from constants import *
+import convert
+from metrics import ConversionMetrics, run_summary, BYTES_READ_KEY, BYTES_WRITTEN_KEY
+
+def test_narrowing_range_reads_are_counted (make_granule, tmp_path) :
+    in_path  = make_granule(lines=64, elements=48)
+    out_dir  = tmp_path / "out"
+    out_dir.mkdir()
+    var_name = "goes_channel_1_reflectance"
+
+    metrics = ConversionMetrics(in_path)
+    assert convert.convert_file(str(out_dir), in_path, metrics=metrics,
+                                storage_settings={var_name: {NARROW_TYPE_KEY: True}}) == 0
+
+    # the data range is read once before the copy, and once more for the copy itself
+    var_io = metrics.variables[var_name]
+    assert var_io[BYTES_READ_KEY] == 2 * 64 * 48 * 2
+    assert var_io[BYTES_WRITTEN_KEY] == 64 * 48 * 2
+
+def test_memory_is_sampled_per_file (make_granule) :
+    metrics = ConversionMetrics(make_granule())
+    metrics.finish(0)
+    file_metrics = metrics.to_dict()
+    assert file_metrics["rss_start_bytes"] > 0 and file_metrics["rss_end_bytes"] > 0
+    assert file_metrics["process_peak_rss_bytes"] > 0
+
+    summary = run_summary([file_metrics], 1.0, 0)
+    assert summary["peak_rss_bytes"] >= file_metrics["process_peak_rss_bytes"]
+    datetime.strptime(summary["run_time"], ISO_OUT_TIME_FORMAT)
@@ -0,0 +1,57 @@
+# encoding: utf-8
+"""
+
+Tests for the downsampled overview variables (see the overviews module).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import numpy
+from netCDF4 import Dataset
+
+from constants import *
+import convert
+from overviews import reduce_block, overview_name
+
+def test_mean_ignores_fill_and_nan () :
+    data = numpy.array([[1.0, 3.0, -999.0, -999.0],
+                        [numpy.nan, 5.0, -999.0, -999.0]], dtype=numpy.float32)
+    result = reduce_block(data, 2, numpy.float32(-999.0))
+    assert result.dtype == numpy.float32
+    assert result.tolist() == [[3.0, -999.0]]
+
+def test_integer_mean_is_rounded_and_keeps_type () :
+    data = numpy.array([[1, 2], [2, 2]], dtype=numpy.int16)
+    result = reduce_block(data, 2, numpy.int16(-32768))
+    assert result.dtype == numpy.int16
+    assert result.tolist() == [[2]]
+
+def test_mode_ignores_edge_padding () :
+    # the last box is only one element wide, padding must not outvote the real value in it
+    data = numpy.array([[0, 0, 3],
+                        [0, 0, 3]], dtype=numpy.int8)
+    assert reduce_block(data, 2, None, [0, 1, 2, 3]).tolist() == [[0, 3]]
+    assert reduce_block(data, 2, numpy.int8(-128), [0, 1, 2, 3]).tolist() == [[0, 3]]
+
+def test_mode_of_all_fill_box_is_fill () :
+    data = numpy.array([[-128, -128], [-128, 2]], dtype=numpy.int8)
+    assert reduce_block(data, 2, numpy.int8(-128), [0, 1, 2, 3]).tolist() == [[2]]
+    assert reduce_block(numpy.full((2, 2), -128, dtype=numpy.int8), 2, numpy.int8(-128), [0, 1, 2, 3]).tolist() == [[-128]]
+
+def test_blockwise_overviews_match_whole_array (make_granule, tmp_path) :
+    # factors that don't divide each other or the block size, with blocks far smaller than the variable
+    in_path = make_granule(lines=1024, elements=64)
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    assert convert.convert_file(str(out_dir), in_path, copy_buffer_size=16 * 1024, overview_factors=[3, 4]) == 0
+
+    out_file = Dataset(convert.output_file_path(str(out_dir), in_path))
+    out_file.set_auto_maskandscale(False)
+    for var_name in [LAT_VAR_NAME, "bench_cloud_mask"] :
+        var_obj   = out_file.variables[var_name]
+        var_data  = var_obj[:]
+        flag_vals = list(var_obj.getncattr(FLAG_VALS_ATTR_NAME)) if FLAG_VALS_ATTR_NAME in var_obj.ncattrs() else None
+        for factor in [3, 4] :
+            expected = reduce_block(var_data, factor, var_obj.getncattr(FILL_VALUE_KEY), flag_vals)
+            numpy.testing.assert_array_equal(out_file.variables[overview_name(var_name, factor)][:], expected)
+    out_file.close()
@@ -0,0 +1,56 @@
+# encoding: utf-8
+"""
+
+Tests for unpacking the bit fields of packed variables (see the packed_flags module).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import numpy
+from netCDF4 import Dataset
+
+from constants import *
+import convert
+import packed_flags
+
+CLOUD_MASK_LAYOUT = [("cloud_mask", {PACKED_BYTE_KEY: 0, PACKED_BITS_KEY: (1, 2),
+                                     FLAG_VALS_ATTR_NAME: [0, 1, 2, 3],
+                                     FLAG_MEANINGS_ATTR_NAME: "confident_cloudy probably_cloudy probably_clear confident_clear"})]
+
+def test_unpack_field () :
+    packed = numpy.array([[[0b00000110, 0], [0b11111001, 0]]], dtype=numpy.uint8).view(numpy.int8)
+    field  = packed_flags.unpack_field(packed, CLOUD_MASK_LAYOUT[0][1])
+    assert field.dtype == numpy.uint8
+    assert field.tolist() == [[3, 0]]
+
+def test_packed_variables_without_layout_are_not_unpacked (make_granule, tmp_path) :
+    in_path = make_granule()
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    assert convert.convert_file(str(out_dir), in_path, unpack_flags=True) == 0
+    out_file = Dataset(convert.output_file_path(str(out_dir), in_path))
+    packed_names = [var_name for var_name in out_file.variables.keys() if var_name.endswith(PACKED_VAR_SUFFIX)]
+    assert len(packed_names) > 0
+    assert not any(var_name.startswith(packed_name + "_") for var_name in out_file.variables.keys() for packed_name in packed_names)
+    out_file.close()
+
+def test_fields_are_unpacked_with_a_layout (make_granule, tmp_path, monkeypatch) :
+    real_rules = packed_flags.match_variable_rules
+    def _rules_with_layout (var_name) :
+        rules = dict(real_rules(var_name))
+        if var_name.endswith("_cloud_mask_packed") :
+            rules[PACKED_FLAGS_RULE] = CLOUD_MASK_LAYOUT
+        return rules
+    monkeypatch.setattr(packed_flags, "match_variable_rules", _rules_with_layout)
+
+    in_path = make_granule()
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    assert convert.convert_file(str(out_dir), in_path, unpack_flags=True, copy_buffer_size=2048) == 0
+    out_file = Dataset(convert.output_file_path(str(out_dir), in_path))
+    out_file.set_auto_maskandscale(False)
+    packed  = out_file.variables["bench_cloud_mask_packed"][:]
+    flags   = out_file.variables["bench_cloud_mask_packed_cloud_mask"]
+    numpy.testing.assert_array_equal(flags[:], (packed[..., 0].view(numpy.uint8) >> 1) & 3)
+    assert flags.getncattr(FLAG_MEANINGS_ATTR_NAME) == CLOUD_MASK_LAYOUT[0][1][FLAG_MEANINGS_ATTR_NAME]
+    out_file.close()
@@ -0,0 +1,58 @@
+# encoding: utf-8
+"""
+
+Tests for narrowing integer variables and quantizing float variables (see packing_for_variable).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import numpy
+
+from constants import *
+import convert
+
+def test_narrowest_type_keeps_a_fill_value_that_fits () :
+    assert convert.narrowest_integer_type(numpy.dtype("int32"), (0, 10), -1) == (numpy.dtype("int8"), -1)
+
+def test_fill_value_moves_to_the_edge_of_the_new_type () :
+    # below the data if there is room there, otherwise above it
+    assert convert.narrowest_integer_type(numpy.dtype("int16"), (-5, 100), -32768) == (numpy.dtype("int8"), -128)
+    assert convert.narrowest_integer_type(numpy.dtype("int16"), (0, 200), -32768)  == (numpy.dtype("uint8"), 255)
+
+def test_no_narrowing_without_room_for_the_fill_value () :
+    assert convert.narrowest_integer_type(numpy.dtype("int16"), (0, 255), -32768) == (numpy.dtype("int16"), -32768)
+
+def test_flag_values_must_fit () :
+    assert convert.narrowest_integer_type(numpy.dtype("int16"), (0, 3), None, [0, 300]) == (numpy.dtype("int16"), None)
+
+def test_narrowing_relocates_fill_and_clips_valid_range () :
+    attrs = {FILL_VALUE_KEY: numpy.int16(-32768), VALID_RANGE_ATTR_NAME: numpy.array([-32767, 32767], dtype=numpy.int16),
+             "scale_factor": 0.01}
+    data_type, new_attrs, var_storage = convert.packing_for_variable("goes_channel_1_reflectance", numpy.dtype("int16"),
+                                                                     attrs, {NARROW_TYPE_KEY: True, ZLIB_KEY: True},
+                                                                     data_range=(0, 200))
+
+    assert data_type == numpy.dtype("uint8")
+    assert new_attrs[FILL_VALUE_KEY] == 255 and new_attrs[FILL_VALUE_KEY].dtype == numpy.uint8
+    assert list(new_attrs[VALID_RANGE_ATTR_NAME]) == [0, 254]
+    assert new_attrs[VALID_RANGE_ATTR_NAME].dtype == numpy.uint8
+    assert new_attrs["scale_factor"] == 0.01
+    assert var_storage == {ZLIB_KEY: True}
+    # the caller's attributes are left alone
+    assert attrs[FILL_VALUE_KEY] == -32768
+
+def test_valid_min_and_max_are_clipped () :
+    attrs = {FILL_VALUE_KEY: numpy.int32(-1), VALID_MIN_ATTR_NAME: numpy.int32(-1000), VALID_MAX_ATTR_NAME: numpy.int32(1000)}
+    data_type, new_attrs, _ = convert.packing_for_variable("counts", numpy.dtype("int32"), attrs,
+                                                           {NARROW_TYPE_KEY: True}, data_range=(0, 100))
+    assert data_type == numpy.dtype("int8")
+    assert (new_attrs[VALID_MIN_ATTR_NAME], new_attrs[VALID_MAX_ATTR_NAME]) == (-128, 127)
+
+def test_digits_are_in_unpacked_units () :
+    _, _, var_storage = convert.packing_for_variable("temperature", numpy.dtype("float32"), {"scale_factor": 0.01},
+                                                     {LEAST_SIG_DIGIT_KEY: 3})
+    assert var_storage[LEAST_SIG_DIGIT_KEY] == 1
+
+    # integer data isn't quantized
+    _, _, var_storage = convert.packing_for_variable("counts", numpy.dtype("int16"), { }, {LEAST_SIG_DIGIT_KEY: 3})
+    assert LEAST_SIG_DIGIT_KEY not in var_storage
@@ -0,0 +1,40 @@
+# encoding: utf-8
+"""
+
+Tests for finding the rules that apply to a variable name (see the rules module).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import re
+
+from constants import *
+from rules import match_variable_rules
+
+VAR_NAMES = ["goes_channel_2_reflectance", "goes_channel_14_brightness_temperature", "pixel_surface_type",
+             "ascm_cloud_mask", "bench_cloud_mask_packed", "bench_cloud_type_packed", "calibration_offset",
+             "bc1_planck", "scan_line_time", "pixel_latitude", "not_a_known_variable"]
+
+def _last_match (rule_map, var_name) :
+    # the way each map was searched before the index: every pattern in order, the last match wins
+    found = None
+    for pattern, value in rule_map.items() :
+        if re.match(pattern, var_name) :
+            found = value
+    return found
+
+def test_index_matches_each_map () :
+    for var_name in VAR_NAMES :
+        rules = match_variable_rules(var_name)
+        assert rules[SPECIAL_DIMS_RULE] == _last_match(SPECIAL_VARIABLES, var_name)
+        assert rules[RANGE_LIMS_RULE]   == _last_match(RANGE_LIMS_MAP, var_name)
+        assert rules[FLAG_INFO_RULE]    == _last_match(FLAG_INFO_MAP, var_name)
+        assert rules[PACKED_FLAGS_RULE] == _last_match(PACKED_FLAGS_MAP, var_name)
+        assert (rules[LONG_NAME_RULE] is None) == (_last_match(LONG_NAME_MAP, var_name) is None)
+
+def test_channel_long_names_are_filled_in () :
+    assert match_variable_rules("goes_channel_2_reflectance")[LONG_NAME_RULE] == \
+           "pixel-resolution array of reflectances for channel 2 from goes"
+
+def test_results_are_remembered () :
+    assert match_variable_rules("pixel_surface_type") is match_variable_rules("pixel_surface_type")
@@ -0,0 +1,87 @@
+# encoding: utf-8
+"""
+
+Tests for starting conversions within a memory budget (see the scheduler module).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import threading, time
+
+from constants import *
+import scheduler
+
+MB = 1024 * 1024
+
+def test_estimate_counts_overview_buffers_and_alignment (make_granule) :
+    in_path = make_granule(lines=512, elements=480)
+    lat_block_bytes = 512 * 480 * 4 # the latitude is float32, and one block of it will be the whole variable
+
+    # with a small copy buffer, blocks line up with the 256 line chunks
+    plain_memory = scheduler.estimate_conversion_memory(in_path, copy_buffer_size=64 * 1024)
+    assert plain_memory < scheduler.WORKER_BASE_MEMORY + scheduler.BLOCK_COPIES * lat_block_bytes
+
+    # a factor of 3 makes the blocks line up with lcm(256, 3) = 768 lines, so the whole variable is one block,
+    # and its overviews are reduced from float64 copies of it
+    overview_memory = scheduler.estimate_conversion_memory(in_path, copy_buffer_size=64 * 1024, overview_factors=[3],
+                                                           overview_patterns=[LAT_VAR_NAME])
+    assert overview_memory >= scheduler.WORKER_BASE_MEMORY + scheduler.BLOCK_COPIES * lat_block_bytes \
+                              + 512 * 480 * scheduler.OVERVIEW_BYTES_PER_VALUE
+
+def test_unreadable_file_needs_only_a_worker (tmp_path) :
+    bad_path = tmp_path / "bad.hdf"
+    bad_path.write_bytes(b"not an hdf file")
+    assert scheduler.estimate_conversion_memory(str(bad_path)) == scheduler.WORKER_BASE_MEMORY
+
+class _FakePool (object) :
+    """
+    a worker pool that finishes each file a little while after it is started, recording what ran at the same time
+    """
+
+    def __init__ (self, file_memory) :
+        self.file_memory = file_memory
+        self.running     = set([ ])
+        self.peak_memory = 0
+        self.peak_jobs   = 0
+        self.lock        = threading.Lock()
+
+    def apply_async (self, func, args, callback=None, error_callback=None) :
+        file_path = args[0][1]
+        with self.lock :
+            self.running.add(file_path)
+            self.peak_memory = max(self.peak_memory, sum(self.file_memory[path] for path in self.running))
+            self.peak_jobs   = max(self.peak_jobs, len(self.running))
+        def _finish () :
+            with self.lock :
+                self.running.discard(file_path)
+            callback((file_path, 0, None))
+        threading.Timer(0.02, _finish).start()
+
+def _scheduled_paths (file_memory, budget, jobs, monkeypatch) :
+    monkeypatch.setattr(scheduler, "estimate_conversion_memory", lambda file_path, **options : file_memory[file_path])
+    pool = _FakePool(file_memory)
+    worker_args = [("out", file_path, False, { }, False, None) for file_path in sorted(file_memory.keys())]
+    results = list(scheduler.scheduled_conversions(pool, worker_args, budget, jobs))
+    return [result[0] for result in results], pool
+
+def test_files_start_within_the_budget (monkeypatch) :
+    file_memory = {"a": 400 * MB, "b": 400 * MB, "c": 300 * MB, "d": 100 * MB}
+    paths, pool = _scheduled_paths(file_memory, 800 * MB, 4, monkeypatch)
+
+    assert paths == ["a", "b", "c", "d"]
+    assert pool.peak_memory <= 800 * MB
+    assert pool.peak_jobs >= 2
+
+def test_jobs_limit_is_kept (monkeypatch) :
+    file_memory = dict((name, MB) for name in "abcdef")
+    paths, pool = _scheduled_paths(file_memory, 1000 * MB, 2, monkeypatch)
+
+    assert paths == list("abcdef")
+    assert pool.peak_jobs == 2
+
+def test_file_larger_than_the_budget_runs_alone (monkeypatch) :
+    file_memory = {"a": 100 * MB, "b": 900 * MB, "c": 100 * MB}
+    paths, pool = _scheduled_paths(file_memory, 500 * MB, 3, monkeypatch)
+
+    assert paths == ["a", "b", "c"]
+    assert pool.peak_memory == 900 * MB
@@ -0,0 +1,48 @@
+# encoding: utf-8
+"""
+
+Tests for the schema cache (see the schema_cache module).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os
+
+from constants import *
+import convert
+from schema_cache import SchemaCache, schema_signature, DIMENSIONS_CACHE_KIND
+
+def test_signature_follows_schema_not_data (make_granule) :
+    first_info,  first_file  = convert.read_hdf4_info(make_granule(file_index=0))
+    second_info, second_file = convert.read_hdf4_info(make_granule(file_index=1))
+    first_file.end()
+    second_file.end()
+    assert schema_signature(first_info) == schema_signature(second_info)
+
+    changed_lat  = dict(first_info[VAR_INFO_KEY][LAT_VAR_NAME])
+    changed_lat[VAR_ATTRS_KEY] = dict(changed_lat[VAR_ATTRS_KEY], units="degrees")
+    changed_info = dict(first_info)
+    changed_info[VAR_INFO_KEY] = dict(first_info[VAR_INFO_KEY])
+    changed_info[VAR_INFO_KEY][LAT_VAR_NAME] = changed_lat
+    assert schema_signature(changed_info) != schema_signature(first_info)
+
+def test_saved_results_are_shared (tmp_path) :
+    cache_dir = str(tmp_path / "cache")
+    SchemaCache(cache_dir).put(DIMENSIONS_CACHE_KIND, "abc", {"lines": 10})
+    assert SchemaCache(cache_dir).get(DIMENSIONS_CACHE_KIND, "abc") == {"lines": 10}
+    assert SchemaCache(cache_dir).get(DIMENSIONS_CACHE_KIND, "def") is None
+
+def test_existing_cache_dir_is_fine (tmp_path) :
+    # another worker may make the directory between our check and our makedirs
+    cache_dir = str(tmp_path / "cache")
+    os.makedirs(cache_dir)
+    SchemaCache(cache_dir)
+
+def test_unusable_cache_dir_falls_back_to_memory (make_granule, tmp_path) :
+    in_path = make_granule()
+    blocker = tmp_path / "not_a_dir"
+    blocker.write_text("")
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    assert convert.convert_file(str(out_dir), in_path, schema_cache_dir=str(blocker / "cache")) == 0
+    assert os.path.exists(convert.output_file_path(str(out_dir), in_path))
@@ -0,0 +1,81 @@
+# encoding: utf-8
+"""
+
+Tests for splitting conversions across nodes (see the shards module).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os, time
+
+import pytest
+
+from constants import *
+from shards import parse_shard, in_shard, acquire_lock, release_lock
+
+def test_parse_shard () :
+    assert parse_shard("1/4") == (1, 4)
+    for bad_text in ["4/4", "-1/4", "1", "1/0"] :
+        with pytest.raises(ValueError) :
+            parse_shard(bad_text)
+
+def test_every_file_is_in_exactly_one_shard () :
+    file_names = ["geocatL2.GOES-13.2015100." + str(file_num).zfill(4) + ".hdf" for file_num in range(200)]
+    for file_name in file_names :
+        assert sum(in_shard(file_name, (shard_index, 3)) for shard_index in range(3)) == 1
+    # every shard gets some of the work
+    assert all(any(in_shard(file_name, (shard_index, 3)) for file_name in file_names) for shard_index in range(3))
+
+def test_shard_ignores_directory () :
+    assert in_shard("/mnt/a/granule.hdf", (1, 5)) == in_shard("/data/b/granule.hdf", (1, 5))
+
+def test_lock_is_exclusive (tmp_path) :
+    output_path = str(tmp_path / "out.nc")
+    lock = acquire_lock(output_path)
+    assert lock is not None
+    assert acquire_lock(output_path) is None
+    release_lock(lock)
+    assert not os.path.exists(output_path + LOCK_FILE_SUFFIX)
+    assert acquire_lock(output_path) is not None
+
+def _make_stale (output_path) :
+    lock_path = output_path + LOCK_FILE_SUFFIX
+    old_time  = time.time() - LOCK_STALE_SECONDS - 60
+    os.utime(lock_path, (old_time, old_time))
+
+def test_stale_lock_is_taken_over_once (tmp_path) :
+    output_path = str(tmp_path / "out.nc")
+    crashed_lock = acquire_lock(output_path)
+    _make_stale(output_path)
+
+    new_lock = acquire_lock(output_path)
+    assert new_lock is not None
+    # a second process that also saw the stale lock must not take the new one
+    assert acquire_lock(output_path) is None
+
+    # the crashed process no longer owns the lock and must not remove it
+    release_lock(crashed_lock)
+    assert os.path.exists(output_path + LOCK_FILE_SUFFIX)
+    release_lock(new_lock)
+    assert not os.path.exists(output_path + LOCK_FILE_SUFFIX)
+
+def test_racing_takeover_puts_new_lock_back (tmp_path, monkeypatch) :
+    # another process takes the stale lock over just before we move it out of the way
+    output_path = str(tmp_path / "out.nc")
+    acquire_lock(output_path)
+    _make_stale(output_path)
+
+    other_lock      = [ ]
+    original_rename = os.rename
+    def _lose_race_then_rename (source_path, dest_path) :
+        if not other_lock :
+            monkeypatch.setattr(os, "rename", original_rename)
+            other_lock.append(acquire_lock(output_path))
+        original_rename(source_path, dest_path)
+    monkeypatch.setattr(os, "rename", _lose_race_then_rename)
+
+    assert acquire_lock(output_path) is None
+    assert other_lock[0] is not None
+    with open(output_path + LOCK_FILE_SUFFIX) as lock_file :
+        assert lock_file.read() == other_lock[0][1]
+    assert [name for name in os.listdir(str(tmp_path)) if name.endswith(".stale")] == [ ]
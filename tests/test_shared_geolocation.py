@@ -0,0 +1,55 @@
+# encoding: utf-8
+"""
+
+Tests for sharing identical geolocation between output files (see share_geolocation).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os
+
+from netCDF4 import Dataset
+
+from constants import *
+import convert
+import schema_cache
+
+def _new_run (monkeypatch) :
+    # a new run starts without anything this process has cached in memory
+    monkeypatch.setattr(schema_cache, "_SCHEMA_CACHES", { })
+    monkeypatch.setattr(convert, "_KNOWN_SHARED_GEO_FILES", set([ ]))
+
+def _geolocation_file (out_dir, in_path) :
+    out_file = Dataset(convert.output_file_path(str(out_dir), in_path))
+    geo_file = getattr(out_file, GEOLOCATION_FILE_ATTR_NAME)
+    out_file.close()
+    return geo_file
+
+def test_rerun_uses_cached_geolocation_hash (make_granule, tmp_path, monkeypatch) :
+    in_path = make_granule()
+    out_dir, geo_dir = tmp_path / "out", tmp_path / "geo"
+    out_dir.mkdir()
+    geo_dir.mkdir()
+
+    _new_run(monkeypatch)
+    assert convert.convert_file(str(out_dir), in_path, shared_geo_dir=str(geo_dir)) == 0
+    first_geo_file = _geolocation_file(out_dir, in_path)
+
+    # the next run must not read the geolocation again to hash it
+    hashed_files = [ ]
+    real_geolocation_hash = convert.geolocation_hash
+    def _counting_geolocation_hash (*args, **kwargs) :
+        hashed_files.append(args)
+        return real_geolocation_hash(*args, **kwargs)
+    monkeypatch.setattr(convert, "geolocation_hash", _counting_geolocation_hash)
+
+    _new_run(monkeypatch)
+    assert convert.convert_file(str(out_dir), in_path, shared_geo_dir=str(geo_dir)) in (0, 3)
+    assert _geolocation_file(out_dir, in_path) == first_geo_file
+    assert hashed_files == [ ]
+
+    # but a changed input is hashed again
+    os.utime(in_path, ns=(os.stat(in_path).st_atime_ns, os.stat(in_path).st_mtime_ns + 10 ** 9))
+    _new_run(monkeypatch)
+    assert convert.convert_file(str(out_dir), in_path, shared_geo_dir=str(geo_dir)) in (0, 3)
+    assert len(hashed_files) == 1
@@ -0,0 +1,54 @@
+# encoding: utf-8
+"""
+
+Tests for cutting the converted data down to a window (see the subset module).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import numpy
+from pyhdf.SD import SD, SDC
+
+from constants import *
+import convert
+from subset import window_from_bounding_box
+
+def _make_geolocation_file (file_path, lat_data, lon_data) :
+    file_object = SD(file_path, SDC.WRITE | SDC.CREATE | SDC.TRUNC)
+    for var_name, var_data, hdf_type in [(LAT_VAR_NAME, lat_data, SDC.FLOAT32), (LON_VAR_NAME, lon_data, SDC.FLOAT64)] :
+        var_sds = file_object.create(var_name, hdf_type, var_data.shape)
+        var_sds[:] = var_data
+        var_sds.endaccess()
+    file_object.end()
+
+def _expected_window (lat_data, lon_data, bbox) :
+    west, south, east, north = bbox
+    inside = (lat_data >= south) & (lat_data <= north) & (lon_data >= west) & (lon_data <= east)
+    rows, cols = numpy.flatnonzero(inside.any(axis=1)), numpy.flatnonzero(inside.any(axis=0))
+    return (int(rows[0]), int(rows[-1]) + 1), (int(cols[0]), int(cols[-1]) + 1)
+
+def test_window_with_different_geolocation_types (tmp_path) :
+    # longitude is stored in a larger type than latitude, so each would be read in different sized blocks
+    lines, elements = 200, 30
+    lat_data = numpy.repeat(numpy.linspace(60.0, -60.0, lines, dtype=numpy.float32)[:, None], elements, axis=1)
+    lon_data = numpy.repeat(numpy.linspace(-40.0, 40.0, lines)[:, None], elements, axis=1) \
+               + numpy.linspace(0.0, 10.0, elements)[None, :]
+    file_path = str(tmp_path / "geo.hdf")
+    _make_geolocation_file(file_path, lat_data, lon_data)
+
+    bbox = (5.0, -20.0, 12.0, 10.0)
+    in_file_info, in_file_obj = convert.read_hdf4_info(file_path)
+    window = window_from_bounding_box(in_file_obj, in_file_info, bbox, copy_buffer_size=elements * 8 * 16)
+    in_file_obj.end()
+    assert window == _expected_window(lat_data, lon_data, bbox)
+
+def test_window_of_synthetic_granule (make_granule, tmp_path) :
+    in_path = make_granule(lines=120, elements=60)
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    assert convert.convert_file(str(out_dir), in_path, line_range=(10, 50), element_range=(5, 25),
+                                copy_buffer_size=1024) == 0
+    from netCDF4 import Dataset
+    out_file = Dataset(convert.output_file_path(str(out_dir), in_path))
+    assert out_file.variables[LAT_VAR_NAME].shape == (40, 20)
+    out_file.close()
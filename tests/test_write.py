@@ -0,0 +1,65 @@
+# encoding: utf-8
+"""
+
+Tests for copying variable data to the output file in blocks (see write_netCDF4_file).
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import numpy
+from netCDF4 import Dataset
+from pyhdf.SD import SD, SDC
+
+from constants import *
+import convert
+import aggregate
+
+def _convert (in_path, out_dir, **convert_options) :
+    out_dir.mkdir()
+    assert convert.convert_file(str(out_dir), in_path, **convert_options) == 0
+    out_file = Dataset(convert.output_file_path(str(out_dir), in_path))
+    out_file.set_auto_maskandscale(False)
+    return out_file
+
+def test_small_blocks_match_whole_variables (make_granule, tmp_path) :
+    in_path    = make_granule(lines=300, elements=40)
+    whole_file = _convert(in_path, tmp_path / "whole", copy_buffer_size=0)
+    block_file = _convert(in_path, tmp_path / "blocks", copy_buffer_size=4096)
+    for var_name in whole_file.variables.keys() :
+        numpy.testing.assert_array_equal(block_file.variables[var_name][:], whole_file.variables[var_name][:])
+    whole_file.close()
+    block_file.close()
+
+def test_blocks_line_up_with_chunks () :
+    class FakeSDS (object) :
+        def __getitem__ (self, line_slice) :
+            return numpy.zeros((line_slice.stop - line_slice.start, 10), dtype=numpy.int16)
+    # 1000 lines of 20 bytes in a 3000 byte buffer is 150 lines a block, cut down to a multiple of 64
+    blocks = list(convert.read_variable_blocks(FakeSDS(), (1000, 10), 2, 3000, align_lines=64))
+    assert [start_line for start_line, _ in blocks] == list(range(0, 1000, 128))
+    assert sum(data.shape[0] for _, data in blocks) == 1000
+
+def _make_granule_with_empty_variable (file_path) :
+    file_object = SD(file_path, SDC.WRITE | SDC.CREATE | SDC.TRUNC)
+    setattr(file_object, IMAGE_DATE_ATTR_NAME, 115100)
+    setattr(file_object, IMAGE_TIME_ATTR_NAME, 120000)
+    lat_sds = file_object.create(LAT_VAR_NAME, SDC.FLOAT32, (4, 5))
+    lat_sds[:] = numpy.ones((4, 5), dtype=numpy.float32)
+    lat_sds.endaccess()
+    file_object.create("goes_planck", SDC.FLOAT32, (0, 16)).endaccess()
+    file_object.end()
+    return file_path
+
+def test_variables_without_data_are_written (tmp_path) :
+    in_path  = _make_granule_with_empty_variable(str(tmp_path / "empty.hdf"))
+    out_file = _convert(in_path, tmp_path / "out")
+    assert out_file.variables["goes_planck"].shape[0] == 0
+    assert out_file.variables["goes_planck"].dtype == numpy.float32
+    out_file.close()
+
+    out_dir = tmp_path / "aggregate"
+    out_dir.mkdir()
+    assert aggregate.aggregate_files(str(out_dir), [in_path]) == 0
+    out_file = Dataset(aggregate.aggregate_file_path(str(out_dir), in_path))
+    assert "goes_planck" in out_file.variables
+    out_file.close()
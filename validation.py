@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Checks of variable data against the valid ranges set by compliance_cleanup, with simple statistics.
+
+The statistics for a variable are built up one block at a time as the block is copied to the output
+file, so checking the data doesn't need another read of the input. Counts of fill values, NaNs and
+values outside the valid range are kept along with the actual minimum, maximum and mean of the data
+(not counting fill values or NaNs). Values are compared in the packed (stored) domain, the same as
+the valid range attributes.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import logging
+import numpy
+from constants import *
+
+LOG = logging.getLogger(__name__)
+
+# the names of the output attributes the statistics are saved in
+ACTUAL_RANGE_ATTR_NAME  = "actual_range"
+ACTUAL_MEAN_ATTR_NAME   = "actual_mean"
+FILL_COUNT_ATTR_NAME    = "fill_value_count"
+NAN_COUNT_ATTR_NAME     = "nan_count"
+OUT_OF_RANGE_ATTR_NAME  = "out_of_range_count"
+
+def valid_range_from_attributes (var_attrs) :
+    """
+    get the [valid min, valid max] for a variable from its attributes, with None for either limit if it isn't set
+    """
+
+    if VALID_RANGE_ATTR_NAME in var_attrs :
+        return [var_attrs[VALID_RANGE_ATTR_NAME][0], var_attrs[VALID_RANGE_ATTR_NAME][1]]
+
+    return [var_attrs.get(VALID_MIN_ATTR_NAME), var_attrs.get(VALID_MAX_ATTR_NAME)]
+
+class VariableStatistics (object) :
+    """
+    counts of fill, NaN and out of range values and the actual range and mean of one variable's data,
+    built up one block of data at a time
+    """
+
+    def __init__ (self, var_name, var_attrs) :
+        self.var_name     = var_name
+        self.fill_value   = var_attrs.get(FILL_VALUE_KEY)
+        self.valid_range  = valid_range_from_attributes(var_attrs)
+        self.total_count  = 0
+        self.fill_count   = 0
+        self.nan_count    = 0
+        self.out_of_range = 0
+        self.data_count   = 0 # the number of values that aren't fill or NaN
+        self.data_sum     = 0.0
+        self.data_min     = None
+        self.data_max     = None
+
+    def add_block (self, data) :
+        """
+        add the statistics for a block of the variable's data
+        """
+
+        data = numpy.asarray(data)
+        self.total_count += data.size
+
+        # find the values that are fill or NaN, if there could be any
+        ignore_mask = None
+        if self.fill_value is not None :
+            ignore_mask = data == self.fill_value
+            self.fill_count += int(numpy.count_nonzero(ignore_mask))
+        if data.dtype.kind == 'f' :
+            nan_mask = numpy.isnan(data)
+            self.nan_count += int(numpy.count_nonzero(nan_mask))
+            ignore_mask = nan_mask if ignore_mask is None else ignore_mask | nan_mask
+        values = data[~ignore_mask] if ignore_mask is not None else data.ravel()
+
+        if values.size <= 0 :
+            return
+
+        # check the values against the valid range
+        valid_min, valid_max = self.valid_range
+        if valid_min is not None and valid_max is not None :
+            self.out_of_range += int(numpy.count_nonzero((values < valid_min) | (values > valid_max)))
+        elif valid_min is not None :
+            self.out_of_range += int(numpy.count_nonzero(values < valid_min))
+        elif valid_max is not None :
+            self.out_of_range += int(numpy.count_nonzero(values > valid_max))
+
+        block_min = values.min()
+        block_max = values.max()
+        self.data_min    = block_min if self.data_min is None else min(self.data_min, block_min)
+        self.data_max    = block_max if self.data_max is None else max(self.data_max, block_max)
+        self.data_count += values.size
+        self.data_sum   += float(values.sum(dtype=numpy.float64))
+
+    def mean (self) :
+        return self.data_sum / self.data_count if self.data_count > 0 else None
+
+    def to_attributes (self) :
+        """
+        get the statistics as attributes for the output variable
+        """
+
+        attributes = {
+                        FILL_COUNT_ATTR_NAME:   self.fill_count,
+                        OUT_OF_RANGE_ATTR_NAME: self.out_of_range,
+                     }
+        if self.nan_count > 0 :
+            attributes[NAN_COUNT_ATTR_NAME] = self.nan_count
+        if self.data_count > 0 :
+            attributes[ACTUAL_RANGE_ATTR_NAME] = numpy.array([self.data_min, self.data_max])
+            attributes[ACTUAL_MEAN_ATTR_NAME]  = self.mean()
+
+        return attributes
+
+    def to_dict (self) :
+        return {
+                    "values":       self.total_count,
+                    "fill_values":  self.fill_count,
+                    "nans":         self.nan_count,
+                    "out_of_range": self.out_of_range,
+                    "min":          self.data_min.item() if self.data_min is not None else None,
+                    "max":          self.data_max.item() if self.data_max is not None else None,
+                    "mean":         self.mean(),
+               }
+
+    def warn_if_out_of_range (self) :
+        """
+        warn the user if any of the data (other than fill values) falls outside of the valid range
+        """
+
+        if self.out_of_range > 0 :
+            LOG.warn(str(self.out_of_range) + " of " + str(self.total_count) + " values of variable " + self.var_name
+                     + " fall outside of the valid range " + str(self.valid_range) + " and are not the fill value.")
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Routines to watch directories for new Geocat hdf4 granules and convert them as they arrive.
+
+The watch directories are polled for input files. A new file is only converted once it is
+complete: either its size and modification time have stopped changing for a settle time, or
+(if a ready suffix is given) a marker file with the same name plus that suffix exists. Files
+written under another name and renamed into place when done can use a settle time of 0.
+
+Complete files are handed to a pool of worker processes that lives as long as the watch does,
+so the interpreter and library startup is only paid once and each worker keeps its schema cache
+warm from one file to the next.
+
+Copyright (c) 2015 University of Wisconsin SSEC. All rights reserved.
+"""
+
+import os, logging, time, signal, multiprocessing
+from constants import *
+from manifest import ConversionManifest, conversion_options_hash
+from shards import in_shard
+from convert import iter_input_files, output_file_path, converter_build_version, _convert_file_in_worker
+
+LOG = logging.getLogger(__name__)
+
+def _file_state (file_path) :
+    """
+    get the (size, modification time) of a file, or None if it can't be read (for example, if it was removed)
+    """
+
+    try :
+        file_stat = os.stat(file_path)
+    except OSError :
+        return None
+
+    return file_stat.st_size, file_stat.st_mtime
+
+class ArrivalTracker (object) :
+    """
+    keeps track of the input files seen in the watch directories and decides when each new or changed
+    file is complete and ready to be converted; each version of a file is only reported as ready once
+    """
+
+    def __init__ (self, settle_time=DEFAULT_SETTLE_TIME, ready_suffix=None) :
+        self.settle_time  = settle_time
+        self.ready_suffix = ready_suffix
+        self.waiting      = { } # file path -> (state, time the file was first seen in that state)
+        self.handled      = { } # file path -> the state the file was in when it was reported as ready
+
+    def ready_files (self, file_paths, now=None) :
+        """
+        given the input files currently in the watch directories, list the ones that are now ready
+        """
+
+        now = time.time() if now is None else now
+        file_paths = set(file_paths)
+        ready = [ ]
+
+        for file_path in sorted(file_paths) :
+            state = _file_state(file_path)
+            if state is None or self.handled.get(file_path) == state :
+                continue
+
+            if self.ready_suffix is not None :
+                is_ready = os.path.exists(file_path + self.ready_suffix)
+            else :
+                # the file is complete once it has gone unchanged for the settle time
+                if file_path not in self.waiting or self.waiting[file_path][0] != state :
+                    self.waiting[file_path] = (state, now)
+                is_ready = now - self.waiting[file_path][1] >= self.settle_time
+
+            if is_ready :
+                self.waiting.pop(file_path, None)
+                self.handled[file_path] = state
+                ready.append(file_path)
+
+        # forget any files that have gone away, so they are picked up again if they come back
+        for tracked_paths in (self.waiting, self.handled) :
+            for file_path in list(tracked_paths.keys()) :
+                if file_path not in file_paths :
+                    del tracked_paths[file_path]
+
+        return ready
+
+def watch_directories (out_path, watch_dirs, jobs=1, manifest_path=None, use_hash=False,
+                       poll_interval=DEFAULT_POLL_INTERVAL, settle_time=DEFAULT_SETTLE_TIME, ready_suffix=None,
+                       shard=None, lock_outputs=False, max_polls=None, **convert_options) :
+    """convert Geocat output hdf4 files as they arrive in the watch directories
+
+    The directories (and their subdirectories) are checked every poll_interval seconds, and each
+    new or changed input file is converted once it is complete (see ArrivalTracker). Files already
+    in the directories when the watch starts are converted too, unless a manifest_path is given and
+    the manifest shows they are already up to date (see hdf4_2_netcdf4).
+
+    Up to jobs files are converted at the same time in a pool of worker processes that is kept for
+    the whole watch (0 or None will use one per cpu); with 1 job the files are converted in this
+    process between polls. The shard and lock_outputs options let several nodes watch the same
+    directories, see hdf4_2_netcdf4. Any other keyword arguments are passed on to convert_file for each file.
+
+    The watch runs until it is interrupted (or gets a SIGTERM), or for max_polls polls if that is
+    given; the conversions that are already running are finished before it returns.
+
+    Returns 0, since problems with individual files are logged as they are converted.
+    """
+
+    if not jobs :
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, jobs)
+
+    manifest = None
+    if manifest_path is not None :
+        manifest = ConversionManifest(manifest_path, converter_build_version(), use_hash=use_hash,
+                                      options_hash=conversion_options_hash(convert_options))
+
+    # stop cleanly on a SIGTERM as well as an interrupt
+    stop_requested = [False]
+    def _request_stop (signal_num, frame) :
+        stop_requested[0] = True
+    old_sigterm_handler = signal.signal(signal.SIGTERM, _request_stop)
+
+    worker_pool = None
+    if jobs > 1 :
+        LOG.info("Converting arriving files using " + str(jobs) + " worker processes.")
+        # the workers ignore interrupts, the watch itself stops them once their files are done
+        old_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        worker_pool = multiprocessing.Pool(processes=jobs)
+        signal.signal(signal.SIGINT, old_sigint_handler)
+
+    tracker   = ArrivalTracker(settle_time=settle_time, ready_suffix=ready_suffix)
+    in_flight = [ ] # (file path, time the file was ready, the pending conversion result)
+
+    def _finish_conversion (file_path, ready_time, file_code) :
+        LOG.info("Finished converting " + file_path + " with return code " + str(file_code)
+                 + " in " + "%.1f" % (time.time() - ready_time) + " seconds.")
+        # codes 0 and 3 (the old output was replaced) mean the file was converted
+        if manifest is not None and file_code in (0, 3) :
+            manifest.record(file_path, output_file_path(out_path, file_path))
+
+    def _collect_finished (wait=False) :
+        for file_path, ready_time, pending_result in list(in_flight) :
+            if wait or pending_result.ready() :
+                try :
+                    _, file_code, _ = pending_result.get()
+                except Exception as err :
+                    LOG.warn("Unable to convert file (" + file_path + "): " + str(err))
+                    file_code = 4
+                in_flight.remove((file_path, ready_time, pending_result))
+                _finish_conversion(file_path, ready_time, file_code)
+
+    LOG.info("Watching for new files in: " + ", ".join(watch_dirs))
+    poll_count = 0
+    try :
+        while not stop_requested[0] and (max_polls is None or poll_count < max_polls) :
+            poll_start = time.time()
+            poll_count += 1
+
+            found_files = iter_input_files(watch_dirs, INPUT_TYPES + COMPRESSED_INPUT_TYPES)
+            if shard is not None :
+                found_files = (file_path for file_path in found_files if in_shard(file_path, shard))
+
+            for file_path in tracker.ready_files(found_files, poll_start) :
+                if manifest is not None and manifest.is_current(file_path, output_file_path(out_path, file_path)) :
+                    LOG.debug("Skipping file that is already up to date: " + file_path)
+                    continue
+                LOG.info("New file is ready to convert: " + file_path)
+                worker_args = (out_path, file_path, False, convert_options, lock_outputs, None)
+                if worker_pool is None :
+                    _, file_code, _ = _convert_file_in_worker(worker_args)
+                    _finish_conversion(file_path, poll_start, file_code)
+                else :
+                    in_flight.append((file_path, poll_start, worker_pool.apply_async(_convert_file_in_worker, (worker_args,))))
+
+            _collect_finished()
+
+            # wait for the next poll, unless converting took longer than that already
+            time.sleep(max(0.0, poll_interval - (time.time() - poll_start)))
+    except KeyboardInterrupt :
+        LOG.info("Watch interrupted.")
+    finally :
+        LOG.info("Stopping the watch once " + str(len(in_flight)) + " running conversions are finished.")
+        if worker_pool is not None :
+            worker_pool.close()
+            _collect_finished(wait=True)
+            worker_pool.join()
+        signal.signal(signal.SIGTERM, old_sigterm_handler)
+
+    return 0